@@ -79,6 +79,42 @@ STATIC_URL = "/static/"
 STATIC_ROOT = BASE_DIR / "var" / "static"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "var" / "media"
+STORAGES = {
+    # Identical uploads are stored once and hardlinked into each client's bucket.
+    "default": {"BACKEND": env("MEDIA_STORAGE_BACKEND", default="domains.storage.ContentAddressableStorage")},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+RESUMABLE_UPLOAD_MAX_SIZE = env.int("RESUMABLE_UPLOAD_MAX_SIZE", default=5 * 1024 ** 3)
+RESUMABLE_UPLOAD_EXPIRE_AFTER = env.int("RESUMABLE_UPLOAD_EXPIRE_AFTER", default=24 * 60 * 60)
+FILE_MANAGER_PAGE_SIZE = env.int("FILE_MANAGER_PAGE_SIZE", default=50)
+ARCHIVE_IMPORT_BATCH_SIZE = env.int("ARCHIVE_IMPORT_BATCH_SIZE", default=100)
+ARCHIVE_IMPORT_CONCURRENCY = env.int("ARCHIVE_IMPORT_CONCURRENCY", default=4)
+ARCHIVE_IMPORT_STALE_AFTER = env.int("ARCHIVE_IMPORT_STALE_AFTER", default=30 * 60)
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 PGVECTOR_DISABLED = env.bool("PGVECTOR_DISABLED", default=False)
+EMBEDDING_BATCH_SIZE = env.int("EMBEDDING_BATCH_SIZE", default=256)
+EMBEDDING_PROVIDER = env("EMBEDDING_PROVIDER", default="contexts.embeddings.HashEmbeddingProvider")
+EMBEDDING_CACHE_URL = env("EMBEDDING_CACHE_URL", default=None)
+EMBEDDING_CACHE_MAX_ENTRIES = env.int("EMBEDDING_CACHE_MAX_ENTRIES", default=4096)
+EMBEDDING_CACHE_TTL = env.int("EMBEDDING_CACHE_TTL", default=7 * 24 * 3600)
+INGEST_SHARD_BYTES = env.int("INGEST_SHARD_BYTES", default=8 * 1024 * 1024)
+CHUNK_MAX_TOKENS = env.int("CHUNK_MAX_TOKENS", default=0) or None
+CHUNK_TOKEN_OVERLAP = env.int("CHUNK_TOKEN_OVERLAP", default=64)
+CHUNK_TOKEN_ENCODING = env("CHUNK_TOKEN_ENCODING", default="cl100k_base")
+LOCAL_VECTOR_INDEX = env.bool("LOCAL_VECTOR_INDEX", default=False)
+VECTOR_INDEX_ROOT = BASE_DIR / "var" / "vector_index"
+VECTOR_INDEX_NPROBE = env.int("VECTOR_INDEX_NPROBE", default=8)
+RETRIEVAL_EF_SEARCH = env.int("RETRIEVAL_EF_SEARCH", default=40)
+EMBEDDING_QUANTIZATION = env("EMBEDDING_QUANTIZATION", default="none")
+QUANTIZED_RERANK_FACTOR = env.int("QUANTIZED_RERANK_FACTOR", default=4)
+EMBEDDING_BLOB_DTYPE = env("EMBEDDING_BLOB_DTYPE", default="float32")
+RETRIEVAL_CACHE_ENABLED = env.bool("RETRIEVAL_CACHE_ENABLED", default=False)
+RETRIEVAL_CACHE_URL = env("RETRIEVAL_CACHE_URL", default=None)
+RETRIEVAL_CACHE_MAX_ENTRIES = env.int("RETRIEVAL_CACHE_MAX_ENTRIES", default=2048)
+RETRIEVAL_CACHE_TTL = env.int("RETRIEVAL_CACHE_TTL", default=3600)
+CHUNK_DEDUP_ENABLED = env.bool("CHUNK_DEDUP_ENABLED", default=True)
+CHUNK_DEDUP_THRESHOLD = env.float("CHUNK_DEDUP_THRESHOLD", default=0.8)
+RETRIEVAL_ITERATIVE_SCAN = env("RETRIEVAL_ITERATIVE_SCAN", default="")
+CHUNK_TEXT_STORAGE = env("CHUNK_TEXT_STORAGE", default="inline")
+CHUNK_MMAP_CACHE_SIZE = env.int("CHUNK_MMAP_CACHE_SIZE", default=32)
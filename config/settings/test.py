@@ -14,6 +14,7 @@ DATABASES = {
 
 MEDIA_ROOT = BASE_DIR / "tmp" / "media"
 STATIC_ROOT = BASE_DIR / "tmp" / "static"
+VECTOR_INDEX_ROOT = BASE_DIR / "tmp" / "vector_index"
 
 # Disable pgvector integrations when the extension is unavailable locally
 PGVECTOR_DISABLED = True
@@ -0,0 +1,307 @@
+"""
+In-process approximate nearest-neighbour search for deployments without pgvector.
+
+Each client gets an IVF-flat index directory: append-only files of chunk ids,
+inverted-list assignments and unit-normalized float32 vectors that are
+memory-mapped for search, k-means centroids, and a tombstone file for chunks
+that have since been deleted. Ingestion appends to the files incrementally;
+``rebuild`` retrains the centroids and compacts away tombstones.
+
+With ``EMBEDDING_QUANTIZATION = "int8"`` the index also keeps int8 codes and
+per-vector scales. The coarse pass scans the codes (a quarter of the bytes)
+and only the best candidates are re-scored from the float32 file.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from .quantization import int8_scores, quantization_mode, quantize_int8, rerank_candidates
+
+
+IDS_FILE = "ids.i64"
+LISTS_FILE = "lists.i32"
+VECTORS_FILE = "vectors.f32"
+CENTROIDS_FILE = "centroids.npy"
+TOMBSTONES_FILE = "deleted.i64"
+CODES_FILE = "codes.i8"
+SCALES_FILE = "scales.f32"
+ALL_FILES = (IDS_FILE, LISTS_FILE, VECTORS_FILE, TOMBSTONES_FILE, CENTROIDS_FILE, CODES_FILE, SCALES_FILE)
+
+DEFAULT_NPROBE = 8
+MIN_TRAIN_SIZE = 1024
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 64
+COMPACT_TOMBSTONE_RATIO = 0.5
+
+
+def local_index_enabled() -> bool:
+    return bool(getattr(settings, "PGVECTOR_DISABLED", False) and getattr(settings, "LOCAL_VECTOR_INDEX", False))
+
+
+def index_root() -> Path:
+    root = getattr(settings, "VECTOR_INDEX_ROOT", None)
+    return Path(root) if root else Path(settings.BASE_DIR) / "var" / "vector_index"
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _kmeans(vectors: np.ndarray, nlist: int, seed: int = 0) -> np.ndarray:
+    """Spherical k-means over a sample; centroids stay unit length so assignment is a dot product."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), nlist * KMEANS_SAMPLE_PER_LIST)
+    sample = vectors[rng.choice(len(vectors), size=sample_size, replace=False)]
+    centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        for index in range(nlist):
+            members = sample[assignment == index]
+            if len(members):
+                centroids[index] = members.sum(axis=0)
+        centroids = _normalize(centroids)
+    return centroids
+
+
+class _Arrays(NamedTuple):
+    ids: np.ndarray
+    lists: np.ndarray
+    vectors: np.ndarray
+    centroids: Optional[np.ndarray]
+    tombstones: np.ndarray
+    codes: Optional[np.ndarray]
+    scales: Optional[np.ndarray]
+
+
+class LocalVectorIndex:
+    """IVF-flat cosine index for one client, stored under ``VECTOR_INDEX_ROOT/<client slug>``."""
+
+    def __init__(self, path: Path, dimensions: int = 1536, nprobe: Optional[int] = None, quantization: Optional[str] = None):
+        self.path = Path(path)
+        self.dimensions = dimensions
+        self.nprobe = nprobe or getattr(settings, "VECTOR_INDEX_NPROBE", DEFAULT_NPROBE)
+        self.quantized = (quantization or quantization_mode()) == "int8"
+        self._cache_key: Optional[Tuple[int, ...]] = None
+        self._arrays: Optional[_Arrays] = None
+        self._read_lock = threading.Lock()
+
+    @classmethod
+    def for_client(cls, client) -> "LocalVectorIndex":
+        path = index_root() / client.slug
+        with _registry_lock:
+            index = _registry.get(path)
+            if index is None:
+                index = _registry[path] = cls(path)
+            return index
+
+    # -- writes -----------------------------------------------------------------------------
+
+    @contextmanager
+    def _write_lock(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / "lock", "a") as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def add(self, ids: Sequence[int], vectors: np.ndarray) -> None:
+        if not len(ids):
+            return
+        vectors = _normalize(np.asarray(vectors).reshape(len(ids), self.dimensions))
+        with self._write_lock():
+            centroids = self._load_centroids()
+            if centroids is None:
+                lists = np.zeros(len(ids), dtype=np.int32)
+            else:
+                lists = np.argmax(vectors @ centroids.T, axis=1).astype(np.int32)
+            # Ids are written first and vectors last; readers only trust rows present in all files.
+            self._append(IDS_FILE, np.asarray(ids, dtype=np.int64))
+            self._append(LISTS_FILE, lists)
+            self._append(VECTORS_FILE, vectors)
+            if self.quantized:
+                codes, scales = quantize_int8(vectors)
+                self._append(CODES_FILE, codes)
+                self._append(SCALES_FILE, scales)
+
+    def remove(self, ids: Sequence[int]) -> None:
+        if not len(ids):
+            return
+        with self._write_lock():
+            self._append(TOMBSTONES_FILE, np.asarray(ids, dtype=np.int64))
+        total, deleted = self._counts()
+        if total and deleted / total > COMPACT_TOMBSTONE_RATIO:
+            self.compact()
+
+    def apply(self, added_ids: Sequence[int], vectors: Optional[np.ndarray], removed_ids: Sequence[int]) -> None:
+        """Apply one ingestion run's changes; removals first so re-added ids are not masked."""
+        self.remove(removed_ids)
+        if vectors is not None:
+            self.add(added_ids, vectors)
+
+    def rebuild(self, rows: Iterable[Tuple[int, Sequence[float]]], nlist: Optional[int] = None) -> int:
+        """Replace the index with ``rows`` of ``(chunk_id, embedding)``, retraining centroids."""
+        ids: List[int] = []
+        vectors: List[np.ndarray] = []
+        for chunk_id, embedding in rows:
+            if embedding is None:
+                continue
+            ids.append(chunk_id)
+            vectors.append(np.asarray(embedding, dtype=np.float32))
+        matrix = _normalize(np.vstack(vectors)) if vectors else np.empty((0, self.dimensions), dtype=np.float32)
+        with self._write_lock():
+            self._write_fresh(np.asarray(ids, dtype=np.int64), matrix, nlist)
+        return len(ids)
+
+    def compact(self) -> int:
+        """Drop tombstoned rows and retrain; holds the write lock so concurrent appends are not lost."""
+        with self._write_lock():
+            arrays = self._open()
+            keep = ~np.isin(arrays.ids, arrays.tombstones)
+            self._write_fresh(np.array(arrays.ids[keep]), np.array(arrays.vectors[keep]), None)
+        return int(keep.sum())
+
+    def _write_fresh(self, ids: np.ndarray, vectors: np.ndarray, nlist: Optional[int]) -> None:
+        """Write a complete index next to the live one and swap files in; caller holds the write lock."""
+        centroids = None
+        if len(ids) >= MIN_TRAIN_SIZE:
+            nlist = nlist or int(np.clip(np.sqrt(len(ids)), 1, 4096))
+            centroids = _kmeans(vectors, nlist)
+            lists = np.argmax(vectors @ centroids.T, axis=1).astype(np.int32)
+        else:
+            lists = np.zeros(len(ids), dtype=np.int32)
+
+        staging = self.path.with_name(self.path.name + ".rebuild")
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+        ids.astype(np.int64).tofile(staging / IDS_FILE)
+        lists.tofile(staging / LISTS_FILE)
+        vectors.astype(np.float32).tofile(staging / VECTORS_FILE)
+        open(staging / TOMBSTONES_FILE, "wb").close()
+        if centroids is not None:
+            np.save(staging / CENTROIDS_FILE, centroids)
+        if self.quantized:
+            codes, scales = quantize_int8(vectors) if len(vectors) else (np.empty(0, np.int8), np.empty(0, np.float32))
+            codes.tofile(staging / CODES_FILE)
+            scales.tofile(staging / SCALES_FILE)
+        for name in ALL_FILES:
+            target = self.path / name
+            if (staging / name).exists():
+                os.replace(staging / name, target)
+            elif target.exists():
+                target.unlink()
+        shutil.rmtree(staging, ignore_errors=True)
+
+    def _append(self, name: str, values: np.ndarray) -> None:
+        with open(self.path / name, "ab") as handle:
+            handle.write(np.ascontiguousarray(values).tobytes())
+            handle.flush()
+            os.fsync(handle.fileno())
+
+    # -- reads ------------------------------------------------------------------------------
+
+    def _load_centroids(self) -> Optional[np.ndarray]:
+        path = self.path / CENTROIDS_FILE
+        return np.load(path) if path.exists() else None
+
+    def _memmap(self, name: str, dtype) -> np.ndarray:
+        path = self.path / name
+        if not path.exists() or path.stat().st_size == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def _open(self) -> _Arrays:
+        stats = []
+        for name in ALL_FILES:
+            path = self.path / name
+            stats.append(path.stat().st_mtime_ns if path.exists() else -1)
+            stats.append(path.stat().st_size if path.exists() else -1)
+        key = tuple(stats)
+        with self._read_lock:
+            if self._cache_key != key or self._arrays is None:
+                ids = self._memmap(IDS_FILE, np.int64)
+                lists = self._memmap(LISTS_FILE, np.int32)
+                vectors = self._memmap(VECTORS_FILE, np.float32)
+                rows = min(len(ids), len(lists), len(vectors) // self.dimensions)
+                vectors = vectors[: rows * self.dimensions].reshape(rows, self.dimensions)
+                codes = scales = None
+                if self.quantized:
+                    codes = self._memmap(CODES_FILE, np.int8)
+                    scales = self._memmap(SCALES_FILE, np.float32)
+                    # Codes written before int8 was enabled are missing; fall back until rebuilt.
+                    if len(codes) // self.dimensions < rows or len(scales) < rows:
+                        codes = scales = None
+                    else:
+                        codes = codes[: rows * self.dimensions].reshape(rows, self.dimensions)
+                        scales = scales[:rows]
+                tombstones = np.unique(self._memmap(TOMBSTONES_FILE, np.int64))
+                self._arrays = _Arrays(ids[:rows], lists[:rows], vectors, self._load_centroids(), tombstones, codes, scales)
+                self._cache_key = key
+            return self._arrays
+
+    def _counts(self) -> Tuple[int, int]:
+        arrays = self._open()
+        return len(arrays.ids), len(arrays.tombstones)
+
+    def __len__(self) -> int:
+        total, deleted = self._counts()
+        return max(total - deleted, 0)
+
+    def search(self, query: Sequence[float], k: int, min_score: Optional[float] = None, allowed: Optional[Sequence[int]] = None) -> List[Tuple[int, float]]:
+        """
+        Return up to ``k`` ``(chunk_id, cosine_similarity)`` pairs, best first. With ``allowed``,
+        only those chunk ids are scored, exhaustively, so the result is the exact top-k of the
+        filtered set rather than a post-filtered approximate one.
+        """
+        ids, lists, vectors, centroids, tombstones, codes, scales = self._open()
+        if not len(ids) or k <= 0:
+            return []
+        query = _normalize(np.asarray(query, dtype=np.float32).reshape(self.dimensions))
+
+        if allowed is not None:
+            candidates = np.flatnonzero(np.isin(ids, np.asarray(allowed, dtype=np.int64)))
+            codes = None
+        elif centroids is None:
+            candidates = np.arange(len(ids))
+        else:
+            nprobe = min(self.nprobe, len(centroids))
+            probe = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+            candidates = np.flatnonzero(np.isin(lists, probe))
+        if len(tombstones):
+            candidates = candidates[~np.isin(ids[candidates], tombstones)]
+        if not len(candidates):
+            return []
+
+        if codes is not None:
+            shortlist = rerank_candidates(k)
+            if len(candidates) > shortlist:
+                coarse = int8_scores(codes[candidates], scales[candidates], query)
+                candidates = candidates[np.argpartition(-coarse, shortlist - 1)[:shortlist]]
+        # Full-precision scores: exact for the flat path, the re-rank step for the int8 path.
+        scores = vectors[candidates] @ query
+        if min_score is not None:
+            keep = scores >= min_score
+            candidates, scores = candidates[keep], scores[keep]
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            candidates, scores = candidates[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return [(int(ids[candidates[position]]), float(scores[position])) for position in order]
+
+
+_registry: Dict[Path, LocalVectorIndex] = {}
+_registry_lock = threading.Lock()
@@ -2,3 +2,8 @@ from django.apps import AppConfig
 class ContextsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "contexts"
+
+    def ready(self):
+        super().ready()
+        # Import signal handlers so deleting a file invalidates cached retrieval results.
+        from . import signals  # noqa: F401
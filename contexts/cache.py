@@ -0,0 +1,336 @@
+"""
+Caches for the retrieval pipeline.
+
+Embeddings are content addressed: the key is the SHA-256 of the normalized
+chunk text plus the embedding model and dimension, so identical boilerplate
+uploaded by different tenants is only ever embedded once. Lookups go through
+a bounded in-process LRU first and an optional shared Valkey tier second.
+
+Retrieval results are cached the same way, keyed by client, a hash of the query
+embedding and the search parameters. Each key also embeds the client's corpus
+version, a counter that ingestion and chunk deletion bump, so a change to a
+client's chunks makes every earlier entry unreachable at once. Without a shared
+tier the counter is per process, so cross-process invalidation needs Valkey.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .embeddings import EmbeddingProvider, embeddings_enabled, generate_embeddings, get_embedding_provider
+
+try:  # Optional dependency; the cache degrades to the local tier without it.
+    import redis  # type: ignore
+except ImportError:  # pragma: no cover - exercised when redis-py unavailable.
+    redis = None
+
+
+DEFAULT_EMBEDDING_CACHE_ENTRIES = 4096
+DEFAULT_EMBEDDING_CACHE_TTL = 7 * 24 * 3600
+DEFAULT_RETRIEVAL_CACHE_ENTRIES = 2048
+DEFAULT_RETRIEVAL_CACHE_TTL = 3600
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form used for content addressing: NFC, collapsed whitespace, stripped."""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def embedding_cache_key(text: str, model: str, dimensions: int) -> str:
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"emb:{model}:{dimensions}:{digest}"
+
+
+class EmbeddingCache:
+    """Two-tier embedding cache: a size-bounded local LRU backed by an optional Valkey tier."""
+
+    def __init__(self, *, max_entries: int = DEFAULT_EMBEDDING_CACHE_ENTRIES, shared=None, ttl: int = DEFAULT_EMBEDDING_CACHE_TTL):
+        self.max_entries = max(int(max_entries), 0)
+        self.shared = shared
+        self.ttl = ttl
+        self._local: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.shared_errors = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "local_hits": self.local_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "shared_errors": self.shared_errors,
+            "size": len(self._local),
+        }
+
+    def get_many(self, keys: Iterable[str], dimensions: int) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        pending = []
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                vector = self._local.get(key)
+                if vector is None:
+                    pending.append(key)
+                    continue
+                self._local.move_to_end(key)
+                found[key] = vector
+                self.local_hits += 1
+
+        promoted: Dict[str, np.ndarray] = {}
+        if pending and self.shared is not None:
+            try:
+                payloads = self.shared.mget(pending)
+            except Exception:  # pragma: no cover - network failures fall back to recomputing.
+                self.shared_errors += 1
+                payloads = [None] * len(pending)
+            for key, payload in zip(pending, payloads):
+                if payload and len(payload) == dimensions * 4:
+                    promoted[key] = self._freeze(np.frombuffer(payload, dtype="<f4"))
+            self.shared_hits += len(promoted)
+            self._store_local(promoted)
+            found.update(promoted)
+
+        self.misses += len(pending) - len(promoted)
+        return found
+
+    def set_many(self, vectors: Dict[str, np.ndarray]) -> None:
+        if not vectors:
+            return
+        frozen = {key: self._freeze(vector) for key, vector in vectors.items()}
+        self._store_local(frozen)
+        if self.shared is None:
+            return
+        try:
+            pipeline = self.shared.pipeline(transaction=False)
+            for key, vector in frozen.items():
+                pipeline.set(key, vector.astype("<f4", copy=False).tobytes(), ex=self.ttl)
+            pipeline.execute()
+        except Exception:  # pragma: no cover - the shared tier is best effort.
+            self.shared_errors += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._local.clear()
+
+    @staticmethod
+    def _freeze(vector: np.ndarray) -> np.ndarray:
+        vector = np.array(vector, dtype=np.float32)
+        vector.setflags(write=False)
+        return vector
+
+    def _store_local(self, vectors: Dict[str, np.ndarray]) -> None:
+        if not self.max_entries:
+            return
+        with self._lock:
+            for key, vector in vectors.items():
+                self._local[key] = vector
+                self._local.move_to_end(key)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+                self.evictions += 1
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def _shared_client(url: Optional[str] = None):
+    url = url or getattr(settings, "EMBEDDING_CACHE_URL", None)
+    if not url or redis is None:
+        return None
+    return redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Return the process-wide embedding cache, building it from settings on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache(
+                max_entries=getattr(settings, "EMBEDDING_CACHE_MAX_ENTRIES", DEFAULT_EMBEDDING_CACHE_ENTRIES),
+                shared=_shared_client(),
+                ttl=getattr(settings, "EMBEDDING_CACHE_TTL", DEFAULT_EMBEDDING_CACHE_TTL),
+            )
+        return _cache
+
+
+def cached_embeddings(
+    texts: Sequence[str],
+    dimensions: int = 1536,
+    provider: Optional[EmbeddingProvider] = None,
+    cache: Optional[EmbeddingCache] = None,
+) -> Optional[np.ndarray]:
+    """
+    Cache-aware :func:`~contexts.embeddings.generate_embeddings`: only texts whose normalized
+    content has not been embedded with this model and dimension before reach the provider.
+    """
+    if not embeddings_enabled():
+        return None
+
+    provider = provider or get_embedding_provider()
+    cache = cache or get_embedding_cache()
+    keys = [embedding_cache_key(text, provider.model, dimensions) for text in texts]
+    found = cache.get_many(keys, dimensions)
+
+    missing: Dict[str, str] = {}
+    for key, text in zip(keys, texts):
+        if key not in found:
+            missing.setdefault(key, text)
+    if missing:
+        computed = generate_embeddings(list(missing.values()), dimensions=dimensions, provider=provider)
+        fresh = dict(zip(missing, computed))
+        cache.set_many(fresh)
+        found.update(fresh)
+
+    matrix = np.empty((len(keys), dimensions), dtype=np.float32)
+    for index, key in enumerate(keys):
+        matrix[index] = found[key]
+    return matrix
+
+
+def retrieval_cache_key(client_id: int, version: int, query_embedding, *, k: int, min_score: float, filters: Optional[Dict[str, Any]] = None, **options: Any) -> str:
+    """``options`` carries any other argument that changes the result (mode, ef_search, ...)."""
+    vector_digest = hashlib.sha256(np.asarray(query_embedding, dtype="<f4").tobytes()).hexdigest()
+    params = json.dumps({"k": k, "min_score": min_score, "filters": filters or {}, **options}, sort_keys=True, default=str)
+    params_digest = hashlib.sha256(params.encode("utf-8")).hexdigest()[:16]
+    return f"ret:{client_id}:{version}:{vector_digest}:{params_digest}"
+
+
+class RetrievalCache:
+    """
+    Top-k result cache with per-client corpus versions; same two tiers as :class:`EmbeddingCache`.
+    Without a shared backend the versions live in each process, so a bump from a worker never
+    reaches the web processes; local entries therefore also expire after ``ttl`` seconds.
+    """
+
+    def __init__(self, *, max_entries: int = DEFAULT_RETRIEVAL_CACHE_ENTRIES, shared=None, ttl: int = DEFAULT_RETRIEVAL_CACHE_TTL):
+        self.max_entries = max(int(max_entries), 0)
+        self.shared = shared
+        self.ttl = ttl
+        # key -> (monotonic expiry, rows)
+        self._local: OrderedDict[str, tuple] = OrderedDict()
+        self._versions: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.shared_errors = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "shared_errors": self.shared_errors,
+            "size": len(self._local),
+        }
+
+    def version(self, client_id: int) -> Optional[int]:
+        """Current corpus version of ``client_id``, or ``None`` when it cannot be read (skip the cache)."""
+        if self.shared is None:
+            with self._lock:
+                return self._versions.get(client_id, 0)
+        try:
+            return int(self.shared.get(f"retver:{client_id}") or 0)
+        except Exception:  # pragma: no cover - never serve results whose version is unknown.
+            self.shared_errors += 1
+            return None
+
+    def bump(self, client_id: int) -> None:
+        with self._lock:
+            self._versions[client_id] = self._versions.get(client_id, 0) + 1
+        if self.shared is None:
+            return
+        try:
+            self.shared.incr(f"retver:{client_id}")
+        except Exception:  # pragma: no cover - entries still expire after ttl.
+            self.shared_errors += 1
+
+    def get(self, key: str) -> Optional[list]:
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._local[key]
+                entry = None
+            if entry is not None:
+                self._local.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        if self.shared is not None:
+            try:
+                payload = self.shared.get(key)
+            except Exception:  # pragma: no cover - treated as a miss.
+                self.shared_errors += 1
+                payload = None
+            if payload:
+                rows = json.loads(payload)
+                self._store_local(key, rows)
+                self.hits += 1
+                return rows
+        self.misses += 1
+        return None
+
+    def set(self, key: str, rows: List[list]) -> None:
+        self._store_local(key, rows)
+        if self.shared is None:
+            return
+        try:
+            self.shared.set(key, json.dumps(rows), ex=self.ttl)
+        except Exception:  # pragma: no cover - the shared tier is best effort.
+            self.shared_errors += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._local.clear()
+
+    def _store_local(self, key: str, rows: list) -> None:
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._local[key] = (time.monotonic() + self.ttl, rows)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+                self.evictions += 1
+
+
+_retrieval_cache: Optional[RetrievalCache] = None
+
+
+def get_retrieval_cache() -> Optional[RetrievalCache]:
+    """Return the process-wide retrieval cache, or ``None`` unless ``RETRIEVAL_CACHE_ENABLED``."""
+    global _retrieval_cache
+    if not getattr(settings, "RETRIEVAL_CACHE_ENABLED", False):
+        return None
+    with _cache_lock:
+        if _retrieval_cache is None:
+            _retrieval_cache = RetrievalCache(
+                max_entries=getattr(settings, "RETRIEVAL_CACHE_MAX_ENTRIES", DEFAULT_RETRIEVAL_CACHE_ENTRIES),
+                shared=_shared_client(getattr(settings, "RETRIEVAL_CACHE_URL", None)),
+                ttl=getattr(settings, "RETRIEVAL_CACHE_TTL", DEFAULT_RETRIEVAL_CACHE_TTL),
+            )
+        return _retrieval_cache
+
+
+def invalidate_retrieval_cache(client_id: int) -> None:
+    """Bump ``client_id``'s corpus version once the current transaction commits."""
+    cache = get_retrieval_cache()
+    if cache is not None:
+        transaction.on_commit(lambda: cache.bump(client_id))
@@ -0,0 +1,127 @@
+"""
+Chunk text stored as byte offsets into the uploaded file.
+
+With ``CHUNK_TEXT_STORAGE = "offsets"`` ingestion stores ``byte_start``/``byte_end``
+and an empty ``text`` for chunks that are an exact UTF-8 slice of the upload,
+so the database no longer holds a second copy of every document. Text is read
+back through memory maps of the media files; a small LRU
+(``CHUNK_MMAP_CACHE_SIZE``) keeps recently used maps open, so serving the k
+results of a query costs a page-cache memcpy per chunk and no extra file opens.
+Chunks from the sentence chunker are not contiguous slices and always stay inline.
+"""
+
+from __future__ import annotations
+
+import mmap
+import os
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+from uploads.models import File
+
+from .models import DocumentChunk
+
+
+CHUNK_TEXT_STORAGE_MODES = ("inline", "offsets")
+DEFAULT_MMAP_CACHE_SIZE = 32
+
+
+def offsets_enabled() -> bool:
+    return getattr(settings, "CHUNK_TEXT_STORAGE", "inline") == "offsets"
+
+
+def media_path(field_file) -> Optional[str]:
+    """Local filesystem path of a stored file, or None for storages without one."""
+    try:
+        return field_file.storage.path(field_file.name)
+    except NotImplementedError:
+        return None
+
+
+class MappedFiles:
+    """LRU of read-only memory maps keyed by path; a map is reopened when the file changes on disk."""
+
+    def __init__(self, max_maps: int = DEFAULT_MMAP_CACHE_SIZE):
+        self.max_maps = max(int(max_maps), 1)
+        self._maps: "OrderedDict[str, Tuple[Tuple[int, int], mmap.mmap]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _map(self, path: str) -> Optional[mmap.mmap]:
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        entry = self._maps.get(path)
+        if entry is not None and entry[0] == signature:
+            self._maps.move_to_end(path)
+            return entry[1]
+        if entry is not None:
+            self._close(path)
+        if not stat.st_size:
+            return None
+        with open(path, "rb") as handle:
+            mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps[path] = (signature, mapped)
+        while len(self._maps) > self.max_maps:
+            self._close(next(iter(self._maps)))
+        return mapped
+
+    def _close(self, path: str) -> None:
+        _, mapped = self._maps.pop(path)
+        mapped.close()
+
+    def read(self, path: str, start: int, end: int) -> str:
+        # Reads hold the lock so an evicted map is never closed mid-slice.
+        with self._lock:
+            mapped = self._map(path)
+            payload = mapped[start:end] if mapped is not None else b""
+        return payload.decode("utf-8", errors="ignore")
+
+    def read_many(self, path: str, spans: Sequence[Tuple[int, int]]) -> list:
+        with self._lock:
+            mapped = self._map(path)
+            payloads = [mapped[start:end] if mapped is not None else b"" for start, end in spans]
+        return [payload.decode("utf-8", errors="ignore") for payload in payloads]
+
+    def clear(self) -> None:
+        with self._lock:
+            for path in list(self._maps):
+                self._close(path)
+
+    def __len__(self) -> int:
+        return len(self._maps)
+
+
+_mapped_files: Optional[MappedFiles] = None
+_mapped_files_lock = threading.Lock()
+
+
+def get_mapped_files() -> MappedFiles:
+    global _mapped_files
+    if _mapped_files is None:
+        with _mapped_files_lock:
+            if _mapped_files is None:
+                _mapped_files = MappedFiles(getattr(settings, "CHUNK_MMAP_CACHE_SIZE", DEFAULT_MMAP_CACHE_SIZE))
+    return _mapped_files
+
+
+def load_chunk_texts(chunk_ids: Iterable[int]) -> Dict[int, str]:
+    """Read the text of offset-stored chunks ``chunk_ids`` from their files; ids missing from the result have none."""
+    rows = DocumentChunk.objects.filter(pk__in=list(chunk_ids), byte_start__isnull=False).values_list("id", "file_id", "byte_start", "byte_end")
+    by_file: Dict[int, list] = defaultdict(list)
+    for chunk_id, file_id, start, end in rows:
+        by_file[file_id].append((chunk_id, start, end))
+    texts: Dict[int, str] = {}
+    maps = get_mapped_files()
+    for record in File.objects.filter(pk__in=list(by_file)).only("id", "file"):
+        path = media_path(record.file)
+        spans = by_file[record.pk]
+        if path is None:
+            continue
+        try:
+            values = maps.read_many(path, [(start, end) for _, start, end in spans])
+        except OSError:
+            continue
+        texts.update((chunk_id, value) for (chunk_id, _, _), value in zip(spans, values))
+    return texts
@@ -0,0 +1,159 @@
+"""
+Near-duplicate chunk detection with MinHash and LSH.
+
+Each chunk gets a MinHash signature over word 3-gram shingles; signatures are
+split into bands and every band is hashed into a bucket key stored in
+``ChunkBand`` per client, which is the LSH index. A new chunk sharing a bucket
+with an existing canonical chunk, and whose estimated Jaccard similarity clears
+``CHUNK_DEDUP_THRESHOLD``, is flagged with ``duplicate_of`` and skipped by
+retrieval. Signatures for a whole batch are computed in one set of NumPy
+operations.
+"""
+
+from __future__ import annotations
+
+import zlib
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from .cache import normalize_text
+from .models import ChunkBand, DocumentChunk
+
+
+DEFAULT_NUM_PERM = 64
+DEFAULT_BANDS = 8
+DEFAULT_DEDUP_THRESHOLD = 0.8
+SHINGLE_SIZE = 3
+_MASK = np.uint64(0xFFFFFFFF)
+# Fixed seed: stored signatures must stay comparable across processes and releases.
+_PERMUTATIONS = np.random.default_rng(20240601).integers(1, 1 << 32, size=(2, DEFAULT_NUM_PERM), dtype=np.uint64)
+_PERMUTATIONS[0] |= np.uint64(1)
+
+
+def dedup_enabled() -> bool:
+    return bool(getattr(settings, "CHUNK_DEDUP_ENABLED", True))
+
+
+def dedup_threshold() -> float:
+    return float(getattr(settings, "CHUNK_DEDUP_THRESHOLD", DEFAULT_DEDUP_THRESHOLD))
+
+
+def _shingles(text: str) -> np.ndarray:
+    tokens = normalize_text(text).lower().split() or [""]
+    hashes = np.fromiter((zlib.crc32(token.encode("utf-8")) for token in tokens), dtype=np.uint64, count=len(tokens))
+    if len(hashes) < SHINGLE_SIZE:
+        return hashes
+    return ((hashes[:-2] * np.uint64(0x9E3779B1)) ^ (hashes[1:-1] * np.uint64(0x85EBCA6B)) ^ hashes[2:]) & _MASK
+
+
+def minhash_signatures(texts: Sequence[str]) -> np.ndarray:
+    """Return a ``(len(texts), DEFAULT_NUM_PERM)`` uint32 matrix of MinHash signatures."""
+    if not texts:
+        return np.empty((0, DEFAULT_NUM_PERM), dtype=np.uint32)
+    shingles = [_shingles(text) for text in texts]
+    offsets = np.cumsum([0] + [len(row) for row in shingles[:-1]])
+    flat = np.concatenate(shingles)
+    # Universal hashing (a * x + b) mod 2**32 for every permutation and shingle at once.
+    hashed = (_PERMUTATIONS[0][:, None] * flat[None, :] + _PERMUTATIONS[1][:, None]) & _MASK
+    return np.minimum.reduceat(hashed, offsets, axis=1).T.astype(np.uint32)
+
+
+def band_keys(signatures: np.ndarray, bands: int = DEFAULT_BANDS) -> np.ndarray:
+    """Hash each band of each signature to a signed 64-bit bucket key, shape ``(rows, bands)``."""
+    rows = signatures.shape[1] // bands
+    grouped = signatures.reshape(len(signatures), bands, rows).astype(np.uint64)
+    keys = np.zeros((len(signatures), bands), dtype=np.uint64)
+    for column in range(rows):
+        keys = keys * np.uint64(0x100000001B3) ^ grouped[:, :, column]
+    keys ^= np.arange(bands, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    return keys.view(np.int64)
+
+
+def pack_signature(signature: np.ndarray) -> bytes:
+    return np.asarray(signature, dtype="<u4").tobytes()
+
+
+def unpack_signature(payload) -> np.ndarray:
+    return np.frombuffer(bytes(payload), dtype="<u4")
+
+
+def _similarity(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.mean(a == b))
+
+
+def find_duplicates(client_id: int, signatures: np.ndarray) -> Tuple[List[Optional[int]], List[Optional[int]]]:
+    """
+    For each signature return ``(existing, earlier)``: the canonical chunk id it duplicates,
+    or the index of an earlier canonical row in the same batch. At most one is set per row.
+    """
+    threshold = dedup_threshold()
+    keys = band_keys(signatures)
+    candidates: Dict[int, List[Tuple[int, np.ndarray]]] = defaultdict(list)
+    rows = ChunkBand.objects.filter(client_id=client_id, key__in=np.unique(keys).tolist()).values_list("key", "chunk_id", "chunk__minhash")
+    for key, chunk_id, payload in rows:
+        if payload is not None:
+            candidates[key].append((chunk_id, unpack_signature(payload)))
+
+    existing: List[Optional[int]] = [None] * len(signatures)
+    earlier: List[Optional[int]] = [None] * len(signatures)
+    batch_buckets: Dict[int, List[int]] = defaultdict(list)
+    for index, (signature, row_keys) in enumerate(zip(signatures, keys.tolist())):
+        best, best_score = None, threshold
+        for key in row_keys:
+            for chunk_id, other in candidates.get(key, ()):
+                score = _similarity(signature, other)
+                if score >= best_score:
+                    best, best_score = chunk_id, score
+        if best is not None:
+            existing[index] = best
+            continue
+        for key in row_keys:
+            for other_index in batch_buckets.get(key, ()):
+                score = _similarity(signature, signatures[other_index])
+                if score >= best_score:
+                    best, best_score = other_index, score
+        if best is not None:
+            earlier[index] = best
+            continue
+        for key in row_keys:
+            batch_buckets[key].append(index)
+    return existing, earlier
+
+
+def index_bands(client_id: int, chunks: Iterable[Tuple[int, np.ndarray]], *, batch_size: int = 1000) -> None:
+    """Add canonical chunks ``(chunk_id, signature)`` to the client's LSH buckets."""
+    chunks = list(chunks)
+    if not chunks:
+        return
+    keys = band_keys(np.stack([signature for _, signature in chunks]))
+    ChunkBand.objects.bulk_create(
+        (ChunkBand(client_id=client_id, key=key, chunk_id=chunk_id) for (chunk_id, _), row in zip(chunks, keys.tolist()) for key in row),
+        batch_size=batch_size,
+    )
+
+
+def promote_duplicates(client_id: int, removed_ids: Sequence[int]) -> List[int]:
+    """
+    Before canonical chunks ``removed_ids`` are deleted, make the oldest surviving duplicate of
+    each one canonical and repoint the rest at it. Returns the ids that became canonical.
+    """
+    rows = (
+        DocumentChunk.objects.filter(duplicate_of_id__in=removed_ids)
+        .exclude(pk__in=removed_ids)
+        .order_by("duplicate_of_id", "id")
+        .values_list("id", "duplicate_of_id", "minhash")
+    )
+    groups: Dict[int, List[Tuple[int, Optional[bytes]]]] = defaultdict(list)
+    for chunk_id, canonical_id, payload in rows:
+        groups[canonical_id].append((chunk_id, payload))
+    promoted = []
+    for members in groups.values():
+        head, _ = members[0]
+        DocumentChunk.objects.filter(pk=head).update(duplicate_of=None)
+        DocumentChunk.objects.filter(pk__in=[chunk_id for chunk_id, _ in members[1:]]).update(duplicate_of=head)
+        promoted.append(head)
+    index_bands(client_id, [(members[0][0], unpack_signature(members[0][1])) for members in groups.values() if members[0][1] is not None])
+    return promoted
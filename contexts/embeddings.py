@@ -1,31 +1,32 @@
 from __future__ import annotations
 
+import codecs
 import hashlib
-from typing import Iterable, List
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Sequence, Union
 
+import numpy as np
+import tiktoken
 from django.conf import settings
+from django.utils.module_loading import import_string
 
 
-def chunk_text(text: str, chunk_size: int = 600) -> Iterable[str]:
-    """
-    Yield chunks of text roughly `chunk_size` characters long, splitting on sentence boundaries
-    when available to preserve readability.
-    """
-    if not text:
-        return []
+DEFAULT_BLOCK_SIZE = 64 * 1024
+DEFAULT_EMBEDDING_PROVIDER = "contexts.embeddings.HashEmbeddingProvider"
+DEFAULT_TOKEN_ENCODING = "cl100k_base"
+_DIGEST_SIZE = hashlib.sha256().digest_size
+
 
-    segments: List[str] = []
-    buffer = []
+def _pack_sentences(sentences: Iterable[str], chunk_size: int) -> Iterator[str]:
+    """Greedily join sentences into segments of at most ``chunk_size`` characters."""
+    buffer: List[str] = []
     current_length = 0
 
-    for sentence in text.split("."):
-        sentence = sentence.strip()
-        if not sentence:
-            continue
-        sentence += "."
+    for sentence in sentences:
         sentence_len = len(sentence)
         if current_length + sentence_len > chunk_size and buffer:
-            segments.append(" ".join(buffer).strip())
+            yield " ".join(buffer).strip()
             buffer = [sentence]
             current_length = sentence_len
         else:
@@ -33,21 +34,247 @@ def chunk_text(text: str, chunk_size: int = 600) -> Iterable[str]:
             current_length += sentence_len
 
     if buffer:
-        segments.append(" ".join(buffer).strip())
-    return segments
+        yield " ".join(buffer).strip()
 
 
-def generate_embedding(text: str, dimensions: int = 1536):
+def _terminate(sentence: str) -> Optional[str]:
+    sentence = sentence.strip()
+    if not sentence:
+        return None
+    return sentence + "."
+
+
+def chunk_text(text: str, chunk_size: int = 600) -> Iterable[str]:
     """
-    Deterministic pseudo-embedding suitable for tests. Returns None when PGVECTOR is disabled.
+    Yield chunks of text roughly `chunk_size` characters long, splitting on sentence boundaries
+    when available to preserve readability.
     """
-    if getattr(settings, "PGVECTOR_DISABLED", False):
+    if not text:
+        return []
+
+    sentences = (_terminate(sentence) for sentence in text.split("."))
+    return list(_pack_sentences((sentence for sentence in sentences if sentence), chunk_size))
+
+
+def chunk_fingerprint(text: str) -> str:
+    """Stable identity of a segment, used to diff re-ingested files against stored chunks."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _stream_sentences(stream: BinaryIO, block_size: int, max_sentence: int) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    pending = ""
+    while True:
+        block = stream.read(block_size)
+        if isinstance(block, str):
+            block = block.encode("utf-8")
+        final = not block
+        # The incremental decoder holds back partial multi-byte sequences until the next block.
+        pending += decoder.decode(block or b"", final=final)
+        *complete, pending = pending.split(".")
+        for sentence in complete:
+            sentence = _terminate(sentence)
+            if sentence:
+                yield sentence
+        if final:
+            break
+        if len(pending) > max_sentence:
+            # A run of text with no full stop: cut at the last space so memory stays bounded.
+            cut = pending.rfind(" ", 0, max_sentence)
+            cut = cut if cut > 0 else max_sentence
+            head, pending = pending[:cut].strip(), pending[cut:]
+            if head:
+                yield head
+    sentence = _terminate(pending)
+    if sentence:
+        yield sentence
+
+
+def stream_chunks(stream: BinaryIO, chunk_size: int = 600, block_size: int = DEFAULT_BLOCK_SIZE) -> Iterator[str]:
+    """
+    Streaming counterpart of :func:`chunk_text` that reads ``stream`` in ``block_size`` byte
+    blocks and lazily yields the same segments without holding the whole document in memory.
+    Runs of text longer than ``max(block_size, chunk_size)`` without a full stop are cut at
+    whitespace so peak memory stays bounded.
+    """
+    return _pack_sentences(_stream_sentences(stream, block_size, max(block_size, chunk_size)), chunk_size)
+
+
+@dataclass(frozen=True)
+class TextChunk:
+    """
+    A token-budgeted chunk, its character offsets ``[start, end)`` in the source document and,
+    when known, the matching UTF-8 byte offsets ``[byte_start, byte_end)``.
+    """
+
+    text: str
+    start: int
+    end: int
+    token_count: int
+    byte_start: Optional[int] = None
+    byte_end: Optional[int] = None
+
+
+def _utf8_prefix_lengths(text: str) -> np.ndarray:
+    """``result[i]`` is the UTF-8 byte length of ``text[:i]``."""
+    code_points = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    widths = 1 + (code_points >= 0x80).astype(np.int64) + (code_points >= 0x800) + (code_points >= 0x10000)
+    prefix = np.zeros(len(code_points) + 1, dtype=np.int64)
+    np.cumsum(widths, out=prefix[1:])
+    return prefix
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = DEFAULT_TOKEN_ENCODING) -> tiktoken.Encoding:
+    """Return the tiktoken encoder for a model or encoding name, built once per process."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(model)
+
+
+def _last_break(text: str) -> int:
+    return max(text.rfind(" "), text.rfind("\n"))
+
+
+def stream_token_chunks(
+    stream: BinaryIO,
+    max_tokens: int = 512,
+    overlap: int = 64,
+    encoding: Union[str, tiktoken.Encoding, None] = None,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> Iterator[TextChunk]:
+    """
+    Yield chunks of at most ``max_tokens`` tokens, each sharing ``overlap`` tokens with the
+    previous one. Text is read and encoded one block at a time (cut at whitespace, a natural
+    pre-tokenizer boundary); only the unfinished tail of a block is encoded again with the
+    next one, so the document is never re-encoded per chunk.
+    """
+    if not isinstance(encoding, tiktoken.Encoding):
+        encoding = get_encoding(encoding or getattr(settings, "CHUNK_TOKEN_ENCODING", DEFAULT_TOKEN_ENCODING))
+    overlap = min(max(overlap, 0), max_tokens - 1)
+    stride = max_tokens - overlap
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    pending = ""
+    base = 0
+    byte_base = 0
+
+    while True:
+        block = stream.read(block_size)
+        if isinstance(block, str):
+            block = block.encode("utf-8")
+        final = not block
+        pending += decoder.decode(block or b"", final=final)
+        if not final and len(pending) < block_size:
+            continue
+
+        cut = len(pending) if final else _last_break(pending)
+        if cut <= 0:
+            cut = len(pending)
+        piece = pending[:cut]
+        tokens = encoding.encode_ordinary(piece)
+        _, offsets = encoding.decode_with_offsets(tokens)
+        byte_offsets = _utf8_prefix_lengths(piece)
+
+        start = 0
+        while start < len(tokens) and (final or len(tokens) - start > max_tokens):
+            end = min(start + max_tokens, len(tokens))
+            char_start = offsets[start]
+            char_end = offsets[end] if end < len(tokens) else len(piece)
+            text = piece[char_start:char_end]
+            if text.strip():
+                yield TextChunk(
+                    text=text,
+                    start=base + char_start,
+                    end=base + char_end,
+                    token_count=end - start,
+                    byte_start=byte_base + int(byte_offsets[char_start]),
+                    byte_end=byte_base + int(byte_offsets[char_end]),
+                )
+            if end == len(tokens):
+                start = end
+                break
+            start += stride
+
+        keep = offsets[start] if start < len(tokens) else len(piece)
+        pending = pending[keep:]
+        base += keep
+        byte_base += int(byte_offsets[keep])
+        if final:
+            return
+
+
+class EmbeddingProvider:
+    """
+    Interface for embedding backends. Subclasses implement :meth:`embed` for a single batch;
+    :func:`generate_embeddings` takes care of splitting input into ``batch_size`` batches.
+    """
+
+    model = "base"
+    batch_size = 256
+
+    def embed(self, texts: Sequence[str], dimensions: int) -> np.ndarray:
+        """Return a ``(len(texts), dimensions)`` float32 matrix for one batch of texts."""
+        raise NotImplementedError
+
+
+class HashEmbeddingProvider(EmbeddingProvider):
+    """Deterministic pseudo-embeddings built from a SHA-256 chain, suitable for tests."""
+
+    model = "sha256-hash"
+
+    def embed(self, texts: Sequence[str], dimensions: int) -> np.ndarray:
+        rounds = -(-dimensions // _DIGEST_SIZE)
+        digests = bytearray()
+        for text in texts:
+            current = hashlib.sha256(text.encode("utf-8")).digest()
+            for _ in range(rounds):
+                current = hashlib.sha256(current).digest()
+                digests += current
+        raw = np.frombuffer(bytes(digests), dtype=np.uint8).reshape(len(texts), rounds * _DIGEST_SIZE)
+        matrix = raw[:, :dimensions].astype(np.float32)
+        matrix /= np.float32(255.0)
+        matrix -= np.float32(0.5)
+        return matrix
+
+
+@lru_cache(maxsize=None)
+def _load_provider(path: str) -> EmbeddingProvider:
+    return import_string(path)()
+
+
+def get_embedding_provider() -> EmbeddingProvider:
+    """Return the provider configured by ``settings.EMBEDDING_PROVIDER``."""
+    return _load_provider(getattr(settings, "EMBEDDING_PROVIDER", DEFAULT_EMBEDDING_PROVIDER))
+
+
+def embeddings_enabled() -> bool:
+    """Embeddings are produced when pgvector is available or the local vector index replaces it."""
+    return not getattr(settings, "PGVECTOR_DISABLED", False) or bool(getattr(settings, "LOCAL_VECTOR_INDEX", False))
+
+
+def generate_embeddings(texts: Sequence[str], dimensions: int = 1536, provider: Optional[EmbeddingProvider] = None) -> Optional[np.ndarray]:
+    """
+    Embed ``texts`` in provider-sized batches and return a C-contiguous ``(n, dimensions)``
+    float32 matrix. Returns None when embeddings are disabled (see :func:`embeddings_enabled`).
+    """
+    if not embeddings_enabled():
         return None
 
-    seed = hashlib.sha256(text.encode("utf-8")).digest()
-    values: List[float] = []
-    current = seed
-    while len(values) < dimensions:
-        current = hashlib.sha256(current).digest()
-        values.extend(((byte / 255.0) - 0.5) for byte in current)
-    return values[:dimensions]
+    provider = provider or get_embedding_provider()
+    matrix = np.empty((len(texts), dimensions), dtype=np.float32)
+    step = max(provider.batch_size, 1)
+    for start in range(0, len(texts), step):
+        matrix[start:start + step] = provider.embed(texts[start:start + step], dimensions)
+    return matrix
+
+
+def generate_embedding(text: str, dimensions: int = 1536):
+    """
+    Single-text convenience wrapper around :func:`generate_embeddings`. Returns a list of floats,
+    or None when embeddings are disabled.
+    """
+    matrix = generate_embeddings([text], dimensions=dimensions)
+    if matrix is None:
+        return None
+    return matrix[0].tolist()
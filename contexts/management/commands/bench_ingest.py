@@ -0,0 +1,74 @@
+"""
+Ingestion throughput benchmark.
+
+Builds a synthetic document, ingests it once with the legacy row-by-row
+insert loop and once with the batched pipeline used by
+``contexts.tasks._chunk_and_embed``, and reports rows/sec for both. All
+benchmark objects are removed afterwards so the command is safe to run
+against a development database.
+"""
+
+from __future__ import annotations
+
+import time
+import uuid
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+
+from contexts.embeddings import chunk_text, generate_embedding
+from contexts.models import Category, DocumentChunk
+from contexts.tasks import _chunk_and_embed
+from domains.models import Client
+from uploads.models import File
+
+
+SENTENCE = "Clause {index} sets out the obligations of the parties under this agreement"
+
+
+def _legacy_rowwise_ingest(file: File, content: str, chunk_size: int) -> list[int]:
+    """Reference implementation of the original one-INSERT-per-chunk loop."""
+    DocumentChunk.objects.filter(file=file).delete()
+    created_ids = []
+    for segment in chunk_text(content, chunk_size=chunk_size):
+        chunk = DocumentChunk.objects.create(file=file, client=file.client, text=segment, embedding=generate_embedding(segment))
+        created_ids.append(chunk.id)
+    return created_ids
+
+
+class Command(BaseCommand):
+    help = "Benchmark chunk ingestion throughput (rows/sec) for row-wise vs batched inserts."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sentences", type=int, default=20_000, help="Number of sentences in the synthetic document.")
+        parser.add_argument("--chunk-size", type=int, default=600)
+        parser.add_argument("--batch-size", type=int, default=None)
+
+    def handle(self, *args, **options):
+        content = ". ".join(SENTENCE.format(index=index) for index in range(options["sentences"])) + "."
+        suffix = uuid.uuid4().hex[:8]
+        client = Client.objects.create(name=f"bench-ingest-{suffix}")
+        category = Category.objects.create(name=f"bench-ingest-{suffix}")
+        record = File.objects.create(client=client, file=ContentFile(content.encode("utf-8"), name="bench.txt"), category=category)
+        try:
+            started = time.perf_counter()
+            legacy_ids = _legacy_rowwise_ingest(record, content, options["chunk_size"])
+            legacy_elapsed = time.perf_counter() - started
+
+            started = time.perf_counter()
+            batched_ids = _chunk_and_embed(record.pk, chunk_size=options["chunk_size"], batch_size=options["batch_size"])
+            batched_elapsed = time.perf_counter() - started
+        finally:
+            record.file.delete(save=False)
+            record.delete()
+            category.delete()
+            client.delete()
+
+        self._report("row-wise", len(legacy_ids), legacy_elapsed)
+        self._report("batched", len(batched_ids), batched_elapsed)
+        if batched_elapsed and legacy_elapsed:
+            self.stdout.write(self.style.SUCCESS(f"speedup: {legacy_elapsed / batched_elapsed:.1f}x"))
+
+    def _report(self, label: str, rows: int, elapsed: float) -> None:
+        rate = rows / elapsed if elapsed else float("inf")
+        self.stdout.write(f"{label:>9}: {rows} rows in {elapsed:.3f}s ({rate:,.0f} rows/sec)")
@@ -0,0 +1,173 @@
+"""
+Retrieval latency and recall benchmark.
+
+Loads a synthetic corpus in which every chunk carries a unique invoice number
+and is embedded with the deterministic ``generate_embeddings``. The corpus can
+be grown in steps (``--chunks 1000 10000 100000``). At every size each
+available backend and quantization mode is measured:
+
+* ``vector`` issues noisy copies of stored embeddings; recall@k is the overlap
+  with the exact brute-force cosine top-k.
+* ``hybrid`` issues identifier-style queries ("status of INV-000123"); recall@k
+  is the fraction of queries whose target chunk is returned.
+
+Latency percentiles come from the backend call alone; the retrieval result cache
+is bypassed. Results are printed as JSON; benchmark objects are removed afterwards.
+"""
+
+from __future__ import annotations
+
+import json
+import random
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+
+from contexts.ann import LocalVectorIndex
+from contexts.embeddings import embeddings_enabled, generate_embeddings
+from contexts.models import Category, DocumentChunk
+from contexts.retrieval import BACKENDS, DEFAULT_CANDIDATE_FACTOR, DEFAULT_RRF_K, HYBRID_BACKENDS
+from domains.models import Client
+from uploads.models import File
+
+
+WORDS = "payment terms delivery schedule warranty liability renewal notice pricing discount".split()
+QUANTIZATIONS = {"local": ("none", "int8"), "pgvector": ("none", "halfvec")}
+QUERY_NOISE = 0.1
+
+
+def _chunk_text(index: int, rng: random.Random) -> str:
+    filler = " ".join(rng.choice(WORDS) for _ in range(24))
+    return f"Invoice INV-{index:06d} covers {filler}."
+
+
+def _percentiles(latencies) -> dict:
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99]) if latencies else (0.0, 0.0, 0.0)
+    return {"p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3)}
+
+
+def _unit(matrix: np.ndarray) -> np.ndarray:
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=-1, keepdims=True), 1e-12)
+
+
+class Command(BaseCommand):
+    help = "Benchmark retrieval latency and recall@k for every backend on a synthetic corpus."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunks", type=int, nargs="+", default=[5000], help="Corpus sizes to measure, grown in order.")
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--k", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--backend", action="append", dest="backends", choices=sorted(BACKENDS), help="Repeat to select several; defaults to all available.")
+
+    def handle(self, *args, **options):
+        if not embeddings_enabled():
+            raise CommandError("Embeddings are disabled; enable pgvector or LOCAL_VECTOR_INDEX.")
+        backends = options["backends"] or [backend for backend in sorted(BACKENDS) if self._available(backend)]
+        for backend in backends:
+            if not self._available(backend):
+                raise CommandError(f"Backend {backend!r} is not available on this database.")
+
+        rng = random.Random(options["seed"])
+        noise = np.random.default_rng(options["seed"])
+        suffix = uuid.uuid4().hex[:8]
+        client = Client.objects.create(name=f"bench-retrieval-{suffix}")
+        category = Category.objects.create(name=f"bench-retrieval-{suffix}")
+        record = File.objects.create(client=client, file=ContentFile(b"synthetic", name="bench.txt"), category=category)
+        results = []
+        ids = []
+        corpus = np.empty((0, DocumentChunk._meta.get_field("embedding").dimensions), dtype=np.float32)
+        try:
+            with tempfile.TemporaryDirectory() as index_root:
+                for size in sorted(options["chunks"]):
+                    new_ids, new_vectors = self._load_corpus(record, len(ids), size, rng)
+                    ids.extend(new_ids)
+                    corpus = np.vstack([corpus, new_vectors])
+                    workload = self._workload(ids, corpus, options["queries"], options["k"], rng, noise)
+                    for backend in backends:
+                        for quantization in QUANTIZATIONS[backend]:
+                            overrides = {"EMBEDDING_QUANTIZATION": quantization}
+                            if backend == "local":
+                                overrides.update(PGVECTOR_DISABLED=True, LOCAL_VECTOR_INDEX=True, VECTOR_INDEX_ROOT=Path(index_root) / f"{quantization}-{size}")
+                            else:
+                                overrides.update(PGVECTOR_DISABLED=False)
+                            with override_settings(**overrides):
+                                if backend == "local":
+                                    LocalVectorIndex.for_client(client).rebuild(zip(ids, corpus))
+                                for mode in ("vector", "hybrid"):
+                                    results.append({
+                                        "chunks": len(ids),
+                                        "backend": backend,
+                                        "quantization": quantization,
+                                        "mode": mode,
+                                        **self._run(mode, backend, client, workload, options["k"]),
+                                    })
+        finally:
+            record.file.delete(save=False)
+            record.delete()
+            category.delete()
+            client.delete()
+        report = {
+            "database": connection.vendor,
+            "queries": options["queries"],
+            "k": options["k"],
+            "seed": options["seed"],
+            "results": results,
+        }
+        self.stdout.write(json.dumps(report, indent=2))
+
+    @staticmethod
+    def _available(backend: str) -> bool:
+        # The local index only needs stored embeddings; pgvector needs the Postgres extension.
+        return backend == "local" or connection.vendor == "postgresql"
+
+    def _load_corpus(self, record, start, stop, rng):
+        texts = [_chunk_text(index, rng) for index in range(start, stop)]
+        if not texts:
+            return [], np.empty((0, DocumentChunk._meta.get_field("embedding").dimensions), dtype=np.float32)
+        embeddings = generate_embeddings(texts)
+        chunks = DocumentChunk.objects.bulk_create(
+            (DocumentChunk(file=record, client=record.client, text=text, embedding=embeddings[index]) for index, text in enumerate(texts)),
+            batch_size=500,
+        )
+        return [chunk.id for chunk in chunks], embeddings
+
+    @staticmethod
+    def _workload(ids, corpus, queries, k, rng, noise):
+        targets = rng.sample(range(len(ids)), min(queries, len(ids)))
+        vectors = corpus[targets] + noise.normal(scale=QUERY_NOISE, size=(len(targets), corpus.shape[1])).astype(np.float32)
+        exact = _unit(vectors) @ _unit(corpus).T
+        top = min(k, len(ids))
+        truth = np.argpartition(-exact, top - 1, axis=1)[:, :top] if top else np.empty((len(targets), 0), dtype=np.int64)
+        texts = [f"status of INV-{index:06d}" for index in targets]
+        return {
+            "vector": (vectors, [{ids[column] for column in row} for row in truth]),
+            "hybrid": (texts, generate_embeddings(texts), [ids[target] for target in targets]),
+        }
+
+    @staticmethod
+    def _run(mode, backend, client, workload, k):
+        latencies = []
+        recalls = []
+        if mode == "vector":
+            vectors, truths = workload["vector"]
+            for vector, truth in zip(vectors, truths):
+                started = time.perf_counter()
+                results = BACKENDS[backend](client, vector, k, 0.0, None)
+                latencies.append(time.perf_counter() - started)
+                recalls.append(len(truth & {result.id for result in results}) / len(truth) if truth else 1.0)
+        else:
+            texts, embeddings, targets = workload["hybrid"]
+            for text, embedding, target in zip(texts, embeddings, targets):
+                started = time.perf_counter()
+                results = HYBRID_BACKENDS[backend](client, text, embedding, k, 0.0, k * DEFAULT_CANDIDATE_FACTOR, DEFAULT_RRF_K, None)
+                latencies.append(time.perf_counter() - started)
+                recalls.append(float(target in {result.id for result in results}))
+        return {f"recall@{k}": round(float(np.mean(recalls)), 4) if recalls else 0.0, **_percentiles(latencies)}
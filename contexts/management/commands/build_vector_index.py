@@ -0,0 +1,41 @@
+"""
+Rebuild the in-process vector index used when pgvector is disabled.
+
+Ingestion keeps each client's index current incrementally; this command is for
+first-time setup, after bulk imports, or to retrain centroids and drop
+tombstones once a corpus has changed substantially.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contexts.ann import LocalVectorIndex
+from contexts.models import DocumentChunk
+from domains.models import Client
+
+
+class Command(BaseCommand):
+    help = "Rebuild per-client local ANN indexes from stored DocumentChunk embeddings."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--client", action="append", dest="clients", default=[], help="Client slug; repeat to select several.")
+        parser.add_argument("--nlist", type=int, default=None, help="Number of inverted lists (defaults to sqrt(rows)).")
+
+    def handle(self, *args, **options):
+        clients = Client.objects.order_by("slug")
+        if options["clients"]:
+            clients = clients.filter(slug__in=options["clients"])
+            if not clients.exists():
+                raise CommandError("No matching clients.")
+
+        for client in clients:
+            rows = (
+                DocumentChunk.objects.filter(client=client, embedding__isnull=False, duplicate_of__isnull=True)
+                .order_by("id")
+                .with_numpy_embeddings()
+                .values_list("id", "embedding_array")
+                .iterator(chunk_size=2000)
+            )
+            count = LocalVectorIndex.for_client(client).rebuild(rows, nlist=options["nlist"])
+            self.stdout.write(f"{client.slug}: indexed {count} chunks")
+
+        self.stdout.write(self.style.SUCCESS("Vector indexes rebuilt."))
@@ -0,0 +1,103 @@
+"""
+Storage and recall report for quantized embeddings.
+
+Loads stored embeddings (optionally for one client), uses a sample of them,
+slightly perturbed, as queries, and compares each compact representation's
+top-k against exact float32 search, both for the coarse pass alone and after
+re-ranking the shortlist at full precision. Prints JSON.
+
+Per-mode ``estimated_*`` sizes count vector components only. On PostgreSQL the
+report also measures what is actually on disk: the chunk table (with TOAST,
+where the float32 vectors live) and each of its indexes, so the saving from the
+halfvec HNSW index can be read off the index sizes.
+"""
+
+from __future__ import annotations
+
+import json
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from contexts.models import DocumentChunk
+from contexts.quantization import bytes_per_vector, dequantize_int8, quantize_int8
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+
+
+def _recall(found: np.ndarray, truth: np.ndarray) -> float:
+    return float(np.mean([len(set(row) & set(expected)) / len(expected) for row, expected in zip(found, truth)]))
+
+
+def _rerank(shortlist: np.ndarray, exact: np.ndarray, k: int) -> np.ndarray:
+    rescored = np.take_along_axis(exact, shortlist, axis=1)
+    order = np.argsort(-rescored, axis=1)[:, :k]
+    return np.take_along_axis(shortlist, order, axis=1)
+
+
+def _measured_sizes():
+    """On-disk bytes of the chunk table and each of its indexes; ``None`` off PostgreSQL."""
+    if connection.vendor != "postgresql":
+        return None
+    table = DocumentChunk._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_table_size(%s::regclass), pg_indexes_size(%s::regclass)", [table, table])
+        table_bytes, indexes_bytes = cursor.fetchone()
+        cursor.execute(
+            "SELECT indexrelid::regclass::text, pg_relation_size(indexrelid) FROM pg_index WHERE indrelid = %s::regclass ORDER BY 2 DESC",
+            [table],
+        )
+        indexes = dict(cursor.fetchall())
+    return {"table_bytes": table_bytes, "indexes_bytes": indexes_bytes, "indexes": indexes}
+
+
+class Command(BaseCommand):
+    help = "Report storage saved and recall lost by halfvec and int8 embedding quantization."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--client", help="Limit to one client slug.")
+        parser.add_argument("--limit", type=int, default=20_000, help="Maximum chunks to load.")
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument("--rerank-factor", type=int, default=4)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        chunks = DocumentChunk.objects.filter(embedding__isnull=False).order_by("id")
+        if options["client"]:
+            chunks = chunks.filter(client__slug=options["client"])
+        _, corpus = chunks[: options["limit"]].embedding_matrix()
+        k = options["k"]
+        if len(corpus) <= k:
+            raise CommandError(f"Need more than k={k} embedded chunks; found {len(corpus)}.")
+
+        corpus = corpus / np.maximum(np.linalg.norm(corpus, axis=1, keepdims=True), 1e-12)
+        rng = np.random.default_rng(options["seed"])
+        picks = rng.choice(len(corpus), size=min(options["queries"], len(corpus)), replace=False)
+        queries = corpus[picks] + rng.normal(scale=0.01, size=(len(picks), corpus.shape[1])).astype(np.float32)
+
+        exact = queries @ corpus.T
+        truth = _top_k(exact, k)
+        shortlist = min(k * options["rerank_factor"], len(corpus))
+
+        half_scores = (queries.astype(np.float16) @ corpus.astype(np.float16).T).astype(np.float32)
+        codes, scales = quantize_int8(corpus)
+        int8_scores = queries @ dequantize_int8(codes, scales).T
+
+        dimensions = corpus.shape[1]
+        baseline = bytes_per_vector(dimensions, "none")
+        report = {"chunks": len(corpus), "queries": len(picks), "k": k, "rerank_candidates": shortlist, "measured": _measured_sizes(), "modes": {}}
+        for mode, scores in (("halfvec", half_scores), ("int8", int8_scores)):
+            per_vector = bytes_per_vector(dimensions, mode)
+            report["modes"][mode] = {
+                "estimated_bytes_per_vector": per_vector,
+                "estimated_saved_pct": round(100 * (1 - per_vector / baseline), 1),
+                "estimated_saved_bytes": (baseline - per_vector) * len(corpus),
+                f"recall@{k}_coarse": round(_recall(_top_k(scores, k), truth), 4),
+                f"recall@{k}_reranked": round(_recall(_rerank(_top_k(scores, shortlist), exact, k), truth), 4),
+            }
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,161 @@
+"""
+Re-embed stored chunks, e.g. after changing the embedding model.
+
+Chunks are streamed in id order (a server-side cursor on Postgres), embedded
+in batches by a process pool and written back with ``bulk_update``. After
+every batch that has been written, the last chunk id goes to a JSON checkpoint,
+so an interrupted run resumes where it stopped when started again with the
+same filters. Local vector indexes of affected clients are rebuilt at the end.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from contexts.ann import local_index_enabled
+from contexts.cache import get_retrieval_cache
+from contexts.chunk_store import load_chunk_texts
+from contexts.embeddings import DEFAULT_EMBEDDING_PROVIDER, _load_provider, embeddings_enabled, generate_embeddings
+from contexts.models import DocumentChunk
+from domains.models import Client
+
+
+def _init_worker() -> None:
+    import django
+
+    django.setup()
+
+
+def _embed_batch(provider_path: str, dimensions: int, ids: Sequence[int], texts: Sequence[str]) -> Tuple[Sequence[int], np.ndarray]:
+    return ids, generate_embeddings(list(texts), dimensions=dimensions, provider=_load_provider(provider_path))
+
+
+class Command(BaseCommand):
+    help = "Re-embed DocumentChunk rows in parallel batches with a resumable checkpoint."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--client", action="append", dest="clients", default=[], help="Client slug; repeat to select several.")
+        parser.add_argument("--category", action="append", dest="categories", default=[], help="Category slug; repeat to select several.")
+        parser.add_argument("--provider", default=None, help="Dotted path of the embedding provider (defaults to EMBEDDING_PROVIDER).")
+        parser.add_argument("--batch-size", type=int, default=256)
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Embedding processes; 1 embeds in-process.")
+        parser.add_argument("--checkpoint", default=None, help="Checkpoint file (defaults to var/reembed-<model>.json).")
+        parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint.")
+        parser.add_argument("--dry-run", action="store_true", help="Report what would be re-embedded without writing.")
+
+    def handle(self, *args, **options):
+        if not embeddings_enabled():
+            raise CommandError("Embeddings are disabled; enable pgvector or LOCAL_VECTOR_INDEX.")
+        provider_path = options["provider"] or getattr(settings, "EMBEDDING_PROVIDER", DEFAULT_EMBEDDING_PROVIDER)
+        provider = _load_provider(provider_path)
+        dimensions = DocumentChunk._meta.get_field("embedding").dimensions
+        filters = {"clients": sorted(options["clients"]), "categories": sorted(options["categories"]), "model": provider.model}
+        checkpoint = Path(options["checkpoint"] or Path(settings.BASE_DIR) / "var" / f"reembed-{provider.model}.json")
+
+        chunks = DocumentChunk.objects.all()
+        if options["clients"]:
+            chunks = chunks.filter(client__slug__in=options["clients"])
+        if options["categories"]:
+            chunks = chunks.filter(file__category__slug__in=options["categories"])
+        last_id = 0 if options["restart"] else self._resume(checkpoint, filters)
+        pending = chunks.filter(pk__gt=last_id)
+
+        if options["dry_run"]:
+            count = pending.count()
+            self.stdout.write(f"Would re-embed {count} chunks with {provider.model} ({dimensions} dims), resuming after id {last_id}.")
+            return
+
+        started = time.perf_counter()
+        done = 0
+        batch_size = max(options["batch_size"], 1)
+        rows = pending.order_by("id").values_list("id", "text").iterator(chunk_size=batch_size * 4)
+        for ids, matrix in self._embed(rows, provider_path, dimensions, batch_size, options["workers"]):
+            DocumentChunk.objects.bulk_update(
+                [DocumentChunk(pk=chunk_id, embedding=matrix[index]) for index, chunk_id in enumerate(ids)],
+                ["embedding"],
+                batch_size=batch_size,
+            )
+            done += len(ids)
+            self._save(checkpoint, filters, ids[-1], done)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"{done} chunks re-embedded, {done / elapsed:.1f} rows/sec")
+
+        elapsed = time.perf_counter() - started
+        self._refresh(chunks)
+        checkpoint.unlink(missing_ok=True)
+        self.stdout.write(self.style.SUCCESS(f"Re-embedded {done} chunks in {elapsed:.1f}s ({done / elapsed if elapsed else 0.0:.1f} rows/sec)."))
+
+    def _embed(self, rows, provider_path: str, dimensions: int, batch_size: int, workers: int):
+        """Yield ``(ids, matrix)`` per batch in id order, keeping the pool at most two batches per worker ahead."""
+        batches = self._batches(rows, batch_size)
+        if workers <= 1:
+            for ids, texts in batches:
+                yield _embed_batch(provider_path, dimensions, ids, texts)
+            return
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            in_flight = deque()
+            for ids, texts in batches:
+                in_flight.append(pool.submit(_embed_batch, provider_path, dimensions, ids, texts))
+                if len(in_flight) >= workers * 2:
+                    yield in_flight.popleft().result()
+            while in_flight:
+                yield in_flight.popleft().result()
+
+    @classmethod
+    def _batches(cls, rows, batch_size: int):
+        ids: List[int] = []
+        texts: List[str] = []
+        for chunk_id, text in rows:
+            ids.append(chunk_id)
+            texts.append(text)
+            if len(ids) >= batch_size:
+                yield ids, cls._with_texts(ids, texts)
+                ids, texts = [], []
+        if ids:
+            yield ids, cls._with_texts(ids, texts)
+
+    @staticmethod
+    def _with_texts(ids: List[int], texts: List[str]) -> List[str]:
+        # Offset-stored chunks keep an empty text column; read them from the uploaded file.
+        missing = [chunk_id for chunk_id, text in zip(ids, texts) if not text]
+        if not missing:
+            return texts
+        stored = load_chunk_texts(missing)
+        return [stored.get(chunk_id, text) if not text else text for chunk_id, text in zip(ids, texts)]
+
+    @staticmethod
+    def _resume(checkpoint: Path, filters: dict) -> int:
+        try:
+            state = json.loads(checkpoint.read_text())
+        except (FileNotFoundError, ValueError):
+            return 0
+        # A checkpoint from a run with different filters or model does not apply.
+        return int(state.get("last_id", 0)) if state.get("filters") == filters else 0
+
+    @staticmethod
+    def _save(checkpoint: Path, filters: dict, last_id: int, done: int) -> None:
+        checkpoint.parent.mkdir(parents=True, exist_ok=True)
+        staging = checkpoint.with_suffix(".tmp")
+        staging.write_text(json.dumps({"filters": filters, "last_id": last_id, "done": done}))
+        os.replace(staging, checkpoint)
+
+    def _refresh(self, chunks) -> None:
+        client_ids = set(chunks.values_list("client_id", flat=True).distinct())
+        cache = get_retrieval_cache()
+        if cache is not None:
+            for client_id in client_ids:
+                cache.bump(client_id)
+        if local_index_enabled() and client_ids:
+            slugs = list(Client.objects.filter(pk__in=client_ids).values_list("slug", flat=True))
+            call_command("build_vector_index", client=slugs, stdout=self.stdout)
@@ -0,0 +1,53 @@
+"""
+Give large tenants a dedicated partial HNSW index.
+
+Select clients explicitly with ``--client`` or by size with ``--min-chunks``;
+``--drop`` removes their dedicated indexes again and ``--list`` shows what
+exists. Indexes are built with CREATE INDEX CONCURRENTLY so ingestion stays
+writable. Postgres only.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+
+from contexts.partitions import create_tenant_index_sql, drop_tenant_index_sql, tenant_indexes
+from domains.models import Client
+
+
+class Command(BaseCommand):
+    help = "Create or drop per-client partial HNSW indexes on DocumentChunk."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--client", action="append", dest="clients", default=[], help="Client slug; repeat to select several.")
+        parser.add_argument("--min-chunks", type=int, default=None, help="Select every client with at least this many chunks.")
+        parser.add_argument("--drop", action="store_true", help="Drop the selected clients' dedicated indexes.")
+        parser.add_argument("--list", action="store_true", help="List existing dedicated indexes and exit.")
+        parser.add_argument("--dry-run", action="store_true", help="Print the SQL without running it.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Tenant vector indexes require PostgreSQL with pgvector.")
+        if options["list"]:
+            for client_id, definition in sorted(tenant_indexes().items()):
+                self.stdout.write(f"{client_id}: {definition}")
+            return
+
+        clients = Client.objects.order_by("slug")
+        if options["clients"]:
+            clients = clients.filter(slug__in=options["clients"])
+        elif options["min_chunks"] is not None:
+            clients = clients.annotate(chunk_count=Count("document_chunks")).filter(chunk_count__gte=options["min_chunks"])
+        else:
+            raise CommandError("Pass --client or --min-chunks.")
+        if not clients.exists():
+            raise CommandError("No matching clients.")
+
+        for client in clients:
+            sql = drop_tenant_index_sql(client.pk) if options["drop"] else create_tenant_index_sql(client.pk)
+            if options["dry_run"]:
+                self.stdout.write(sql)
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute(sql)
+            self.stdout.write(f"{client.slug}: {'dropped' if options['drop'] else 'indexed'}")
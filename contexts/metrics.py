@@ -0,0 +1,75 @@
+"""
+Lightweight in-process metrics for the retrieval pipeline.
+
+Samples are kept in bounded windows per metric name so percentiles reflect
+recent traffic; counters are plain monotonically increasing integers. Every
+timing is also emitted on the ``contexts.metrics`` logger at DEBUG level so a
+log shipper can aggregate across processes.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW = 2048
+
+
+class MetricsRecorder:
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=self.window))
+        self._counts: Dict[str, int] = defaultdict(int)
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float, **fields: Any) -> None:
+        with self._lock:
+            self._samples[name].append(seconds)
+            self._counts[name] += 1
+        logger.debug("%s took %.2fms %s", name, seconds * 1000, fields)
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    @contextmanager
+    def timer(self, name: str, **fields: Any) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **fields)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            timings = {}
+            for name, samples in self._samples.items():
+                values = np.fromiter(samples, dtype=np.float64) * 1000
+                p50, p95, p99 = np.percentile(values, [50, 95, 99]) if len(values) else (0.0, 0.0, 0.0)
+                timings[name] = {
+                    "count": self._counts[name],
+                    "last_ms": float(values[-1]) if len(values) else 0.0,
+                    "p50_ms": float(p50),
+                    "p95_ms": float(p95),
+                    "p99_ms": float(p99),
+                }
+            return {"timings": timings, "counters": dict(self._counters)}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+            self._counters.clear()
+
+
+retrieval_metrics = MetricsRecorder()
@@ -0,0 +1,35 @@
+from django.db import migrations
+
+
+INDEX_NAME = "contexts_chunk_embedding_hnsw"
+
+
+def create_hnsw_index(apps, schema_editor):
+    # HNSW is a pgvector access method; other backends (SQLite edge installs) use contexts.ann.
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX_NAME} ON contexts_documentchunk "
+        "USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)"
+    )
+
+
+def drop_hnsw_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME}")
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction; building it concurrently keeps
+    # ingestion writable while the graph is built on large tables.
+    atomic = False
+
+    dependencies = [
+        ('contexts', '0005_documentchunk_offsets'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_hnsw_index, drop_hnsw_index),
+    ]
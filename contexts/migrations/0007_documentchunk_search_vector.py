@@ -0,0 +1,39 @@
+from django.db import migrations
+
+
+INDEX_NAME = "contexts_chunk_search_vector_gin"
+
+
+def add_search_vector(apps, schema_editor):
+    # Full-text search is Postgres-only; the local backend falls back to term matching.
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    # The 'simple' configuration skips stemming and stop words so identifiers such as
+    # invoice numbers and SKUs are indexed verbatim.
+    schema_editor.execute(
+        "ALTER TABLE contexts_documentchunk ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('simple', text)) STORED"
+    )
+    schema_editor.execute(
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX_NAME} ON contexts_documentchunk USING gin (search_vector)"
+    )
+
+
+def drop_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME}")
+    schema_editor.execute("ALTER TABLE contexts_documentchunk DROP COLUMN IF EXISTS search_vector")
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('contexts', '0006_documentchunk_embedding_hnsw'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_vector, drop_search_vector),
+    ]
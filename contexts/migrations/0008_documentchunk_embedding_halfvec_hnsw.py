@@ -0,0 +1,36 @@
+from django.db import migrations
+
+
+INDEX_NAME = "contexts_chunk_embedding_halfvec_hnsw"
+
+
+def create_halfvec_index(apps, schema_editor):
+    # Expression index over the existing float32 column: existing rows are indexed as-is and no
+    # backfill is needed. Only the graph is half precision; the float32 column stays for the
+    # re-rank, so the table is not smaller. Once EMBEDDING_QUANTIZATION = "halfvec" is live, the
+    # float32 index from 0006 can be dropped, which is where the space is actually saved.
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX_NAME} ON contexts_documentchunk "
+        "USING hnsw ((embedding::halfvec(1536)) halfvec_cosine_ops) WITH (m = 16, ef_construction = 64)"
+    )
+
+
+def drop_halfvec_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME}")
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('contexts', '0007_documentchunk_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_halfvec_index, drop_halfvec_index),
+    ]
@@ -0,0 +1,72 @@
+import struct
+
+import numpy as np
+from django.db import migrations
+
+
+BATCH_SIZE = 500
+# Frozen copy of the blob layout at the time of this migration, so it never follows later
+# model changes: a little-endian (dimensions, dtype code) header, then float32 components.
+BLOB_HEADER = struct.Struct("<HH")
+FLOAT32_CODE = 0
+BLOB_DTYPES = {0: np.dtype("<f4"), 1: np.dtype("<f2")}
+
+
+def pack_float32(components: np.ndarray) -> bytes:
+    array = np.asarray(components, dtype=BLOB_DTYPES[FLOAT32_CODE])
+    return BLOB_HEADER.pack(len(array), FLOAT32_CODE) + array.tobytes()
+
+
+def parse_text_literal(raw: str) -> np.ndarray:
+    return np.array([float(item) for item in raw.strip()[1:-1].split(",") if item.strip()], dtype=np.float32)
+
+
+def unpack_blob(raw) -> np.ndarray:
+    dimensions, code = BLOB_HEADER.unpack_from(raw)
+    return np.frombuffer(raw, dtype=BLOB_DTYPES[code], count=dimensions, offset=BLOB_HEADER.size).astype(np.float32)
+
+
+def to_text_literal(components: np.ndarray) -> str:
+    return "[" + ",".join(str(float(value)) for value in components) + "]"
+
+
+def _rewrite(schema_editor, convert):
+    # Keyset batches so the table is never updated underneath an open scan.
+    last_id = 0
+    with schema_editor.connection.cursor() as cursor:
+        while True:
+            cursor.execute(
+                "SELECT id, embedding FROM contexts_documentchunk WHERE id > %s AND embedding IS NOT NULL ORDER BY id LIMIT %s",
+                [last_id, BATCH_SIZE],
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            updates = [(value, chunk_id) for chunk_id, value in ((chunk_id, convert(raw)) for chunk_id, raw in rows) if value is not None]
+            if updates:
+                cursor.executemany("UPDATE contexts_documentchunk SET embedding = %s WHERE id = %s", updates)
+
+
+def encode_embeddings(apps, schema_editor):
+    # pgvector columns keep their native type; elsewhere text literals become packed blobs.
+    if schema_editor.connection.vendor == "postgresql":
+        return
+    _rewrite(schema_editor, lambda raw: pack_float32(parse_text_literal(raw)) if isinstance(raw, str) else None)
+
+
+def decode_embeddings(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        return
+    _rewrite(schema_editor, lambda raw: None if isinstance(raw, str) else to_text_literal(unpack_blob(raw)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contexts', '0008_documentchunk_embedding_halfvec_hnsw'),
+    ]
+
+    operations = [
+        migrations.RunPython(encode_embeddings, decode_embeddings),
+    ]
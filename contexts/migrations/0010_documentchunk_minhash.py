@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contexts', '0009_documentchunk_embedding_blob'),
+        ('domains', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentchunk',
+            name='minhash',
+            field=models.BinaryField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='documentchunk',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicates', to='contexts.documentchunk'),
+        ),
+        migrations.CreateModel(
+            name='ChunkBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.BigIntegerField()),
+                ('chunk', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lsh_bands', to='contexts.documentchunk')),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='domains.client')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['client', 'key'], name='contexts_ch_client__086b3b_idx')],
+            },
+        ),
+    ]
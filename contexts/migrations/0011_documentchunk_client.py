@@ -0,0 +1,48 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+BATCH_SIZE = 10000
+
+
+def backfill_client(apps, schema_editor):
+    # Id-range batches keep each UPDATE short on large tables.
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT MIN(id), MAX(id) FROM contexts_documentchunk")
+        low, high = cursor.fetchone()
+        if low is None:
+            return
+        for start in range(low, high + 1, BATCH_SIZE):
+            cursor.execute(
+                "UPDATE contexts_documentchunk SET client_id = "
+                "(SELECT client_id FROM uploads_file WHERE uploads_file.id = contexts_documentchunk.file_id) "
+                "WHERE id >= %s AND id < %s AND client_id IS NULL",
+                [start, start + BATCH_SIZE],
+            )
+
+
+class Migration(migrations.Migration):
+
+    # The backfill and the NOT NULL change must not share a transaction on Postgres
+    # (pending trigger events from the new foreign key).
+    atomic = False
+
+    dependencies = [
+        ('contexts', '0010_documentchunk_minhash'),
+        ('domains', '0001_initial'),
+        ('uploads', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentchunk',
+            name='client',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='document_chunks', to='domains.client'),
+        ),
+        migrations.RunPython(backfill_client, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='documentchunk',
+            name='client',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='document_chunks', to='domains.client'),
+        ),
+    ]
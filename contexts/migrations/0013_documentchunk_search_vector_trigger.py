@@ -0,0 +1,55 @@
+from django.db import migrations
+
+
+INDEX_NAME = "contexts_chunk_search_vector_gin"
+TRIGGER_NAME = "contexts_chunk_search_vector"
+
+
+def make_search_vector_writable(apps, schema_editor):
+    # A generated column can only see the inline text, which offset-stored chunks leave empty.
+    # The column becomes a plain tsvector: a trigger fills it from inline text and ingestion
+    # writes it for offset-stored chunks from the text it has in memory.
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("ALTER TABLE contexts_documentchunk ALTER COLUMN search_vector DROP EXPRESSION IF EXISTS")
+    schema_editor.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION {TRIGGER_NAME}() RETURNS trigger AS $$
+        BEGIN
+            IF NEW.text <> '' THEN
+                NEW.search_vector := to_tsvector('simple', NEW.text);
+            END IF;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    schema_editor.execute(f"DROP TRIGGER IF EXISTS {TRIGGER_NAME} ON contexts_documentchunk")
+    schema_editor.execute(
+        f"CREATE TRIGGER {TRIGGER_NAME} BEFORE INSERT OR UPDATE OF text ON contexts_documentchunk "
+        f"FOR EACH ROW EXECUTE FUNCTION {TRIGGER_NAME}()"
+    )
+
+
+def restore_generated_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP TRIGGER IF EXISTS {TRIGGER_NAME} ON contexts_documentchunk")
+    schema_editor.execute(f"DROP FUNCTION IF EXISTS {TRIGGER_NAME}()")
+    schema_editor.execute("ALTER TABLE contexts_documentchunk DROP COLUMN IF EXISTS search_vector")
+    schema_editor.execute(
+        "ALTER TABLE contexts_documentchunk ADD COLUMN search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('simple', text)) STORED"
+    )
+    schema_editor.execute(f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON contexts_documentchunk USING gin (search_vector)")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contexts', '0012_documentchunk_byte_offsets'),
+    ]
+
+    operations = [
+        migrations.RunPython(make_search_vector_writable, restore_generated_search_vector),
+    ]
@@ -1,11 +1,72 @@
+import struct
+
+import numpy as np
 from django.conf import settings
 from django.db import models
+from django.db.models import ExpressionWrapper, F
 from django.utils.text import slugify
+from pgvector import Vector
 from pgvector.django import VectorField
 
 
+# Packed vectors for databases without pgvector: a little-endian header of
+# (dimensions, dtype code) followed by the little-endian components.
+_BLOB_HEADER = struct.Struct("<HH")
+_BLOB_DTYPES = {"float32": (0, np.dtype("<f4")), "float16": (1, np.dtype("<f2"))}
+_BLOB_CODES = {code: dtype for code, dtype in _BLOB_DTYPES.values()}
+
+
+def pack_vector(value, dtype: str = "float32") -> bytes:
+    code, numpy_dtype = _BLOB_DTYPES[dtype]
+    array = np.asarray(value.to_numpy() if isinstance(value, Vector) else value, dtype=numpy_dtype)
+    return _BLOB_HEADER.pack(len(array), code) + array.tobytes()
+
+
+def unpack_vector(blob) -> np.ndarray:
+    """Decode :func:`pack_vector` output; float32 blobs are returned as a view, without copying."""
+    dimensions, code = _BLOB_HEADER.unpack_from(blob)
+    array = np.frombuffer(blob, dtype=_BLOB_CODES[code], count=dimensions, offset=_BLOB_HEADER.size)
+    return array if code == 0 else array.astype(np.float32)
+
+
+def vector_to_numpy(value):
+    """Parse a stored vector (text literal, packed blob, ``Vector`` or sequence) into a read-only float32 array."""
+    if value is None:
+        return None
+    if isinstance(value, (bytes, memoryview)):
+        array = unpack_vector(value)
+    elif isinstance(value, Vector):
+        array = value.to_numpy()
+    elif isinstance(value, str):
+        components = value.strip()[1:-1]
+        array = np.array(components.split(",") if components else [], dtype=np.float32)
+    else:
+        array = np.asarray(value, dtype=np.float32)
+    array.flags.writeable = False
+    return array
+
+
 class ListVectorField(VectorField):
-    """VectorField that always returns a plain Python list when possible."""
+    """
+    VectorField that always returns a plain Python list when possible.
+
+    With ``as_numpy=True`` values load as read-only float32 NumPy arrays instead, parsed
+    straight from the database value without building a list of Python floats.
+
+    On databases other than PostgreSQL the column is a BLOB holding :func:`pack_vector`
+    output (float32, or float16 with ``EMBEDDING_BLOB_DTYPE="float16"``). Text literals
+    written before migration 0009 still load.
+    """
+
+    def __init__(self, *args, as_numpy: bool = False, **kwargs):
+        self.as_numpy = as_numpy
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.as_numpy:
+            kwargs["as_numpy"] = True
+        return name, path, args, kwargs
 
     def _coerce(self, value):
         if value is None:
@@ -22,17 +83,34 @@ class ListVectorField(VectorField):
             return value
 
     def to_python(self, value):
+        if self.as_numpy:
+            return vector_to_numpy(value)
         coerced = super().to_python(value)
         return self._coerce(coerced)
 
+    def db_type(self, connection):
+        if connection.vendor != "postgresql":
+            return "blob"
+        return super().db_type(connection)
+
     def from_db_value(self, value, expression, connection):
+        if self.as_numpy:
+            return vector_to_numpy(value)
+        if isinstance(value, (bytes, memoryview)):
+            return unpack_vector(value).tolist()
         coerced = super().from_db_value(value, expression, connection)
         return self._coerce(coerced)
 
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if connection.vendor != "postgresql" and value is not None and not isinstance(value, (bytes, str)):
+            return pack_vector(value, getattr(settings, "EMBEDDING_BLOB_DTYPE", "float32"))
+        return super().get_db_prep_value(value, connection, prepared)
+
     def get_prep_value(self, value):
         if getattr(settings, "PGVECTOR_DISABLED", False):
-            # When pgvector is disabled we persist embeddings as JSON-compatible lists.
-            return self._coerce(value)
+            # Lookups and expressions get a plain list. Saved values on databases other than
+            # PostgreSQL never reach this point: get_db_prep_value packs them into the BLOB column.
+            value = self._coerce(value)
         return super().get_prep_value(value)
 
 
@@ -49,17 +127,143 @@ class Category(models.Model):
         return self.name
 
 
+class DocumentChunkQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        _fill_client(objs)
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def with_numpy_embeddings(self, name: str = "embedding_array"):
+        """Annotate ``name`` with the embedding as a read-only float32 array instead of a list."""
+        dimensions = self.model._meta.get_field("embedding").dimensions
+        return self.annotate(**{name: ExpressionWrapper(F("embedding"), output_field=ListVectorField(dimensions=dimensions, as_numpy=True))})
+
+    def embedding_matrix(self):
+        """
+        Return ``(ids, matrix)`` for every chunk with an embedding: an int64 id array and one
+        contiguous float32 matrix, row ``i`` belonging to ``ids[i]``. Works on sliced querysets.
+        """
+        dimensions = self.model._meta.get_field("embedding").dimensions
+        rows = [row for row in self.with_numpy_embeddings().values_list("id", "embedding_array") if row[1] is not None]
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty((0, dimensions), dtype=np.float32)
+        ids, arrays = zip(*rows)
+        return np.fromiter(ids, dtype=np.int64, count=len(ids)), np.stack(arrays)
+
+
+def _fill_client(chunks) -> None:
+    """Copy ``client`` from each chunk's file where the caller did not set it."""
+    missing = [chunk for chunk in chunks if chunk.client_id is None]
+    if not missing:
+        return
+    from uploads.models import File
+
+    owners = dict(File.objects.filter(pk__in={chunk.file_id for chunk in missing}).values_list("pk", "client_id"))
+    for chunk in missing:
+        chunk.client_id = owners.get(chunk.file_id)
+
+
 class DocumentChunk(models.Model):
     file = models.ForeignKey("uploads.File", on_delete=models.CASCADE, related_name="chunks")
-    text = models.TextField()
+    # Denormalized from file.client so tenant-scoped vector searches need no join and can use
+    # per-client partial HNSW indexes (see the tenant_vector_index command).
+    client = models.ForeignKey("domains.Client", on_delete=models.CASCADE, related_name="document_chunks")
+    # Empty when the chunk is stored as UTF-8 byte offsets into the file (see contexts.chunk_store).
+    text = models.TextField(blank=True)
+    fingerprint = models.CharField(max_length=64, blank=True, default="")
+    start_offset = models.BigIntegerField(null=True, blank=True)
+    end_offset = models.BigIntegerField(null=True, blank=True)
+    token_count = models.PositiveIntegerField(null=True, blank=True)
+    byte_start = models.BigIntegerField(null=True, blank=True)
+    byte_end = models.BigIntegerField(null=True, blank=True)
     embedding = ListVectorField(dimensions=1536, null=True, blank=True)
+    shard = models.ForeignKey("IngestionShard", on_delete=models.SET_NULL, null=True, blank=True, related_name="chunks")
+    minhash = models.BinaryField(null=True, blank=True, editable=False)
+    duplicate_of = models.ForeignKey("self", on_delete=models.SET_NULL, null=True, blank=True, related_name="duplicates")
     score = models.FloatField(default=0.0)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = DocumentChunkQuerySet.as_manager()
+
     class Meta:
         indexes = [
             models.Index(fields=["file"]),
         ]
 
+    def save(self, *args, **kwargs):
+        _fill_client([self])
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"Chunk {self.pk} for {self.file}"
+
+
+class IngestionJob(models.Model):
+    """A sharded (fan-out) ingestion run for one file; the latest job reflects the file's state."""
+
+    STATUS_CHOICES = [
+        ("running", "Running"),
+        ("ready", "Ready"),
+        ("failed", "Failed"),
+    ]
+
+    file = models.ForeignKey("uploads.File", on_delete=models.CASCADE, related_name="ingestion_jobs")
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default="running")
+    chunk_size = models.PositiveIntegerField(default=600)
+    shard_count = models.PositiveIntegerField(default=0)
+    shards_done = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at", "-id"]
+
+    @property
+    def progress(self) -> float:
+        if not self.shard_count:
+            return 0.0
+        return self.shards_done / self.shard_count
+
+    def __str__(self):
+        return f"Ingestion {self.pk} for {self.file} ({self.status})"
+
+
+class IngestionShard(models.Model):
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    ]
+
+    job = models.ForeignKey(IngestionJob, on_delete=models.CASCADE, related_name="shards")
+    index = models.PositiveIntegerField()
+    start = models.BigIntegerField()
+    end = models.BigIntegerField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default="pending")
+    attempts = models.PositiveIntegerField(default=0)
+    chunk_count = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ["index"]
+        unique_together = ("job", "index")
+
+    def __str__(self):
+        return f"Shard {self.index} of job {self.job_id} [{self.start}:{self.end})"
+
+
+class ChunkBand(models.Model):
+    """One LSH band bucket of a canonical chunk's MinHash signature, scoped to the client."""
+
+    client = models.ForeignKey("domains.Client", on_delete=models.CASCADE, related_name="+")
+    key = models.BigIntegerField()
+    chunk = models.ForeignKey(DocumentChunk, on_delete=models.CASCADE, related_name="lsh_bands")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["client", "key"]),
+        ]
+
+    def __str__(self):
+        return f"Band {self.key} of chunk {self.chunk_id}"
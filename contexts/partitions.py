@@ -0,0 +1,49 @@
+"""
+Per-tenant vector index partitions on Postgres.
+
+Every chunk carries ``client_id``, so a tenant can get a dedicated partial HNSW
+index that covers only its own rows. Vector searches filter on
+``client_id = <id> AND duplicate_of_id IS NULL``, which implies the index
+predicate, so the planner serves a large tenant from its own graph instead of
+post-filtering the global index from migration 0006. Small tenants keep using
+the shared index.
+"""
+
+from __future__ import annotations
+
+from typing import Dict
+
+from django.db import connection
+
+from .quantization import quantization_mode
+
+
+INDEX_PREFIX = "contexts_chunk_hnsw_client_"
+HNSW_OPTIONS = "WITH (m = 16, ef_construction = 64)"
+
+
+def tenant_index_name(client_id: int) -> str:
+    return f"{INDEX_PREFIX}{int(client_id)}"
+
+
+def create_tenant_index_sql(client_id: int, mode: str = None) -> str:
+    """``CREATE INDEX`` for one client, over the column form searched in ``mode`` (see contexts.quantization)."""
+    mode = mode or quantization_mode()
+    column = "(embedding::halfvec(1536)) halfvec_cosine_ops" if mode == "halfvec" else "embedding vector_cosine_ops"
+    return (
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {tenant_index_name(client_id)} ON contexts_documentchunk "
+        f"USING hnsw ({column}) {HNSW_OPTIONS} WHERE client_id = {int(client_id)} AND duplicate_of_id IS NULL"
+    )
+
+
+def drop_tenant_index_sql(client_id: int) -> str:
+    return f"DROP INDEX CONCURRENTLY IF EXISTS {tenant_index_name(client_id)}"
+
+
+def tenant_indexes() -> Dict[int, str]:
+    """Map client id to index definition for every dedicated tenant index."""
+    if connection.vendor != "postgresql":
+        return {}
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT indexname, indexdef FROM pg_indexes WHERE tablename = 'contexts_documentchunk' AND indexname LIKE %s", [INDEX_PREFIX + "%"])
+        return {int(name[len(INDEX_PREFIX):]): definition for name, definition in cursor.fetchall()}
@@ -0,0 +1,66 @@
+"""
+Compact embedding representations.
+
+``halfvec`` (pgvector only) searches a float16 HNSW expression index over the
+float32 column (migration 0008): the graph is half the size of the float32
+one, but the table itself is unchanged because re-ranking needs the float32
+vectors. ``int8`` (local index only) scalar-quantizes each vector
+symmetrically with its own scale so ``vector ~= codes * scale``, and keeps the
+codes next to the float32 file in the index directory. Both are used for a
+coarse first pass whose candidates are re-ranked at full precision.
+"""
+
+from __future__ import annotations
+
+from typing import Tuple
+
+import numpy as np
+from django.conf import settings
+
+
+QUANTIZATION_MODES = ("none", "halfvec", "int8")
+# Which vector backend can serve each compact mode; see contexts.retrieval.vector_backend.
+MODE_BACKENDS = {"halfvec": "pgvector", "int8": "local"}
+DEFAULT_RERANK_FACTOR = 4
+
+
+def quantization_mode() -> str:
+    mode = getattr(settings, "EMBEDDING_QUANTIZATION", "none") or "none"
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown EMBEDDING_QUANTIZATION {mode!r}; expected one of {QUANTIZATION_MODES}.")
+    backend = "local" if getattr(settings, "PGVECTOR_DISABLED", False) else "pgvector"
+    if MODE_BACKENDS.get(mode, backend) != backend:
+        raise ValueError(f"EMBEDDING_QUANTIZATION {mode!r} is only supported by the {MODE_BACKENDS[mode]} backend, not {backend}.")
+    return mode
+
+
+def rerank_candidates(k: int) -> int:
+    """How many coarse-pass candidates to re-rank at full precision for a top-``k`` query."""
+    return k * max(int(getattr(settings, "QUANTIZED_RERANK_FACTOR", DEFAULT_RERANK_FACTOR)), 1)
+
+
+def quantize_int8(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Return ``(codes, scales)``: int8 codes per row and one float32 scale per row."""
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float32))
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def dequantize_int8(codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    return codes.astype(np.float32) * scales[:, None]
+
+
+def int8_scores(codes: np.ndarray, scales: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Approximate ``vectors @ query`` straight from the codes without materializing floats per row."""
+    return (codes.astype(np.float32) @ np.asarray(query, dtype=np.float32)) * scales
+
+
+def bytes_per_vector(dimensions: int, mode: str) -> int:
+    """Size of one vector's components in ``mode``; an estimate that ignores row and page overhead."""
+    if mode == "halfvec":
+        return 2 * dimensions
+    if mode == "int8":
+        return dimensions + 4
+    return 4 * dimensions
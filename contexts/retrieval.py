@@ -0,0 +1,444 @@
+"""
+Top-k chunk retrieval for prompt templates.
+
+``search_chunks`` is the single entry point used by callers; it dispatches to
+pgvector when the database has the extension and to the in-process
+``contexts.ann`` index for deployments running with ``PGVECTOR_DISABLED``.
+Both backends score by cosine similarity so ``min_score`` means the same
+thing everywhere. On Postgres the query is served by the HNSW index created in
+migration 0006. ``hybrid_search_chunks`` adds a full-text arm (the generated
+``search_vector`` column and GIN index from migration 0007) and merges both
+rankings with reciprocal rank fusion. Chunks flagged as near-duplicates by
+``contexts.dedup`` are never returned. Category and tag filters (the
+``uploads.query.select_docs`` predicates) are applied inside the search itself,
+so ``k`` results come back whenever the filtered set holds ``k`` chunks; a
+matching file whose text is a near-duplicate of a chunk elsewhere is returned
+through that duplicate. With ``RETRIEVAL_CACHE_ENABLED`` both
+entry points serve repeated queries from :class:`contexts.cache.RetrievalCache`.
+Chunks stored as byte offsets (``CHUNK_TEXT_STORAGE = "offsets"``) get their text
+from :mod:`contexts.chunk_store` once the final top-k is known. Ingestion writes
+their ``search_vector`` from the text it read (migration 0013), and the local
+lexical ranking reads their text back from the files, so both arms match them.
+"""
+
+from __future__ import annotations
+
+import heapq
+from dataclasses import dataclass, replace
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q, Subquery
+from django.db.models.functions import Cast
+from pgvector import HalfVector, Vector
+from pgvector.django import CosineDistance, HalfVectorField
+
+from uploads.query import normalize_category_values, normalize_tag_values, select_docs
+
+from .ann import LocalVectorIndex
+from .cache import cached_embeddings, get_retrieval_cache, retrieval_cache_key
+from .chunk_store import load_chunk_texts
+from .metrics import retrieval_metrics
+from .models import DocumentChunk
+from .quantization import quantization_mode, rerank_candidates
+
+
+DEFAULT_EF_SEARCH = 40
+EMBEDDING_DIMENSIONS = 1536
+DEFAULT_RRF_K = 60
+DEFAULT_CANDIDATE_FACTOR = 4
+ITERATIVE_SCAN_MODES = ("strict_order", "relaxed_order")
+LEXICAL_SCAN_BATCH = 2000
+
+
+@dataclass(frozen=True)
+class RetrievedChunk:
+    id: int
+    file_id: int
+    score: float
+    text: str
+
+
+@dataclass(frozen=True)
+class ChunkFilter:
+    """Restrict retrieval to chunks of files matching ``select_docs(categories, tags)``."""
+
+    categories: Tuple[str, ...] = ()
+    tags: Tuple[str, ...] = ()
+
+    @classmethod
+    def build(cls, categories: Iterable = None, tags: Iterable = None) -> Optional["ChunkFilter"]:
+        categories = tuple(sorted(normalize_category_values(categories or [])))
+        tags = tuple(sorted(normalize_tag_values(tags or [])))
+        return cls(categories, tags) if categories or tags else None
+
+    def files(self, client):
+        return select_docs(self.categories, self.tags).filter(client=client)
+
+    def apply(self, chunks, client):
+        """
+        Canonical chunks the filtered search ranks: those of matching files, plus those outside
+        the filter that have a near-duplicate inside it (dedup links copies across files, so the
+        duplicate may be a matching file's only copy of that text). :meth:`localize` swaps the
+        latter for their in-filter duplicate.
+        """
+        in_filter = DocumentChunk.objects.filter(duplicate_of=OuterRef("pk"), file_id__in=Subquery(self.files(client).values("pk")))
+        return chunks.filter(duplicate_of__isnull=True).filter(Q(file_id__in=Subquery(self.files(client).values("pk"))) | Exists(in_filter))
+
+    def localize(self, results: List["RetrievedChunk"], client) -> List["RetrievedChunk"]:
+        """Replace hits on canonical chunks outside the filter with their in-filter near-duplicate."""
+        file_ids = set(self.files(client).values_list("pk", flat=True))
+        outside = [result.id for result in results if result.file_id not in file_ids]
+        if not outside:
+            return results
+        stand_ins: Dict[int, tuple] = {}
+        rows = DocumentChunk.objects.filter(duplicate_of_id__in=outside, file_id__in=file_ids).order_by("id").values_list("duplicate_of_id", "id", "file_id", "text")
+        for canonical_id, chunk_id, file_id, text in rows:
+            stand_ins.setdefault(canonical_id, (chunk_id, file_id, text))
+        localized = []
+        for result in results:
+            if result.file_id in file_ids:
+                localized.append(result)
+            elif result.id in stand_ins:
+                chunk_id, file_id, text = stand_ins[result.id]
+                localized.append(replace(result, id=chunk_id, file_id=file_id, text=text))
+        return localized
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"categories": list(self.categories), "tags": list(self.tags)}
+
+
+def vector_backend() -> str:
+    return "local" if getattr(settings, "PGVECTOR_DISABLED", False) else "pgvector"
+
+
+def _pgvector_queryset(client, query_embedding, k: int, filters: Optional[ChunkFilter] = None):
+    chunks = DocumentChunk.objects.filter(client=client, embedding__isnull=False)
+    chunks = filters.apply(chunks, client) if filters is not None else chunks.filter(duplicate_of__isnull=True)
+    if quantization_mode() == "halfvec":
+        # Coarse pass over the half-precision HNSW index (migration 0008), then re-rank the
+        # shortlist by exact float32 distance. Both steps run in a single statement.
+        coarse = (
+            chunks.annotate(coarse_distance=CosineDistance(Cast("embedding", HalfVectorField(dimensions=EMBEDDING_DIMENSIONS)), HalfVector(query_embedding)))
+            .order_by("coarse_distance")
+            .values("pk")[: rerank_candidates(k)]
+        )
+        chunks = DocumentChunk.objects.filter(pk__in=Subquery(coarse))
+    return (
+        chunks.annotate(distance=CosineDistance("embedding", query_embedding))
+        .order_by("distance")
+        .values_list("id", "file_id", "distance", "text")[:k]
+    )
+
+
+def _set_ef_search(ef_search: Optional[int], k: int, filtered: bool = False) -> None:
+    """Apply ``hnsw.ef_search`` (and, for filtered queries, ``hnsw.iterative_scan``) for the current transaction only."""
+    if connection.vendor != "postgresql":
+        return
+    ef_search = ef_search or getattr(settings, "RETRIEVAL_EF_SEARCH", DEFAULT_EF_SEARCH)
+    # hnsw.ef_search caps how many candidates an index scan can return, so it must cover k.
+    with connection.cursor() as cursor:
+        cursor.execute(f"SET LOCAL hnsw.ef_search = {max(int(ef_search), k)}")
+        # pgvector >= 0.8 keeps scanning the graph until enough rows pass the filter.
+        iterative_scan = getattr(settings, "RETRIEVAL_ITERATIVE_SCAN", "")
+        if filtered and iterative_scan in ITERATIVE_SCAN_MODES:
+            cursor.execute(f"SET LOCAL hnsw.iterative_scan = {iterative_scan}")
+
+
+def _pgvector_search(client, query_embedding, k: int, min_score: float, ef_search: Optional[int] = None, filters: Optional[ChunkFilter] = None) -> List[RetrievedChunk]:
+    """Cosine top-k served by the HNSW index; ``ef_search`` trades recall for latency per call."""
+    with transaction.atomic():
+        _set_ef_search(ef_search, rerank_candidates(k) if quantization_mode() == "halfvec" else k, filtered=filters is not None)
+        rows = list(_pgvector_queryset(client, query_embedding, k, filters))
+    results = [RetrievedChunk(id=chunk_id, file_id=file_id, score=1.0 - distance, text=text) for chunk_id, file_id, distance, text in rows]
+    # relaxed_order iterative scans may return rows slightly out of order.
+    results.sort(key=lambda result: -result.score)
+    results = [result for result in results if result.score >= min_score]
+    return filters.localize(results, client) if filters is not None else results
+
+
+def _allowed_chunk_ids(client, filters: Optional[ChunkFilter]) -> Optional[np.ndarray]:
+    if filters is None:
+        return None
+    ids = filters.apply(DocumentChunk.objects.filter(client=client), client).values_list("id", flat=True)
+    return np.fromiter(ids, dtype=np.int64)
+
+
+def _local_search(client, query_embedding, k: int, min_score: float, ef_search: Optional[int] = None, filters: Optional[ChunkFilter] = None) -> List[RetrievedChunk]:
+    results = _local_vector_hits(client, query_embedding, k, min_score, filters)
+    return filters.localize(results, client) if filters is not None else results
+
+
+def _local_vector_hits(client, query_embedding, k: int, min_score: float, filters: Optional[ChunkFilter] = None) -> List[RetrievedChunk]:
+    allowed = _allowed_chunk_ids(client, filters)
+    if allowed is not None and not len(allowed):
+        return []
+    hits = LocalVectorIndex.for_client(client).search(query_embedding, k, min_score=min_score, allowed=allowed)
+    if not hits:
+        return []
+    # The index may briefly trail the database; rows that no longer exist are skipped.
+    chunks = DocumentChunk.objects.filter(pk__in=[chunk_id for chunk_id, _ in hits], client=client).only("id", "file_id", "text").in_bulk()
+    return [
+        RetrievedChunk(id=chunk_id, file_id=chunks[chunk_id].file_id, score=score, text=chunks[chunk_id].text)
+        for chunk_id, score in hits
+        if chunk_id in chunks
+    ]
+
+
+BACKENDS = {
+    "pgvector": _pgvector_search,
+    "local": _local_search,
+}
+
+
+def _with_texts(results: List[RetrievedChunk]) -> List[RetrievedChunk]:
+    """Fill in the text of offset-stored chunks, which the backends return empty."""
+    missing = [result.id for result in results if not result.text]
+    if not missing:
+        return results
+    texts = load_chunk_texts(missing)
+    return [replace(result, text=texts[result.id]) if result.id in texts else result for result in results]
+
+
+def _cached(client, query_embedding, search: Callable[[], List[RetrievedChunk]], *, k: int, min_score: float, **options) -> List[RetrievedChunk]:
+    """Run ``search`` through the retrieval result cache when it is enabled."""
+    cache = get_retrieval_cache()
+    version = cache.version(client.pk) if cache is not None else None
+    if version is None:
+        return _with_texts(search())
+    key = retrieval_cache_key(client.pk, version, query_embedding, k=k, min_score=min_score, **options)
+    rows = cache.get(key)
+    if rows is not None:
+        retrieval_metrics.increment("retrieval.cache.hits")
+        return [RetrievedChunk(*row) for row in rows]
+    retrieval_metrics.increment("retrieval.cache.misses")
+    results = _with_texts(search())
+    # Stored under the version read before searching, so a concurrent ingest can only orphan it.
+    cache.set(key, [[result.id, result.file_id, result.score, result.text] for result in results])
+    return results
+
+
+def search_chunks(
+    client,
+    query_embedding: Sequence[float],
+    *,
+    k: int = 3,
+    min_score: float = 0.0,
+    ef_search: Optional[int] = None,
+    categories: Iterable = None,
+    tags: Iterable = None,
+) -> List[RetrievedChunk]:
+    """
+    Return the ``k`` chunks of ``client`` most similar to ``query_embedding``, best first, with
+    cosine scores below ``min_score`` dropped. ``categories``/``tags`` restrict the search to
+    files :func:`uploads.query.select_docs` would return. Latency is recorded per backend in
+    :data:`contexts.metrics.retrieval_metrics`.
+    """
+    if query_embedding is None or k <= 0:
+        return []
+    filters = ChunkFilter.build(categories, tags)
+    backend = vector_backend()
+    with retrieval_metrics.timer(f"retrieval.{backend}", k=k):
+        results = _cached(
+            client,
+            query_embedding,
+            lambda: BACKENDS[backend](client, query_embedding, k, min_score, ef_search, filters),
+            k=k,
+            min_score=min_score,
+            filters=filters and filters.as_dict(),
+            mode="vector",
+            ef_search=ef_search,
+        )
+    retrieval_metrics.increment(f"retrieval.{backend}.calls")
+    return results
+
+
+def rrf_fuse(rankings: Sequence[Sequence[int]], k: int, rrf_k: int = DEFAULT_RRF_K) -> List[tuple]:
+    """Reciprocal rank fusion: ``score(d) = sum(1 / (rrf_k + rank))`` over every ranking containing d."""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+
+_HYBRID_SQL = """
+WITH vector_hits AS (
+    SELECT id, row_number() OVER (ORDER BY distance) AS rank
+    FROM (
+        SELECT c.id, c.embedding <=> %(embedding)s::vector AS distance
+        FROM contexts_documentchunk c
+        WHERE c.client_id = %(client_id)s AND c.embedding IS NOT NULL AND c.duplicate_of_id IS NULL
+          AND (%(unfiltered)s OR c.file_id = ANY(%(file_ids)s) OR EXISTS (
+              SELECT 1 FROM contexts_documentchunk d WHERE d.duplicate_of_id = c.id AND d.file_id = ANY(%(file_ids)s)))
+        ORDER BY distance
+        LIMIT %(candidates)s
+    ) ranked
+    WHERE 1 - distance >= %(min_score)s
+),
+lexical_hits AS (
+    SELECT id, row_number() OVER (ORDER BY lexical_rank DESC, id) AS rank
+    FROM (
+        SELECT c.id, ts_rank_cd(c.search_vector, query) AS lexical_rank
+        FROM contexts_documentchunk c,
+        websearch_to_tsquery('simple', %(text)s) query
+        WHERE c.client_id = %(client_id)s AND c.duplicate_of_id IS NULL AND c.search_vector @@ query
+          AND (%(unfiltered)s OR c.file_id = ANY(%(file_ids)s) OR EXISTS (
+              SELECT 1 FROM contexts_documentchunk d WHERE d.duplicate_of_id = c.id AND d.file_id = ANY(%(file_ids)s)))
+        ORDER BY lexical_rank DESC
+        LIMIT %(candidates)s
+    ) ranked
+),
+fused AS (
+    SELECT id, SUM(1.0 / (%(rrf_k)s + rank)) AS score
+    FROM (SELECT * FROM vector_hits UNION ALL SELECT * FROM lexical_hits) hits
+    GROUP BY id
+)
+SELECT c.id, c.file_id, fused.score, c.text
+FROM fused
+JOIN contexts_documentchunk c ON c.id = fused.id
+ORDER BY fused.score DESC, c.id
+LIMIT %(k)s
+"""
+
+
+def _pgvector_hybrid_search(client, query_text, query_embedding, k, min_score, candidates, rrf_k, ef_search, filters=None) -> List[RetrievedChunk]:
+    """Both rankings and the fusion run in one statement against the HNSW and GIN indexes."""
+    params = {
+        "embedding": Vector(np.asarray(query_embedding, dtype=np.float32)).to_text(),
+        "client_id": client.pk,
+        # The matching file ids are resolved up front (a short list) and applied in both arms.
+        "unfiltered": filters is None,
+        "file_ids": [] if filters is None else list(filters.files(client).values_list("pk", flat=True)),
+        "candidates": candidates,
+        "min_score": min_score,
+        "text": query_text,
+        "rrf_k": rrf_k,
+        "k": k,
+    }
+    with transaction.atomic():
+        _set_ef_search(ef_search, candidates, filtered=filters is not None)
+        with connection.cursor() as cursor:
+            cursor.execute(_HYBRID_SQL, params)
+            rows = cursor.fetchall()
+    results = [RetrievedChunk(id=chunk_id, file_id=file_id, score=float(score), text=text) for chunk_id, file_id, score, text in rows]
+    return filters.localize(results, client) if filters is not None else results
+
+
+def _batched(items: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _local_lexical_ranking(client, query_text: str, candidates: int, filters: Optional[ChunkFilter] = None) -> List[int]:
+    """Term-match ranking for the local backend, which has no full-text index."""
+    terms = [term for term in dict.fromkeys(query_text.split()) if len(term) > 1]
+    if not terms:
+        return []
+    matches = Q()
+    for term in terms:
+        matches |= Q(text__icontains=term)
+    # Offset-stored chunks have no inline text to match; their text is read back from the files.
+    rows = DocumentChunk.objects.filter(matches | Q(text="", byte_start__isnull=False), client=client)
+    rows = filters.apply(rows, client) if filters is not None else rows.filter(duplicate_of__isnull=True)
+    lowered_terms = [term.lower() for term in terms]
+    # Every matching row is scored, a batch at a time; only the best ``candidates`` are kept.
+    best: List[tuple] = []
+    for batch in _batched(rows.values_list("id", "text").iterator(chunk_size=LEXICAL_SCAN_BATCH), LEXICAL_SCAN_BATCH):
+        stored = load_chunk_texts([chunk_id for chunk_id, text in batch if not text])
+        for chunk_id, text in batch:
+            lowered = (text or stored.get(chunk_id, "")).lower()
+            score = sum(term in lowered for term in lowered_terms)
+            if score:
+                best.append((-score, chunk_id))
+        best = heapq.nsmallest(candidates, best)
+    return [chunk_id for _, chunk_id in sorted(best)]
+
+
+def _local_hybrid_search(client, query_text, query_embedding, k, min_score, candidates, rrf_k, ef_search, filters=None) -> List[RetrievedChunk]:
+    # Both rankings hold canonical ids; hits outside the filter are localized after fusion.
+    vector_ids = [chunk.id for chunk in _local_vector_hits(client, query_embedding, candidates, min_score, filters)]
+    fused = rrf_fuse([vector_ids, _local_lexical_ranking(client, query_text, candidates, filters)], k, rrf_k)
+    chunks = DocumentChunk.objects.filter(pk__in=[chunk_id for chunk_id, _ in fused]).only("id", "file_id", "text").in_bulk()
+    results = [
+        RetrievedChunk(id=chunk_id, file_id=chunks[chunk_id].file_id, score=score, text=chunks[chunk_id].text)
+        for chunk_id, score in fused
+        if chunk_id in chunks
+    ]
+    return filters.localize(results, client) if filters is not None else results
+
+
+HYBRID_BACKENDS = {
+    "pgvector": _pgvector_hybrid_search,
+    "local": _local_hybrid_search,
+}
+
+
+def hybrid_search_chunks(
+    client,
+    query_text: str,
+    query_embedding: Sequence[float],
+    *,
+    k: int = 3,
+    min_score: float = 0.0,
+    candidates: Optional[int] = None,
+    rrf_k: int = DEFAULT_RRF_K,
+    ef_search: Optional[int] = None,
+    categories: Iterable = None,
+    tags: Iterable = None,
+) -> List[RetrievedChunk]:
+    """
+    Fuse the vector top-``candidates`` with a full-text top-``candidates`` by reciprocal rank.
+    ``min_score`` filters the vector arm only (it is a cosine threshold); lexical hits always
+    compete, which is what lets exact identifiers such as invoice numbers surface. Scores on
+    the returned chunks are RRF scores. ``categories``/``tags`` restrict both arms as in
+    :func:`search_chunks`.
+    """
+    if query_embedding is None or k <= 0:
+        return []
+    candidates = max(candidates or k * DEFAULT_CANDIDATE_FACTOR, k)
+    filters = ChunkFilter.build(categories, tags)
+    backend = vector_backend()
+    with retrieval_metrics.timer(f"retrieval.hybrid.{backend}", k=k):
+        results = _cached(
+            client,
+            query_embedding,
+            lambda: HYBRID_BACKENDS[backend](client, query_text, query_embedding, k, min_score, candidates, rrf_k, ef_search, filters),
+            k=k,
+            min_score=min_score,
+            filters=filters and filters.as_dict(),
+            mode="hybrid",
+            query_text=query_text,
+            candidates=candidates,
+            rrf_k=rrf_k,
+            ef_search=ef_search,
+        )
+    retrieval_metrics.increment(f"retrieval.hybrid.{backend}.calls")
+    return results
+
+
+def retrieve_for_template(template, client, query: str) -> List[RetrievedChunk]:
+    """
+    Embed ``query`` and search with the template's ``retrieval_params`` and retrieval mode.
+    ``categories``, ``tags`` and ``ef_search`` in the template metadata are passed through.
+    """
+    embeddings = cached_embeddings([query])
+    if embeddings is None:
+        return []
+    metadata = template.metadata or {}
+    options = {
+        "ef_search": metadata.get("ef_search"),
+        "categories": metadata.get("categories"),
+        "tags": metadata.get("tags"),
+        **template.retrieval_params(),
+    }
+    if template.retrieval_mode == "hybrid":
+        return hybrid_search_chunks(client, query, embeddings[0], **options)
+    return search_chunks(client, embeddings[0], **options)
@@ -0,0 +1,44 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .ann import LocalVectorIndex, local_index_enabled
+from .cache import invalidate_retrieval_cache
+from .models import DocumentChunk
+
+
+@receiver(pre_delete, sender="uploads.File")
+def promote_duplicates_of_deleted_file(sender, instance, **kwargs):
+    # Near-duplicates in other files must not vanish from retrieval with their canonical chunk.
+    from .tasks import _promote_duplicates
+
+    removed = list(DocumentChunk.objects.filter(file=instance, duplicate_of__isnull=True).values_list("id", flat=True))
+    if removed:
+        _promote_duplicates(instance, removed)
+
+
+@receiver(pre_delete, sender="uploads.File")
+def drop_deleted_file_from_local_index(sender, instance, **kwargs):
+    # The cascade bypasses _delete_chunks, which would otherwise tombstone these ids.
+    if not local_index_enabled():
+        return
+    removed = list(DocumentChunk.objects.filter(file=instance).values_list("id", flat=True))
+    if removed:
+        index = LocalVectorIndex.for_client(instance.client)
+        transaction.on_commit(lambda: index.remove(removed))
+
+
+@receiver(post_delete, sender="uploads.File")
+def invalidate_results_for_deleted_file(sender, instance, **kwargs):
+    # Chunks go with the file through the cascade, which bypasses _delete_chunks.
+    invalidate_retrieval_cache(instance.client_id)
+
+
+@receiver(post_save, sender="uploads.File")
+def keep_chunk_client_in_sync(sender, instance, created, **kwargs):
+    # DocumentChunk.client is denormalized from File.client; follow a file moved between clients.
+    if created:
+        return
+    moved = DocumentChunk.objects.filter(file=instance).exclude(client_id=instance.client_id).update(client_id=instance.client_id)
+    if moved:
+        invalidate_retrieval_cache(instance.client_id)
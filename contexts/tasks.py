@@ -1,42 +1,471 @@
 from __future__ import annotations
 
-from typing import Iterable
+from collections import defaultdict, deque
+from itertools import chain, islice
+from typing import BinaryIO, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Union
 
-from django.db import transaction
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
 from huey.contrib.djhuey import task
 
 from uploads.models import File
-from .embeddings import chunk_text, generate_embedding
-from .models import DocumentChunk
+from .ann import LocalVectorIndex, local_index_enabled
+from .cache import cached_embeddings, invalidate_retrieval_cache
+from .chunk_store import get_mapped_files, media_path, offsets_enabled
+from .dedup import dedup_enabled, find_duplicates, index_bands, minhash_signatures, pack_signature, promote_duplicates
+from .embeddings import DEFAULT_BLOCK_SIZE, TextChunk, chunk_fingerprint, stream_chunks, stream_token_chunks
+from .models import DocumentChunk, IngestionJob, IngestionShard
 
 
-def _chunk_and_embed(file_id: int, *, chunk_size: int = 600):
+DEFAULT_INGEST_BATCH_SIZE = 256
+DEFAULT_INGEST_SHARD_BYTES = 8 * 1024 * 1024
+DEFAULT_TOKEN_OVERLAP = 64
+
+Segment = Union[str, TextChunk]
+
+
+def _ingest_batch_size(batch_size: Optional[int] = None) -> int:
+    size = batch_size or getattr(settings, "EMBEDDING_BATCH_SIZE", DEFAULT_INGEST_BATCH_SIZE)
+    return max(int(size), 1)
+
+
+def _batched(items: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _segment_stream(stream: BinaryIO, *, chunk_size: int, max_tokens: Optional[int] = None, overlap: Optional[int] = None) -> Iterator[Segment]:
+    """Pick the token-budgeted chunker when a token budget is configured, else the sentence chunker."""
+    max_tokens = max_tokens or getattr(settings, "CHUNK_MAX_TOKENS", None)
+    if max_tokens:
+        if overlap is None:
+            overlap = getattr(settings, "CHUNK_TOKEN_OVERLAP", DEFAULT_TOKEN_OVERLAP)
+        return stream_token_chunks(stream, max_tokens=max_tokens, overlap=overlap)
+    return stream_chunks(stream, chunk_size=chunk_size)
+
+
+def _segment_text(segment: Segment) -> str:
+    return segment.text if isinstance(segment, TextChunk) else segment
+
+
+def _chunk_and_embed(
+    file_id: int,
+    *,
+    chunk_size: int = 600,
+    batch_size: Optional[int] = None,
+    max_tokens: Optional[int] = None,
+    overlap: Optional[int] = None,
+):
+    file = File.objects.get(pk=file_id)
+    source_id = _identical_file(file)
+    if source_id is not None:
+        return _copy_chunks(file, source_id, batch_size=batch_size)
+    file.file.open("rb")
+    try:
+        segments = _segment_stream(file.file, chunk_size=chunk_size, max_tokens=max_tokens, overlap=overlap)
+        first = next(segments, None)
+        if first is None:
+            return []
+        return _ingest_segments(file, chain([first], segments), batch_size=batch_size)
+    finally:
+        file.file.close()
+
+
+def _identical_file(file: File) -> Optional[int]:
+    """Another file of the same client with identical content (same SHA-256) whose chunks already exist."""
+    if not file.sha256 or DocumentChunk.objects.filter(file=file).exists():
+        return None
+    siblings = File.objects.filter(client_id=file.client_id, sha256=file.sha256).exclude(pk=file.pk)
+    return siblings.filter(Exists(DocumentChunk.objects.filter(file=OuterRef("pk")))).order_by("pk").values_list("pk", flat=True).first()
+
+
+def _copy_chunks(file: File, source_id: int, *, batch_size: Optional[int] = None) -> List[int]:
+    """
+    Clone the chunks of an identical file instead of chunking and embedding it again. With dedup
+    enabled the clones point at the originals as near-duplicates, so retrieval is unchanged.
+    """
+    batch_size = _ingest_batch_size(batch_size)
+    dedup = dedup_enabled()
+    ids: List[int] = []
+    with transaction.atomic():
+        File.objects.select_for_update().only("pk").get(pk=file.pk)
+        rows = DocumentChunk.objects.filter(file_id=source_id).order_by("id").iterator(chunk_size=batch_size)
+        for batch in _batched(rows, batch_size):
+            clones = [
+                DocumentChunk(
+                    file=file,
+                    client_id=file.client_id,
+                    text=chunk.text,
+                    fingerprint=chunk.fingerprint,
+                    start_offset=chunk.start_offset,
+                    end_offset=chunk.end_offset,
+                    token_count=chunk.token_count,
+                    byte_start=chunk.byte_start,
+                    byte_end=chunk.byte_end,
+                    embedding=chunk.embedding,
+                    minhash=chunk.minhash,
+                    duplicate_of_id=(chunk.duplicate_of_id or chunk.id) if dedup else None,
+                )
+                for chunk in batch
+            ]
+            created = [chunk.id for chunk in DocumentChunk.objects.bulk_create(clones, batch_size=batch_size)]
+            ids.extend(created)
+            _copy_search_vectors([(chunk_id, chunk.id) for chunk_id, chunk in zip(created, batch) if chunk.byte_start is not None])
+            if not dedup and local_index_enabled():
+                indexed = [(chunk_id, clone.embedding) for chunk_id, clone in zip(created, clones) if clone.embedding is not None]
+                if indexed:
+                    LocalVectorIndex.for_client(file.client).add([chunk_id for chunk_id, _ in indexed], np.asarray([vector for _, vector in indexed], dtype=np.float32))
+        invalidate_retrieval_cache(file.client_id)
+    return ids
+
+
+def _byte_spans(file: File, segments: Sequence[Segment], texts: Sequence[str]) -> List[Optional[tuple]]:
+    """
+    With ``CHUNK_TEXT_STORAGE = "offsets"``, the ``(byte_start, byte_end)`` of each segment whose
+    text reads back unchanged from the stored file; None for segments that must stay inline.
+    """
+    spans: List[Optional[tuple]] = [None] * len(segments)
+    path = media_path(file.file) if offsets_enabled() else None
+    candidates = [index for index, segment in enumerate(segments) if isinstance(segment, TextChunk) and segment.byte_start is not None]
+    if path is None or not candidates:
+        return spans
+    offsets = [(segments[index].byte_start, segments[index].byte_end) for index in candidates]
+    try:
+        stored = get_mapped_files().read_many(path, offsets)
+    except OSError:
+        return spans
+    for index, span, value in zip(candidates, offsets, stored):
+        if value == texts[index]:
+            spans[index] = span
+    return spans
+
+
+def _write_search_vectors(rows: Sequence[tuple]) -> None:
+    """
+    Full-text index offset-stored chunks from ``(chunk_id, text)`` pairs. Their inline text is
+    empty, so the trigger from migration 0013 cannot derive ``search_vector`` on its own.
+    """
+    if not rows or connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany("UPDATE contexts_documentchunk SET search_vector = to_tsvector('simple', %s) WHERE id = %s", [(text, chunk_id) for chunk_id, text in rows])
+
+
+def _copy_search_vectors(pairs: Sequence[tuple]) -> None:
+    """Copy ``search_vector`` from source to clone for ``(clone_id, source_id)`` pairs of offset-stored chunks."""
+    if not pairs or connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            "UPDATE contexts_documentchunk c SET search_vector = s.search_vector FROM contexts_documentchunk s WHERE c.id = %s AND s.id = %s",
+            pairs,
+        )
+
+
+def _insert_segments(file: File, segments: Sequence[Segment], *, batch_size: int, shard: Optional[IngestionShard] = None) -> List[int]:
+    texts = [_segment_text(segment) for segment in segments]
+    spans = _byte_spans(file, segments, texts)
+    embeddings = cached_embeddings(texts)
+    signatures = minhash_signatures(texts) if dedup_enabled() else None
+    if signatures is not None:
+        existing, earlier = find_duplicates(file.client_id, signatures)
+    else:
+        existing = earlier = [None] * len(texts)
+    chunks = [
+        DocumentChunk(
+            file=file,
+            client_id=file.client_id,
+            shard=shard,
+            text="" if spans[index] else text,
+            fingerprint=chunk_fingerprint(text),
+            start_offset=getattr(segment, "start", None),
+            end_offset=getattr(segment, "end", None),
+            token_count=getattr(segment, "token_count", None),
+            byte_start=spans[index][0] if spans[index] else None,
+            byte_end=spans[index][1] if spans[index] else None,
+            embedding=None if embeddings is None else embeddings[index],
+            minhash=None if signatures is None else pack_signature(signatures[index]),
+            duplicate_of_id=existing[index],
+        )
+        for index, (segment, text) in enumerate(zip(segments, texts))
+    ]
+    ids = [chunk.id for chunk in DocumentChunk.objects.bulk_create(chunks, batch_size=batch_size)]
+    _write_search_vectors([(ids[index], texts[index]) for index in range(len(ids)) if spans[index]])
+    followers = [DocumentChunk(pk=ids[index], duplicate_of_id=ids[source]) for index, source in enumerate(earlier) if source is not None]
+    if followers:
+        DocumentChunk.objects.bulk_update(followers, ["duplicate_of"], batch_size=batch_size)
+    canonical = [index for index in range(len(ids)) if existing[index] is None and earlier[index] is None]
+    if signatures is not None:
+        index_bands(file.client_id, [(ids[index], signatures[index]) for index in canonical])
+    invalidate_retrieval_cache(file.client_id)
+    if embeddings is not None and local_index_enabled() and canonical:
+        # Added eagerly: if the transaction rolls back, searches skip ids missing from the database.
+        # Near-duplicates stay out of the index; retrieval never returns them.
+        LocalVectorIndex.for_client(file.client).add([ids[index] for index in canonical], embeddings[canonical])
+    return ids
+
+
+def _promote_duplicates(file: File, removed: Sequence[int]) -> None:
+    """Hand canonical status of chunks about to be deleted to their surviving near-duplicates."""
+    promoted = promote_duplicates(file.client_id, removed)
+    if promoted and local_index_enabled():
+        ids, matrix = DocumentChunk.objects.filter(pk__in=promoted).embedding_matrix()
+        if len(ids):
+            LocalVectorIndex.for_client(file.client).add(ids.tolist(), matrix)
+
+
+def _delete_chunks(file: File, chunks) -> None:
+    """Delete ``chunks`` and tombstone them in the local vector index once the deletion commits."""
+    removed = list(chunks.values_list("id", flat=True))
+    if not removed:
+        return
+    _promote_duplicates(file, removed)
+    if local_index_enabled():
+        index = LocalVectorIndex.for_client(file.client)
+        transaction.on_commit(lambda: index.remove(removed))
+    DocumentChunk.objects.filter(pk__in=removed).delete()
+    invalidate_retrieval_cache(file.client_id)
+
+
+def _ingest_segments(file: File, segments: Iterable[Segment], *, batch_size: Optional[int] = None) -> List[int]:
+    """
+    Diff ``segments`` against the chunks already stored for ``file``. Chunks whose fingerprint
+    reappears keep their row and embedding; only new segments are embedded and inserted and
+    only vanished ones are deleted. Returns chunk ids in segment order.
+    """
+    batch_size = _ingest_batch_size(batch_size)
+    ordered_ids: List[int] = []
+    # One transaction for the whole file: readers never observe a half-ingested document.
+    with transaction.atomic():
+        # Serialize concurrent re-ingests of the same file so they cannot both insert a segment.
+        File.objects.select_for_update().only("pk").get(pk=file.pk)
+        existing: Dict[str, Deque[tuple]] = defaultdict(deque)
+        rows = DocumentChunk.objects.filter(file=file).order_by("id").values_list("id", "fingerprint", "start_offset", "end_offset", "byte_start", "byte_end")
+        for chunk_id, fingerprint, *offsets in rows:
+            existing[fingerprint].append((chunk_id, *offsets))
+
+        for batch in _batched(segments, batch_size):
+            slots: List[Optional[int]] = []
+            fresh = []
+            moved = []
+            offloaded = []
+            for segment in batch:
+                pool = existing.get(chunk_fingerprint(_segment_text(segment)))
+                if not pool:
+                    slots.append(None)
+                    fresh.append(segment)
+                    continue
+                chunk_id, start, end, byte_start, byte_end = pool.popleft()
+                slots.append(chunk_id)
+                if byte_start is not None:
+                    # Offset-stored text must follow the file; without a byte span it goes back inline.
+                    span = (getattr(segment, "byte_start", None), getattr(segment, "byte_end", None))
+                    chars = (getattr(segment, "start", None), getattr(segment, "end", None))
+                    if span != (byte_start, byte_end) or chars != (start, end):
+                        text = "" if span[0] is not None else _segment_text(segment)
+                        offloaded.append(DocumentChunk(pk=chunk_id, text=text, start_offset=chars[0], end_offset=chars[1], byte_start=span[0], byte_end=span[1]))
+                # Unchanged text that shifted within the document only needs its offsets refreshed.
+                elif isinstance(segment, TextChunk) and (segment.start, segment.end) != (start, end):
+                    moved.append(DocumentChunk(pk=chunk_id, start_offset=segment.start, end_offset=segment.end))
+            if moved:
+                DocumentChunk.objects.bulk_update(moved, ["start_offset", "end_offset"], batch_size=batch_size)
+            if offloaded:
+                DocumentChunk.objects.bulk_update(offloaded, ["text", "start_offset", "end_offset", "byte_start", "byte_end"], batch_size=batch_size)
+            if fresh:
+                created = iter(_insert_segments(file, fresh, batch_size=batch_size))
+                slots = [chunk_id if chunk_id is not None else next(created) for chunk_id in slots]
+            ordered_ids.extend(slots)
+
+        # Legacy rows have an empty fingerprint and never match, so they are replaced here too.
+        stale = [chunk_id for pool in existing.values() for chunk_id, *_ in pool]
+        for stale_batch in _batched(stale, batch_size):
+            _delete_chunks(file, DocumentChunk.objects.filter(pk__in=stale_batch))
+    return ordered_ids
+
+
+@task()
+def chunk_and_embed_file_task(
+    file_id: int,
+    *,
+    chunk_size: int = 600,
+    batch_size: Optional[int] = None,
+    max_tokens: Optional[int] = None,
+    overlap: Optional[int] = None,
+):
+    return _chunk_and_embed(file_id, chunk_size=chunk_size, batch_size=batch_size, max_tokens=max_tokens, overlap=overlap)
+
+
+def chunk_and_embed_file(
+    file_id: int,
+    *,
+    chunk_size: int = 600,
+    batch_size: Optional[int] = None,
+    max_tokens: Optional[int] = None,
+    overlap: Optional[int] = None,
+):
+    return _chunk_and_embed(file_id, chunk_size=chunk_size, batch_size=batch_size, max_tokens=max_tokens, overlap=overlap)
+
+
+class _ByteRange:
+    """Read-only view of ``stream[start:end]`` exposing just enough of the file API for the chunker."""
+
+    def __init__(self, stream: BinaryIO, start: int, end: int):
+        stream.seek(start)
+        self._stream = stream
+        self._remaining = max(end - start, 0)
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._stream.read(size) if size else b""
+        self._remaining -= len(data)
+        return data
+
+
+def _shard_bounds(stream: BinaryIO, total: int, shard_bytes: int) -> List[tuple]:
+    """
+    Split ``[0, total)`` into ranges of roughly ``shard_bytes``. Each cut lands just after a
+    full stop so no sentence (and no multi-byte UTF-8 sequence) straddles two shards.
+    """
+    bounds = []
+    start = 0
+    while start < total:
+        cut = start + shard_bytes
+        if cut >= total:
+            bounds.append((start, total))
+            break
+        stream.seek(cut)
+        while True:
+            block = stream.read(DEFAULT_BLOCK_SIZE)
+            if not block:
+                cut = total
+                break
+            stop = block.find(b".")
+            if stop >= 0:
+                cut += stop + 1
+                break
+            cut += len(block)
+        bounds.append((start, cut))
+        start = cut
+    return bounds
+
+
+def _start_sharded_ingestion(file_id: int, *, chunk_size: int = 600, shard_bytes: Optional[int] = None) -> IngestionJob:
     file = File.objects.get(pk=file_id)
-    file.file.open("r")
+    shard_bytes = max(int(shard_bytes or getattr(settings, "INGEST_SHARD_BYTES", DEFAULT_INGEST_SHARD_BYTES)), 1)
+    file.file.open("rb")
     try:
-        content = file.file.read()
+        total = file.file.size
+        bounds = _shard_bounds(file.file, total, shard_bytes)
     finally:
         file.file.close()
-    if isinstance(content, bytes):
-        content = content.decode("utf-8", errors="ignore")
 
-    if not content:
-        return []
+    with transaction.atomic():
+        _delete_chunks(file, DocumentChunk.objects.filter(file=file))
+        job = IngestionJob.objects.create(file=file, chunk_size=chunk_size, shard_count=len(bounds))
+        shards = IngestionShard.objects.bulk_create(
+            IngestionShard(job=job, index=index, start=start, end=end) for index, (start, end) in enumerate(bounds)
+        )
+    if not shards:
+        _finalize_ingestion(job.pk)
+    # Enqueue only after commit so workers never pick up a shard row that does not exist yet.
+    for shard in shards:
+        transaction.on_commit(lambda shard_id=shard.pk: embed_shard_task(shard_id))
+    return job
+
+
+def _embed_shard(shard_id: int, *, batch_size: Optional[int] = None) -> int:
+    """
+    Embed one byte range. Idempotent: the shard's previous chunks are replaced inside the same
+    transaction that flips it to done, so a crashed or re-delivered shard never duplicates rows.
+    """
+    shard = IngestionShard.objects.select_related("job__file").get(pk=shard_id)
+    if shard.status == "done":
+        return shard.chunk_count
+    IngestionShard.objects.filter(pk=shard.pk).update(attempts=F("attempts") + 1)
+    job = shard.job
+    file = job.file
+    batch_size = _ingest_batch_size(batch_size)
+
+    try:
+        file.file.open("rb")
+        try:
+            with transaction.atomic():
+                # A concurrent delivery of the same shard waits on the row lock, then finds it done.
+                locked = IngestionShard.objects.select_for_update().get(pk=shard.pk)
+                if locked.status == "done":
+                    return locked.chunk_count
+                _delete_chunks(file, DocumentChunk.objects.filter(shard=shard))
+                count = 0
+                segments = stream_chunks(_ByteRange(file.file, shard.start, shard.end), chunk_size=job.chunk_size)
+                for batch in _batched(segments, batch_size):
+                    count += len(_insert_segments(file, batch, batch_size=batch_size, shard=shard))
+                IngestionShard.objects.filter(pk=shard.pk).update(status="done", chunk_count=count, error="")
+                IngestionJob.objects.filter(pk=job.pk).update(shards_done=F("shards_done") + 1, updated_at=timezone.now())
+        finally:
+            file.file.close()
+    except Exception as exc:
+        IngestionShard.objects.filter(pk=shard.pk).update(status="failed", error=str(exc))
+        raise
 
-    DocumentChunk.objects.filter(file=file).delete()
+    # The last shard to settle, whether its siblings succeeded or ran out of retries, settles the job.
+    if not job.shards.filter(status="pending").exists():
+        transaction.on_commit(lambda: finalize_ingestion_task(job.pk))
+    return count
 
-    created_ids = []
-    for segment in chunk_text(content, chunk_size=chunk_size):
-        embedding = generate_embedding(segment)
-        chunk = DocumentChunk.objects.create(file=file, text=segment, embedding=embedding)
-        created_ids.append(chunk.id)
-    return created_ids
+
+def _finalize_ingestion(job_id: int) -> IngestionJob:
+    """Mark the job ready or failed once no shard is still pending; until then it keeps running."""
+    job = IngestionJob.objects.get(pk=job_id)
+    if job.shards.filter(status="pending").exists():
+        return job
+    job.status = "failed" if job.shards.exclude(status="done").exists() else "ready"
+    job.completed_at = timezone.now()
+    job.save(update_fields=["status", "completed_at", "updated_at"])
+    return job
+
+
+def ingestion_progress(file_id: int) -> Dict[str, object]:
+    """Snapshot of the latest sharded ingestion for ``file_id``."""
+    job = IngestionJob.objects.filter(file_id=file_id).first()
+    if job is None:
+        return {"status": "none", "shards_done": 0, "shard_count": 0, "progress": 0.0}
+    return {
+        "job_id": job.pk,
+        "status": job.status,
+        "shards_done": job.shards_done,
+        "shard_count": job.shard_count,
+        "progress": job.progress,
+        "failed_shards": list(job.shards.filter(status="failed").values_list("index", flat=True)),
+    }
 
 
 @task()
-def chunk_and_embed_file_task(file_id: int, *, chunk_size: int = 600):
-    return _chunk_and_embed(file_id, chunk_size=chunk_size)
+def chunk_and_embed_file_sharded_task(file_id: int, *, chunk_size: int = 600, shard_bytes: Optional[int] = None):
+    return _start_sharded_ingestion(file_id, chunk_size=chunk_size, shard_bytes=shard_bytes).pk
 
 
-def chunk_and_embed_file(file_id: int, *, chunk_size: int = 600):
-    return _chunk_and_embed(file_id, chunk_size=chunk_size)
+@task(retries=3, retry_delay=10, context=True)
+def embed_shard_task(shard_id: int, task=None):
+    try:
+        return _embed_shard(shard_id)
+    except Exception:
+        if task is not None and task.retries:
+            # A retry is queued, so the shard is still pending as far as the job is concerned.
+            IngestionShard.objects.filter(pk=shard_id, status="failed").update(status="pending")
+        else:
+            # Out of retries: the shard stays failed; settle the job unless siblings are still pending.
+            _finalize_ingestion(IngestionShard.objects.values_list("job_id", flat=True).get(pk=shard_id))
+        raise
+
+
+@task()
+def finalize_ingestion_task(job_id: int):
+    return _finalize_ingestion(job_id).status
@@ -23,3 +23,26 @@ class Client(models.Model):
     def provision_storage(self):
         """Ensure the client's storage domain exists on disk."""
         return ensure_client_media_path(self)
+
+
+class Blob(models.Model):
+    """A media file stored once under its SHA-256 by ContentAddressableStorage."""
+
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    size = models.BigIntegerField(default=0)
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.refcount} refs)"
+
+
+class BlobReference(models.Model):
+    """A storage name (``<client slug>/<filename>``) hardlinked to a blob; each row holds one reference."""
+
+    path = models.CharField(max_length=500, unique=True)
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name="references")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.path} -> {self.blob_id[:12]}"
@@ -1,5 +1,27 @@
+"""
+Client media buckets and the content-addressable storage behind them.
+
+``ContentAddressableStorage`` keeps each distinct file once, under
+``.blobs/<sha[:2]>/<sha>``; the per-client name (``<client slug>/<filename>``)
+is a hardlink to that blob, so paths, ``FieldFile.path`` and memory maps work as
+with plain ``FileSystemStorage``. A ``BlobReference`` row per name keeps the
+blob's reference count; the blob is removed when its last name is deleted.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
 from pathlib import Path
+from typing import Optional, Tuple
+
 from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+
+
+BLOB_DIR = ".blobs"
 
 
 def client_media_path(client) -> Path:
@@ -14,3 +36,126 @@ def ensure_client_media_path(client) -> Path:
     target = client_media_path(client)
     target.mkdir(parents=True, exist_ok=True)
     return target
+
+
+def client_partial_upload_path(client) -> Path:
+    """
+    Directory for resumable uploads still in progress. It lives inside the client's bucket,
+    so completing an upload is a rename rather than a copy.
+    """
+    target = client_media_path(client) / ".partial"
+    target.mkdir(parents=True, exist_ok=True)
+    return target
+
+
+def content_hash(field_file) -> str:
+    """SHA-256 of a stored file when its storage is content addressed, else an empty string."""
+    lookup = getattr(field_file.storage, "content_hash", None)
+    return lookup(field_file.name) if lookup and field_file.name else ""
+
+
+class ContentAddressableStorage(FileSystemStorage):
+    """FileSystemStorage that deduplicates identical content across names and clients."""
+
+    def blob_path(self, digest: str) -> Path:
+        return Path(self.location) / BLOB_DIR / digest[:2] / digest
+
+    def content_hash(self, name: str) -> str:
+        from .models import BlobReference
+
+        return BlobReference.objects.filter(path=name).values_list("blob_id", flat=True).first() or ""
+
+    def _within_location(self, path: str) -> bool:
+        location = os.path.realpath(self.location)
+        return os.path.commonpath([os.path.realpath(path), location]) == location
+
+    def _stage(self, content) -> Tuple[str, str, int]:
+        """Return ``(sha256, staged path, size)``; content is streamed once, never held in memory."""
+        if hasattr(content, "temporary_file_path") and self._within_location(content.temporary_file_path()):
+            # Already on this volume (a finished resumable upload): hash in place and rename into the blob.
+            path = content.temporary_file_path()
+            digest = getattr(content, "sha256", None)
+            if not digest:
+                hasher = hashlib.sha256()
+                with open(path, "rb") as handle:
+                    for block in iter(lambda: handle.read(1024 * 1024), b""):
+                        hasher.update(block)
+                digest = hasher.hexdigest()
+            return digest, path, os.path.getsize(path)
+        # Anything else, including a TemporaryUploadedFile in the system temp dir, which may sit on
+        # another filesystem, is copied into staging next to the blobs so the final rename is local.
+        staging = Path(self.location) / BLOB_DIR / "tmp"
+        staging.mkdir(parents=True, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=staging)
+        hasher = hashlib.sha256()
+        size = 0
+        with os.fdopen(fd, "wb") as handle:
+            for chunk in content.chunks():
+                if isinstance(chunk, str):
+                    chunk = chunk.encode("utf-8")
+                handle.write(chunk)
+                hasher.update(chunk)
+                size += len(chunk)
+        return hasher.hexdigest(), path, size
+
+    def _save(self, name, content):
+        from .models import Blob, BlobReference
+
+        digest, staged, size = self._stage(content)
+        blob = self.blob_path(digest)
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        with transaction.atomic():
+            # The row lock orders this against a concurrent delete of the last reference.
+            Blob.objects.get_or_create(sha256=digest, defaults={"size": size})
+            Blob.objects.select_for_update().get(pk=digest)
+            if blob.exists():
+                os.unlink(staged)
+            else:
+                os.replace(staged, blob)
+                if self.file_permissions_mode is not None:
+                    os.chmod(blob, self.file_permissions_mode)
+            name = self._link(blob, name)
+            # A row left for a name that no longer existed on disk is stale; drop its reference.
+            self._release(name)
+            BlobReference.objects.create(path=name, blob_id=digest)
+            Blob.objects.filter(pk=digest).update(refcount=F("refcount") + 1)
+        return name
+
+    def _link(self, blob: Path, name: str) -> str:
+        full_path = self.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        while True:
+            try:
+                os.link(blob, full_path)
+            except FileExistsError:
+                name = self.get_available_name(name)
+                full_path = self.path(name)
+            except OSError:
+                # No hardlinks here (e.g. another filesystem): fall back to a private copy.
+                with open(blob, "rb") as source, open(full_path, "xb") as target:
+                    shutil.copyfileobj(source, target)
+                break
+            else:
+                break
+        return os.path.relpath(full_path, self.location).replace("\\", "/")
+
+    def _release(self, name: str) -> Optional[str]:
+        from .models import Blob, BlobReference
+
+        reference = BlobReference.objects.filter(path=name).first()
+        if reference is None:
+            return None
+        digest = reference.blob_id
+        blob = Blob.objects.select_for_update().get(pk=digest)
+        reference.delete()
+        if blob.refcount <= 1:
+            blob.delete()
+            self.blob_path(digest).unlink(missing_ok=True)
+        else:
+            Blob.objects.filter(pk=digest).update(refcount=F("refcount") - 1)
+        return digest
+
+    def delete(self, name):
+        super().delete(name)
+        with transaction.atomic():
+            self._release(name)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prompts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prompttemplate',
+            name='retrieval_mode',
+            field=models.CharField(choices=[('vector', 'Vector'), ('hybrid', 'Hybrid (vector + full text)')], default='vector', max_length=16),
+        ),
+    ]
@@ -34,6 +34,11 @@ class ModelConfig(models.Model):
 
 
 class PromptTemplate(models.Model):
+    RETRIEVAL_MODE_CHOICES = [
+        ("vector", "Vector"),
+        ("hybrid", "Hybrid (vector + full text)"),
+    ]
+
     name = models.CharField(max_length=150, unique=True)
     body = models.TextField()
     provider = models.ForeignKey(Provider, on_delete=models.PROTECT, null=True, blank=True, related_name="templates")
@@ -41,6 +46,7 @@ class PromptTemplate(models.Model):
     rate_card = models.ForeignKey("billing.ProviderRateCard", on_delete=models.SET_NULL, null=True, blank=True, related_name="templates")
     retrieval_k = models.PositiveSmallIntegerField(default=3)
     retrieval_min_score = models.FloatField(default=0.0)
+    retrieval_mode = models.CharField(max_length=16, choices=RETRIEVAL_MODE_CHOICES, default="vector")
     metadata = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
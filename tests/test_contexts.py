@@ -1,11 +1,22 @@
+import importlib
+import io
 import math
+from types import SimpleNamespace
 
+import numpy as np
 import pytest
+import tiktoken
+from django.apps import apps
 from django.core.files.base import ContentFile
+from django.db import connection
 
-from contexts.embeddings import generate_embedding
-from contexts.models import DocumentChunk, Category
-from contexts.tasks import chunk_and_embed_file
+from contexts.cache import EmbeddingCache, cached_embeddings
+from contexts.chunk_store import load_chunk_texts
+from contexts.embeddings import HashEmbeddingProvider, chunk_text, generate_embedding, generate_embeddings, stream_chunks, stream_token_chunks
+from contexts.models import DocumentChunk, Category, IngestionShard
+from contexts.retrieval import _local_lexical_ranking, search_chunks
+from contexts import tasks as tasks_module
+from contexts.tasks import _embed_shard, _finalize_ingestion, _start_sharded_ingestion, chunk_and_embed_file, embed_shard_task, finalize_ingestion_task, ingestion_progress
 from domains.models import Client
 from uploads.models import File
 
@@ -46,3 +57,293 @@ def test_vector_search_returns_expected_chunk(settings, tmp_path):
     scored = sorted(((similarity(chunk.embedding, query_embedding), chunk) for chunk in chunks if chunk.embedding), reverse=True)
     top_score, top_chunk = scored[0]
     assert "Support" in top_chunk.text or top_score > 0
+
+
+@pytest.mark.story("S-016")
+def test_batched_ingestion_returns_ids_in_segment_order(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+    settings.PGVECTOR_DISABLED = False
+    client = Client.objects.create(name="Acme")
+    category = Category.objects.create(name="Contracts")
+    body = " ".join(f"Sentence number {index} of the contract." for index in range(40))
+    upload = File.objects.create(client=client, file=ContentFile(body.encode("utf-8"), name="contract.txt"), category=category)
+    chunk_ids = chunk_and_embed_file(upload.id, chunk_size=80, batch_size=3)
+    chunks = list(DocumentChunk.objects.filter(file=upload).order_by("id"))
+    assert [chunk.id for chunk in chunks] == chunk_ids
+    assert len(chunk_ids) > 3
+    assert chunks[0].text.startswith("Sentence number 0")
+    # Re-ingesting replaces the previous rows rather than appending to them.
+    assert len(chunk_and_embed_file(upload.id, chunk_size=80, batch_size=3)) == DocumentChunk.objects.filter(file=upload).count()
+
+
+@pytest.mark.story("S-016")
+def test_stream_chunks_matches_chunk_text_across_block_edges():
+    text = " ".join(f"Grüße aus Köln №{index} — naïve café. Second clause here" for index in range(30)) + "."
+    payload = text.encode("utf-8")
+    expected = list(chunk_text(text, chunk_size=90))
+    for block_size in (1, 3, 7, 64):
+        assert list(stream_chunks(io.BytesIO(payload), chunk_size=90, block_size=block_size)) == expected
+
+
+@pytest.mark.story("S-016")
+def test_generate_embeddings_returns_float32_matrix(settings):
+    settings.PGVECTOR_DISABLED = False
+    texts = ["alpha", "beta", "alpha"]
+    matrix = generate_embeddings(texts, dimensions=64)
+    assert matrix.dtype == np.float32 and matrix.shape == (3, 64)
+    assert matrix.flags["C_CONTIGUOUS"]
+    assert np.array_equal(matrix[0], matrix[2])
+    assert np.allclose(matrix[1], generate_embedding("beta", dimensions=64))
+
+
+@pytest.mark.story("S-016")
+def test_embedding_cache_skips_recomputing_identical_text(settings):
+    settings.PGVECTOR_DISABLED = False
+
+    class CountingProvider(HashEmbeddingProvider):
+        calls = 0
+
+        def embed(self, texts, dimensions):
+            CountingProvider.calls += len(texts)
+            return super().embed(texts, dimensions)
+
+    provider = CountingProvider()
+    cache = EmbeddingCache(max_entries=2)
+    first = cached_embeddings(["Boilerplate clause.", "Boilerplate  clause.", "Other."], dimensions=32, provider=provider, cache=cache)
+    assert CountingProvider.calls == 2
+    assert np.array_equal(first[0], first[1])
+    second = cached_embeddings(["Boilerplate clause."], dimensions=32, provider=provider, cache=cache)
+    assert CountingProvider.calls == 2
+    assert np.array_equal(second[0], first[0])
+    stats = cache.stats()
+    assert stats["local_hits"] == 1 and stats["misses"] == 2 and stats["size"] == 2
+    cached_embeddings(["Third."], dimensions=32, provider=provider, cache=cache)
+    assert cache.stats()["evictions"] == 1
+
+
+@pytest.mark.story("S-016")
+def test_reingest_keeps_unchanged_chunks(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+    settings.PGVECTOR_DISABLED = False
+    client = Client.objects.create(name="Acme")
+    category = Category.objects.create(name="Policies")
+    paragraphs = [f"Paragraph {index} describes policy number {index} in detail." for index in range(6)]
+    upload = File.objects.create(client=client, file=ContentFile(" ".join(paragraphs).encode("utf-8"), name="policy.txt"), category=category)
+    original_ids = chunk_and_embed_file(upload.id, chunk_size=60)
+    assert len(original_ids) == 6
+
+    paragraphs[2] = "Paragraph 2 was rewritten entirely."
+    upload.file.save("policy.txt", ContentFile(" ".join(paragraphs).encode("utf-8")), save=True)
+    revised_ids = chunk_and_embed_file(upload.id, chunk_size=60)
+
+    assert len(revised_ids) == 6
+    assert [revised_ids[i] for i in (0, 1, 3, 4, 5)] == [original_ids[i] for i in (0, 1, 3, 4, 5)]
+    assert revised_ids[2] not in original_ids
+    assert not DocumentChunk.objects.filter(pk=original_ids[2]).exists()
+    assert set(DocumentChunk.objects.filter(file=upload).values_list("id", flat=True)) == set(revised_ids)
+
+
+@pytest.mark.story("S-016")
+def test_sharded_ingestion_fans_out_and_is_idempotent(settings, tmp_path, django_capture_on_commit_callbacks):
+    settings.MEDIA_ROOT = tmp_path
+    settings.PGVECTOR_DISABLED = False
+    client = Client.objects.create(name="Acme")
+    category = Category.objects.create(name="Manuals")
+    body = " ".join(f"Step {index} of the maintenance procedure is documented here." for index in range(50))
+    upload = File.objects.create(client=client, file=ContentFile(body.encode("utf-8"), name="manual.txt"), category=category)
+
+    with django_capture_on_commit_callbacks() as enqueued:
+        job = _start_sharded_ingestion(upload.id, chunk_size=120, shard_bytes=512)
+    assert len(enqueued) == job.shard_count > 1
+    for shard in job.shards.all():
+        with django_capture_on_commit_callbacks() as finalizers:
+            _embed_shard(shard.pk)
+        assert ingestion_progress(upload.id)["shards_done"] == shard.index + 1
+    assert len(finalizers) == 1
+    _finalize_ingestion(job.pk)
+    assert ingestion_progress(upload.id)["status"] == "ready"
+    shards = list(job.shards.all())
+    assert shards[0].start == 0 and shards[-1].end == upload.file.size
+    assert all(left.end == right.start for left, right in zip(shards, shards[1:]))
+    total = DocumentChunk.objects.filter(file=upload).count()
+    assert total == sum(shard.chunk_count for shard in shards)
+
+    # A re-delivered shard is a no-op; a reset (crashed) shard replaces only its own rows.
+    _embed_shard(shards[0].pk)
+    IngestionShard.objects.filter(pk=shards[1].pk).update(status="failed")
+    _embed_shard(shards[1].pk)
+    assert DocumentChunk.objects.filter(file=upload).count() == total
+
+
+@pytest.mark.story("S-016")
+def test_shard_out_of_retries_fails_the_job_once_siblings_settle(settings, tmp_path, monkeypatch, django_capture_on_commit_callbacks):
+    settings.MEDIA_ROOT = tmp_path
+    settings.PGVECTOR_DISABLED = False
+    monkeypatch.setattr("contexts.tasks.finalize_ingestion_task", finalize_ingestion_task.call_local)
+    client = Client.objects.create(name="Acme")
+    category = Category.objects.create(name="Manuals")
+    body = " ".join(f"Step {index} of the maintenance procedure is documented here." for index in range(30))
+    upload = File.objects.create(client=client, file=ContentFile(body.encode("utf-8"), name="manual.txt"), category=category)
+    with django_capture_on_commit_callbacks():
+        job = _start_sharded_ingestion(upload.id, chunk_size=120, shard_bytes=512)
+    broken_shard, healthy_shard = list(job.shards.all())[:2]
+    stream_chunks = tasks_module.stream_chunks
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("embedding provider unavailable")
+
+    monkeypatch.setattr(tasks_module, "stream_chunks", broken)
+    # A failure with retries left keeps the shard pending.
+    with pytest.raises(RuntimeError):
+        embed_shard_task.call_local(broken_shard.pk, task=SimpleNamespace(retries=2))
+    assert IngestionShard.objects.get(pk=broken_shard.pk).status == "pending"
+    # Out of retries while siblings are still pending: the job keeps running.
+    with pytest.raises(RuntimeError):
+        embed_shard_task.call_local(broken_shard.pk)
+    assert ingestion_progress(upload.id)["status"] == "running"
+
+    monkeypatch.setattr(tasks_module, "stream_chunks", stream_chunks)
+    for shard in job.shards.filter(status="pending"):
+        with django_capture_on_commit_callbacks(execute=True):
+            embed_shard_task.call_local(shard.pk)
+    progress = ingestion_progress(upload.id)
+    assert progress["status"] == "failed" and progress["failed_shards"] == [broken_shard.index]
+    assert IngestionShard.objects.get(pk=healthy_shard.pk).status == "done"
+
+
+@pytest.fixture
+def byte_encoding(monkeypatch):
+    """Offline byte-level tiktoken encoding so tests never download BPE ranks."""
+    encoding = tiktoken.Encoding(
+        name="test-bytes",
+        pat_str=r""" ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+""",
+        mergeable_ranks={bytes([value]): value for value in range(256)},
+        special_tokens={},
+    )
+    monkeypatch.setattr("contexts.embeddings.get_encoding", lambda model=None: encoding)
+    return encoding
+
+
+@pytest.mark.story("S-016")
+def test_token_chunks_respect_budget_overlap_and_offsets(byte_encoding):
+    text = " ".join(f"Wört {index} ünd" for index in range(120))
+    chunks = list(stream_token_chunks(io.BytesIO(text.encode("utf-8")), max_tokens=40, overlap=8, encoding=byte_encoding, block_size=64))
+    assert chunks[0].start == 0 and chunks[-1].end == len(text)
+    assert all(chunk.token_count <= 40 for chunk in chunks)
+    assert all(text[chunk.start:chunk.end] == chunk.text for chunk in chunks)
+    assert all(text.encode("utf-8")[chunk.byte_start:chunk.byte_end].decode("utf-8") == chunk.text for chunk in chunks)
+    assert all(following.start < preceding.end for preceding, following in zip(chunks, chunks[1:]))
+
+
+@pytest.mark.story("S-016")
+def test_token_budgeted_ingestion_records_offsets(settings, tmp_path, byte_encoding):
+    settings.MEDIA_ROOT = tmp_path
+    settings.PGVECTOR_DISABLED = False
+    client = Client.objects.create(name="Acme")
+    category = Category.objects.create(name="Specs")
+    body = " ".join(f"Requirement {index} shall hold." for index in range(30))
+    upload = File.objects.create(client=client, file=ContentFile(body.encode("utf-8"), name="spec.txt"), category=category)
+    chunk_ids = chunk_and_embed_file(upload.id, max_tokens=64, overlap=16)
+    chunks = DocumentChunk.objects.in_bulk(chunk_ids)
+    assert all(body[chunk.start_offset:chunk.end_offset] == chunk.text for chunk in chunks.values())
+    assert all(chunk.token_count <= 64 for chunk in chunks.values())
+
+
+@pytest.mark.story("S-016")
+def test_offset_stored_chunks_read_text_from_file(settings, tmp_path, byte_encoding):
+    settings.MEDIA_ROOT = tmp_path / "media"
+    settings.VECTOR_INDEX_ROOT = tmp_path / "index"
+    settings.LOCAL_VECTOR_INDEX = True
+    settings.CHUNK_TEXT_STORAGE = "offsets"
+    client = Client.objects.create(name="Acme")
+    body = " ".join(f"Prüfung {index} für Kunden." for index in range(40))
+    upload = File.objects.create(client=client, file=ContentFile(body.encode("utf-8"), name="spec.txt"), category=Category.objects.create(name="Specs"))
+    chunk_ids = chunk_and_embed_file(upload.id, max_tokens=48, overlap=8)
+    chunks = DocumentChunk.objects.in_bulk(chunk_ids)
+    assert all(chunk.text == "" and chunk.byte_start is not None for chunk in chunks.values())
+
+    target = chunks[chunk_ids[3]]
+    expected = body[target.start_offset:target.end_offset]
+    results = search_chunks(client, generate_embedding(expected), k=1)
+    assert [(result.id, result.text) for result in results] == [(target.pk, expected)]
+    # The lexical arm matches offset-stored text too.
+    [best] = _local_lexical_ranking(client, "Prüfung 17", 1)
+    assert "Prüfung 17 " in body[chunks[best].start_offset:chunks[best].end_offset]
+
+    # A 40-byte prefix (one token stride) realigns the windows, so every chunk is kept but
+    # its byte span shifts by 40 while its character span shifts by 37.
+    revised = "Übersicht über Prüfungen im Jahr 20. " + body
+    upload.file.save("spec.txt", ContentFile(revised.encode("utf-8")))
+    chunk_ids = chunk_and_embed_file(upload.id, max_tokens=48, overlap=8)
+    texts = load_chunk_texts(chunk_ids)
+    assert target.pk in chunk_ids
+    assert all(texts[pk] == revised[chunk.start_offset:chunk.end_offset] for pk, chunk in DocumentChunk.objects.in_bulk(chunk_ids).items())
+
+
+@pytest.mark.story("S-016")
+def test_identical_upload_reuses_existing_chunks(settings, tmp_path, monkeypatch):
+    settings.MEDIA_ROOT = tmp_path
+    settings.LOCAL_VECTOR_INDEX = True
+    settings.VECTOR_INDEX_ROOT = tmp_path / "index"
+    client = Client.objects.create(name="Acme")
+    category = Category.objects.create(name="General")
+    body = b"Terms of service. Payment is due in thirty days. " * 20
+    original = File.objects.create(client=client, file=ContentFile(body, name="terms.txt"), category=category)
+    original_ids = chunk_and_embed_file(original.id)
+    copy = File.objects.create(client=client, file=ContentFile(body, name="terms-copy.txt"), category=category)
+
+    monkeypatch.setattr("contexts.tasks.cached_embeddings", lambda texts: pytest.fail("identical content was embedded again"))
+    copy_ids = chunk_and_embed_file(copy.id)
+    clones = DocumentChunk.objects.in_bulk(copy_ids)
+    assert len(copy_ids) == len(original_ids)
+    assert {chunk.duplicate_of_id for chunk in clones.values()} <= set(original_ids)
+    assert all(chunk.text and chunk.embedding is not None for chunk in clones.values())
+
+
+@pytest.mark.story("S-016")
+def test_embeddings_load_as_numpy_matrix(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+    settings.LOCAL_VECTOR_INDEX = True
+    client = Client.objects.create(name="Acme")
+    upload = File.objects.create(client=client, file=ContentFile(b"x", name="x.txt"), category=Category.objects.create(name="General"))
+    texts = [f"chunk {index}" for index in range(5)]
+    expected = generate_embeddings(texts)
+    chunks = DocumentChunk.objects.bulk_create(DocumentChunk(file=upload, text=text, embedding=expected[index]) for index, text in enumerate(texts))
+    DocumentChunk.objects.create(file=upload, text="pending")
+
+    assert isinstance(DocumentChunk.objects.get(pk=chunks[0].pk).embedding, list)
+    array = DocumentChunk.objects.with_numpy_embeddings().get(pk=chunks[0].pk).embedding_array
+    assert array.dtype == np.float32 and not array.flags.writeable
+
+    ids, matrix = DocumentChunk.objects.order_by("id").embedding_matrix()
+    assert ids.tolist() == [chunk.pk for chunk in chunks]
+    assert matrix.flags.c_contiguous and np.allclose(matrix, expected)
+    assert DocumentChunk.objects.order_by("id")[:2].embedding_matrix()[1].shape == (2, 1536)
+
+
+@pytest.mark.story("S-016")
+def test_embeddings_stored_as_packed_blobs(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+    settings.LOCAL_VECTOR_INDEX = True
+    client = Client.objects.create(name="Acme")
+    upload = File.objects.create(client=client, file=ContentFile(b"x", name="x.txt"), category=Category.objects.create(name="General"))
+    vector = generate_embeddings(["alpha"])[0]
+    chunk = DocumentChunk.objects.create(file=upload, text="alpha", embedding=vector)
+    legacy = DocumentChunk.objects.create(file=upload, text="beta", embedding=vector)
+    with connection.cursor() as cursor:
+        cursor.execute("UPDATE contexts_documentchunk SET embedding = %s WHERE id = %s", ["[" + ",".join(map(str, vector.tolist())) + "]", legacy.pk])
+        cursor.execute("SELECT length(embedding), typeof(embedding) FROM contexts_documentchunk WHERE id = %s", [chunk.pk])
+        assert cursor.fetchone() == (4 + 1536 * 4, "blob")
+
+    assert np.allclose(DocumentChunk.objects.get(pk=legacy.pk).embedding, vector)
+    migration = importlib.import_module("contexts.migrations.0009_documentchunk_embedding_blob")
+    # The SQLite schema editor cannot open inside the test transaction; RunPython only needs .connection.
+    migration.encode_embeddings(apps, SimpleNamespace(connection=connection))
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT typeof(embedding) FROM contexts_documentchunk WHERE id = %s", [legacy.pk])
+        assert cursor.fetchone() == ("blob",)
+    assert DocumentChunk.objects.get(pk=legacy.pk).embedding == DocumentChunk.objects.get(pk=chunk.pk).embedding
+
+    settings.EMBEDDING_BLOB_DTYPE = "float16"
+    half = DocumentChunk.objects.create(file=upload, text="gamma", embedding=vector)
+    assert np.allclose(DocumentChunk.objects.with_numpy_embeddings().get(pk=half.pk).embedding_array, vector, atol=1e-3)
@@ -1,5 +1,11 @@
+import importlib
+from types import SimpleNamespace
+
 import pytest
+from django.apps import apps as django_apps
 from django.core.files.base import ContentFile
+from django.db import connection
+from taggit.models import Tag
 
 from contexts.models import Category
 from domains.models import Client
@@ -21,3 +27,33 @@ def test_select_docs_no_duplicates(settings, tmp_path, django_user_model):
 
     results = select_docs(categories=[cat_a], tags=["alpha"])
     assert set(results) == {f1, f2}
+
+
+@pytest.mark.story("S-015")
+def test_tag_slugs_follow_tag_changes(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+    client = Client.objects.create(name="Acme")
+    category = Category.objects.create(name="General")
+    doc = File.objects.create(client=client, file=ContentFile(b"a", name="a.txt"), category=category)
+    other = File.objects.create(client=client, file=ContentFile(b"b", name="b.txt"), category=category)
+
+    doc.tags.add("Beta", "alpha")
+    other.tags.add("alpha")
+    doc.refresh_from_db()
+    assert doc.tag_slugs == ["alpha", "beta"]
+
+    doc.tags.remove("Beta")
+    tag = Tag.objects.get(name="alpha")
+    tag.slug = "first"
+    tag.save()
+    assert File.objects.get(pk=doc.pk).tag_slugs == ["first"] and File.objects.get(pk=other.pk).tag_slugs == ["first"]
+    assert set(select_docs(tags=["alpha"])) == {doc, other}
+
+    tag.delete()
+    assert File.objects.get(pk=doc.pk).tag_slugs == []
+
+    other.tags.add("gamma")
+    File.objects.update(tag_slugs=[])
+    backfill = importlib.import_module("uploads.migrations.0005_file_tag_slugs").backfill_tag_slugs
+    backfill(django_apps, SimpleNamespace(connection=connection))
+    assert File.objects.get(pk=other.pk).tag_slugs == ["gamma"]
@@ -0,0 +1,363 @@
+import importlib
+import inspect
+import io
+import json
+
+import numpy as np
+import pytest
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+
+from contexts import cache as cache_module
+from contexts.ann import LocalVectorIndex
+from contexts.dedup import minhash_signatures
+from contexts.embeddings import generate_embedding
+from contexts.models import Category, DocumentChunk
+from contexts.partitions import create_tenant_index_sql
+from contexts.cache import get_retrieval_cache
+from contexts.metrics import retrieval_metrics
+from contexts.quantization import dequantize_int8, quantization_mode, quantize_int8
+from contexts.retrieval import ChunkFilter, _pgvector_queryset, hybrid_search_chunks, retrieve_for_template, rrf_fuse, search_chunks
+from contexts.tasks import chunk_and_embed_file
+from domains.models import Client
+from prompts.models import PromptTemplate
+from uploads.models import File
+
+
+@pytest.fixture
+def local_index(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path / "media"
+    settings.VECTOR_INDEX_ROOT = tmp_path / "index"
+    settings.PGVECTOR_DISABLED = True
+    settings.LOCAL_VECTOR_INDEX = True
+    return settings
+
+
+@pytest.mark.story("S-016")
+def test_local_index_search_matches_brute_force(tmp_path):
+    rng = np.random.default_rng(7)
+    vectors = rng.standard_normal((1500, 16)).astype(np.float32)
+    index = LocalVectorIndex(tmp_path / "acme", dimensions=16, nprobe=40)
+    index.rebuild(enumerate(vectors, start=1))
+    index.add([5000], vectors[:1] * 2)
+    index.remove([1])
+
+    query = vectors[0]
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    expected = [int(i) + 1 for i in np.argsort(-(unit @ (query / np.linalg.norm(query))))[1:5]]
+    hits = index.search(query, k=5)
+    assert hits[0][0] == 5000 and hits[0][1] == pytest.approx(1.0, abs=1e-5)
+    assert [chunk_id for chunk_id, _ in hits[1:]] == expected
+    assert len(index) == 1500
+
+
+@pytest.mark.story("S-016")
+def test_ingestion_updates_local_index_and_retrieval(local_index, django_capture_on_commit_callbacks):
+    client = Client.objects.create(name="Edge")
+    category = Category.objects.create(name="Manuals")
+    body = "Reset the router by holding the button. Replace the filter every month. Invoice INV-2024 is overdue."
+    upload = File.objects.create(client=client, file=ContentFile(body.encode("utf-8"), name="notes.txt"), category=category)
+    chunk_ids = chunk_and_embed_file(upload.id, chunk_size=40)
+    assert DocumentChunk.objects.get(pk=chunk_ids[0]).embedding is not None
+
+    target = DocumentChunk.objects.get(pk=chunk_ids[1])
+    results = search_chunks(client, generate_embedding(target.text), k=1)
+    assert [result.id for result in results] == [target.id]
+    assert results[0].score == pytest.approx(1.0, abs=1e-5)
+
+    template = PromptTemplate.objects.create(name="faq", body="{{ prompt }}", retrieval_k=2, retrieval_min_score=0.99)
+    assert [result.id for result in retrieve_for_template(template, client, target.text)] == [target.id]
+
+    upload.file.save("notes.txt", ContentFile(b"Only one sentence remains."), save=True)
+    with django_capture_on_commit_callbacks(execute=True):
+        chunk_and_embed_file(upload.id, chunk_size=40)
+    assert search_chunks(client, generate_embedding(target.text), k=3, min_score=0.99) == []
+
+    call_command("build_vector_index", client=[client.slug])
+    assert len(LocalVectorIndex.for_client(client)) == DocumentChunk.objects.filter(file=upload).count()
+
+
+@pytest.mark.story("S-016")
+def test_deleting_a_file_drops_its_chunks_from_local_index(local_index, django_capture_on_commit_callbacks):
+    client = Client.objects.create(name="Edge")
+    category = Category.objects.create(name="Manuals")
+    kept = File.objects.create(client=client, file=ContentFile(b"Router reset steps. Hold the button for ten seconds.", name="kept.txt"), category=category)
+    gone = File.objects.create(client=client, file=ContentFile(b"Router firmware notes. Version two fixes the reset loop.", name="gone.txt"), category=category)
+    chunk_and_embed_file(kept.id, chunk_size=30)
+    chunk_and_embed_file(gone.id, chunk_size=30)
+    remaining = DocumentChunk.objects.filter(file=kept).count()
+
+    with django_capture_on_commit_callbacks(execute=True):
+        gone.delete()
+
+    assert len(LocalVectorIndex.for_client(client)) == remaining
+    results = search_chunks(client, generate_embedding("router reset"), k=remaining, min_score=-1.0)
+    assert len(results) == remaining and {result.file_id for result in results} == {kept.id}
+
+
+@pytest.mark.story("S-016")
+def test_pgvector_retrieval_orders_by_cosine_distance_with_hnsw_index():
+    migration = importlib.import_module("contexts.migrations.0006_documentchunk_embedding_hnsw")
+    client = Client.objects.create(name="Acme")
+    sql = str(_pgvector_queryset(client, [0.1] * 1536, 5).query)
+    assert "<=>" in sql and "ORDER BY" in sql and "LIMIT 5" in sql
+    assert migration.Migration.atomic is False
+    assert "vector_cosine_ops" in inspect.getsource(migration.create_hnsw_index)
+
+
+@pytest.mark.story("S-016")
+def test_search_records_latency_metrics(local_index):
+    retrieval_metrics.reset()
+    client = Client.objects.create(name="Edge")
+    search_chunks(client, generate_embedding("anything"), k=2)
+    snapshot = retrieval_metrics.snapshot()
+    assert snapshot["timings"]["retrieval.local"]["count"] == 1
+    assert snapshot["counters"]["retrieval.local.calls"] == 1
+
+
+@pytest.mark.story("S-016")
+def test_rrf_fuse_rewards_agreement():
+    fused = rrf_fuse([[1, 2, 3], [3, 4]], k=3, rrf_k=60)
+    assert [chunk_id for chunk_id, _ in fused] == [3, 1, 2]
+
+
+@pytest.mark.story("S-016")
+def test_hybrid_template_surfaces_exact_identifier(local_index):
+    client = Client.objects.create(name="Edge")
+    category = Category.objects.create(name="Invoices")
+    upload = File.objects.create(client=client, file=ContentFile(b"x", name="invoices.txt"), category=category)
+    texts = [f"Invoice INV-{index:04d} covers delivery and payment terms." for index in range(30)]
+    for text in texts:
+        DocumentChunk.objects.create(file=upload, text=text, embedding=generate_embedding(text))
+    LocalVectorIndex.for_client(client).rebuild(DocumentChunk.objects.values_list("id", "embedding"))
+
+    vector_template = PromptTemplate.objects.create(name="vector", body="{{ prompt }}", retrieval_k=3)
+    hybrid_template = PromptTemplate.objects.create(name="billing", body="{{ prompt }}", retrieval_k=3, retrieval_mode="hybrid")
+    # Hash embeddings carry no meaning, so only the full-text arm can find the identifier.
+    assert not any("INV-0017" in result.text for result in retrieve_for_template(vector_template, client, "status of INV-0017"))
+    assert any("INV-0017" in result.text for result in retrieve_for_template(hybrid_template, client, "status of INV-0017"))
+
+
+@pytest.mark.story("S-016")
+def test_bench_retrieval_reports_json(local_index):
+    buffer = io.StringIO()
+    call_command("bench_retrieval", chunks=[40, 80], queries=10, k=3, stdout=buffer)
+    report = json.loads(buffer.getvalue())
+    results = {(row["chunks"], row["backend"], row["quantization"], row["mode"]): row for row in report["results"]}
+    assert set(results) == {(size, "local", quantization, mode) for size in (40, 80) for quantization in ("none", "int8") for mode in ("vector", "hybrid")}
+    assert results[(80, "local", "none", "vector")]["recall@3"] >= 0.9
+    assert results[(80, "local", "int8", "hybrid")]["recall@3"] == 1.0
+    assert {"p50_ms", "p95_ms", "p99_ms"} <= set(results[(40, "local", "none", "hybrid")])
+    assert not Client.objects.filter(name__startswith="bench-retrieval").exists()
+
+
+@pytest.mark.story("S-016")
+def test_int8_local_index_reranks_to_exact_results(tmp_path):
+    rng = np.random.default_rng(3)
+    vectors = rng.standard_normal((400, 32)).astype(np.float32)
+    exact = LocalVectorIndex(tmp_path / "exact", dimensions=32, quantization="none")
+    quantized = LocalVectorIndex(tmp_path / "int8", dimensions=32, quantization="int8")
+    exact.rebuild(enumerate(vectors))
+    quantized.rebuild(enumerate(vectors[:300]))
+    quantized.add(list(range(300, 400)), vectors[300:])
+    assert (tmp_path / "int8" / "codes.i8").stat().st_size == 400 * 32
+
+    codes, scales = quantize_int8(vectors)
+    assert np.abs(dequantize_int8(codes, scales) - vectors).max() < np.abs(vectors).max() / 100
+    for query in vectors[:20]:
+        assert [chunk_id for chunk_id, _ in quantized.search(query, k=5)] == [chunk_id for chunk_id, _ in exact.search(query, k=5)]
+
+
+@pytest.mark.story("S-016")
+def test_halfvec_mode_reranks_coarse_shortlist(settings):
+    settings.PGVECTOR_DISABLED = False
+    settings.EMBEDDING_QUANTIZATION = "halfvec"
+    sql = str(_pgvector_queryset(Client.objects.create(name="Acme"), [0.1] * 1536, 5).query)
+    assert "halfvec(1536)" in sql and "LIMIT 20" in sql and sql.rstrip().endswith("LIMIT 5")
+
+
+@pytest.mark.story("S-016")
+def test_quantization_mode_must_match_vector_backend(settings):
+    settings.PGVECTOR_DISABLED = False
+    settings.EMBEDDING_QUANTIZATION = "int8"
+    with pytest.raises(ValueError, match="local backend"):
+        quantization_mode()
+    settings.PGVECTOR_DISABLED = True
+    assert quantization_mode() == "int8"
+    settings.EMBEDDING_QUANTIZATION = "halfvec"
+    with pytest.raises(ValueError, match="pgvector backend"):
+        quantization_mode()
+
+
+@pytest.mark.story("S-016")
+def test_quantization_report(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+    settings.PGVECTOR_DISABLED = False
+    client = Client.objects.create(name="Acme")
+    upload = File.objects.create(client=client, file=ContentFile(b"x", name="x.txt"), category=Category.objects.create(name="General"))
+    DocumentChunk.objects.bulk_create(DocumentChunk(file=upload, text=f"chunk {index}", embedding=generate_embedding(f"chunk {index}")) for index in range(40))
+    buffer = io.StringIO()
+    call_command("quantization_report", k=5, queries=10, stdout=buffer)
+    report = json.loads(buffer.getvalue())
+    assert report["modes"]["halfvec"]["estimated_saved_pct"] == 50.0
+    assert report["measured"] is None
+    assert report["modes"]["int8"]["recall@5_reranked"] >= 0.9
+
+
+@pytest.mark.story("S-016")
+def test_retrieval_cache_serves_repeats_until_corpus_changes(local_index, monkeypatch, django_capture_on_commit_callbacks):
+    monkeypatch.setattr(cache_module, "_retrieval_cache", None)
+    local_index.RETRIEVAL_CACHE_ENABLED = True
+    retrieval_metrics.reset()
+    client = Client.objects.create(name="Edge")
+    upload = File.objects.create(client=client, file=ContentFile(b"Reset the router. Replace the filter.", name="faq.txt"), category=Category.objects.create(name="FAQ"))
+    with django_capture_on_commit_callbacks(execute=True):
+        chunk_and_embed_file(upload.id, chunk_size=20)
+    query = generate_embedding("Reset the router.")
+
+    first = search_chunks(client, query, k=2)
+    assert search_chunks(client, query, k=2) == first
+    assert search_chunks(client, query, k=1) == first[:1]
+    counters = retrieval_metrics.snapshot()["counters"]
+    assert (counters["retrieval.cache.hits"], counters["retrieval.cache.misses"]) == (1, 2)
+    assert get_retrieval_cache().stats()["hit_rate"] == pytest.approx(1 / 3)
+
+    upload.file.save("faq.txt", ContentFile(b"Reset the modem."), save=True)
+    with django_capture_on_commit_callbacks(execute=True):
+        chunk_and_embed_file(upload.id, chunk_size=20)
+    assert search_chunks(client, query, k=2) != first
+    assert retrieval_metrics.snapshot()["counters"]["retrieval.cache.misses"] == 3
+
+    modem = generate_embedding("Reset the modem.")
+    assert search_chunks(client, modem, k=2) == search_chunks(client, modem, k=2) != []
+    with django_capture_on_commit_callbacks(execute=True):
+        upload.delete()
+    assert search_chunks(client, modem, k=2) == []
+
+
+@pytest.mark.story("S-016")
+def test_local_retrieval_cache_entries_expire_without_shared_backend(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: clock[0])
+    retrieval_cache = cache_module.RetrievalCache(ttl=60)
+    retrieval_cache.set("key", [[1, 0.5]])
+    clock[0] += 59
+    assert retrieval_cache.get("key") == [[1, 0.5]]
+    clock[0] += 2
+    assert retrieval_cache.get("key") is None
+    assert retrieval_cache.misses == 1
+
+
+@pytest.mark.story("S-016")
+def test_near_duplicate_chunks_are_flagged_and_skipped(local_index):
+    client = Client.objects.create(name="Edge")
+    category = Category.objects.create(name="Policies")
+    paragraph = "Refunds are issued within thirty days of purchase when the original receipt is presented at any store location nationwide."
+    original = File.objects.create(client=client, file=ContentFile(paragraph.encode("utf-8"), name="v1.txt"), category=category)
+    revised = File.objects.create(client=client, file=ContentFile(paragraph.replace("nationwide", "nationwide today").encode("utf-8"), name="v2.txt"), category=category)
+    other = File.objects.create(client=client, file=ContentFile(b"Shipping takes five business days for all domestic orders placed online.", name="ship.txt"), category=category)
+    [canonical_id] = chunk_and_embed_file(original.id, chunk_size=400)
+    [duplicate_id] = chunk_and_embed_file(revised.id, chunk_size=400)
+    [distinct_id] = chunk_and_embed_file(other.id, chunk_size=400)
+
+    assert DocumentChunk.objects.get(pk=duplicate_id).duplicate_of_id == canonical_id
+    assert DocumentChunk.objects.get(pk=distinct_id).duplicate_of_id is None
+    query = generate_embedding(DocumentChunk.objects.get(pk=duplicate_id).text)
+    assert duplicate_id not in {result.id for result in search_chunks(client, query, k=3)}
+
+    original.delete()
+    assert DocumentChunk.objects.get(pk=duplicate_id).duplicate_of_id is None
+    assert search_chunks(client, query, k=1)[0].id == duplicate_id
+
+
+@pytest.mark.story("S-016")
+def test_minhash_estimates_jaccard():
+    base = " ".join(f"word{index}" for index in range(200))
+    signatures = minhash_signatures([base, base.replace("word100", "other"), "completely different text about shipping"])
+    assert signatures.shape == (3, 64) and signatures.dtype == np.uint32
+    assert np.mean(signatures[0] == signatures[1]) > 0.9
+    assert np.mean(signatures[0] == signatures[2]) < 0.1
+
+
+@pytest.mark.story("S-016")
+def test_reembed_resumes_from_checkpoint(local_index, tmp_path):
+    client = Client.objects.create(name="Edge")
+    upload = File.objects.create(client=client, file=ContentFile(b"x", name="x.txt"), category=Category.objects.create(name="Manuals"))
+    chunks = DocumentChunk.objects.bulk_create(DocumentChunk(file=upload, text=f"Step {index} of the manual.") for index in range(5))
+    checkpoint = tmp_path / "reembed.json"
+    options = {"client": [client.slug], "workers": 1, "batch_size": 2, "checkpoint": str(checkpoint), "stdout": io.StringIO()}
+
+    call_command("reembed", dry_run=True, **options)
+    assert not DocumentChunk.objects.filter(embedding__isnull=False).exists()
+
+    filters = {"clients": [client.slug], "categories": [], "model": "sha256-hash"}
+    checkpoint.write_text(json.dumps({"filters": filters, "last_id": chunks[1].pk, "done": 2}))
+    call_command("reembed", **options)
+    assert list(DocumentChunk.objects.filter(embedding__isnull=False).values_list("id", flat=True)) == [chunk.pk for chunk in chunks[2:]]
+    assert not checkpoint.exists()
+    assert np.allclose(DocumentChunk.objects.get(pk=chunks[4].pk).embedding, generate_embedding(chunks[4].text))
+    assert search_chunks(client, generate_embedding(chunks[3].text), k=1)[0].id == chunks[3].pk
+
+
+@pytest.mark.story("S-016")
+def test_chunks_carry_client_for_tenant_scoped_search(local_index):
+    acme, edge = Client.objects.create(name="Acme"), Client.objects.create(name="Edge")
+    upload = File.objects.create(client=acme, file=ContentFile(b"x", name="x.txt"), category=Category.objects.create(name="General"))
+    [chunk] = DocumentChunk.objects.bulk_create([DocumentChunk(file=upload, text="alpha")])
+    assert chunk.client_id == acme.pk
+    assert DocumentChunk.objects.create(file=upload, text="beta").client_id == acme.pk
+
+    upload.client = edge
+    upload.save()
+    assert set(DocumentChunk.objects.values_list("client_id", flat=True)) == {edge.pk}
+
+    sql = str(_pgvector_queryset(edge, [0.1] * 1536, 5).query)
+    assert "uploads_file" not in sql and f'"client_id" = {edge.pk}' in sql
+    index_sql = create_tenant_index_sql(edge.pk, mode="none")
+    assert f"WHERE client_id = {edge.pk} AND duplicate_of_id IS NULL" in index_sql and "vector_cosine_ops" in index_sql
+    assert "halfvec_cosine_ops" in create_tenant_index_sql(edge.pk, mode="halfvec")
+
+
+@pytest.mark.story("S-016")
+def test_filtered_retrieval_returns_top_k_within_selected_documents(local_index):
+    client = Client.objects.create(name="Edge")
+    manuals, invoices = Category.objects.create(name="Manuals"), Category.objects.create(name="Invoices")
+    manual = File.objects.create(client=client, file=ContentFile(b"x", name="manual.txt"), category=manuals)
+    invoice = File.objects.create(client=client, file=ContentFile(b"x", name="invoice.txt"), category=invoices)
+    invoice.tags.add("billing")
+    query = np.asarray(generate_embedding("router reset"), dtype=np.float32)
+    rng = np.random.default_rng(5)
+    rows = [(manual, query + rng.normal(scale=0.01, size=query.shape)) for _ in range(20)]
+    rows += [(invoice, query + rng.normal(scale=0.5, size=query.shape)) for _ in range(3)]
+    chunks = DocumentChunk.objects.bulk_create(DocumentChunk(file=upload, text=f"row {index}", embedding=vector.astype(np.float32)) for index, (upload, vector) in enumerate(rows))
+    LocalVectorIndex.for_client(client).rebuild((chunk.id, chunk.embedding) for chunk in chunks)
+    invoice_ids = {chunk.id for chunk in chunks[20:]}
+
+    assert not invoice_ids & {result.id for result in search_chunks(client, query, k=3)}
+    assert {result.id for result in search_chunks(client, query, k=3, categories=[invoices])} == invoice_ids
+    assert {result.id for result in search_chunks(client, query, k=5, tags=["billing"])} == invoice_ids
+    assert {result.id for result in hybrid_search_chunks(client, "row", query, k=3, categories=["invoices"])} == invoice_ids
+
+    sql = str(_pgvector_queryset(client, query.tolist(), 3, ChunkFilter.build(categories=["invoices"])).query)
+    assert "category_id" in sql and "ORDER BY" in sql
+
+
+@pytest.mark.story("S-016")
+def test_filtered_retrieval_reaches_duplicates_of_chunks_outside_the_filter(local_index):
+    client = Client.objects.create(name="Edge")
+    first, second = Category.objects.create(name="A", slug="a"), Category.objects.create(name="B", slug="b")
+    payload = b"Escalation policy. Page the on-call engineer within five minutes."
+    original = File.objects.create(client=client, file=ContentFile(payload, name="policy.txt"), category=first)
+    copy = File.objects.create(client=client, file=ContentFile(payload, name="policy-copy.txt"), category=second)
+    chunk_and_embed_file(original.pk)
+    chunk_and_embed_file(copy.pk)
+    [(canonical_id, _)] = DocumentChunk.objects.filter(file=original).values_list("id", "duplicate_of_id")
+    [(duplicate_id, duplicate_of)] = DocumentChunk.objects.filter(file=copy).values_list("id", "duplicate_of_id")
+    assert duplicate_of == canonical_id
+    query = generate_embedding(payload.decode())
+
+    assert [result.id for result in search_chunks(client, query, k=3)] == [canonical_id]
+    [hit] = search_chunks(client, query, k=3, categories=["b"])
+    assert (hit.id, hit.file_id) == (duplicate_id, copy.pk) and hit.text.startswith("Escalation policy")
+    assert [result.id for result in search_chunks(client, query, k=3, categories=["a"])] == [canonical_id]
+    assert [result.id for result in hybrid_search_chunks(client, "on-call engineer", query, k=3, categories=["b"])] == [duplicate_id]
@@ -1,8 +1,25 @@
+import base64
+import fcntl
+import hashlib
+import io
+import json
+import os
+import tarfile
+import zipfile
+from datetime import timedelta
+
 import pytest
 from django.core.files.base import ContentFile
-from domains.models import Client
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.core.management import call_command
+from django.utils import timezone
+from domains.models import Blob, Client
 from contexts.models import Category
-from uploads.models import File
+from uploads import resumable, tasks
+from uploads.archive import ArchiveEntry, ArchiveError
+from contexts.models import DocumentChunk
+from uploads.models import ArchiveImport, ArchiveMember, File, UploadSession
+from uploads.query import file_page
 from rbac.models import Role, RolePermission, assign_role
 
 @pytest.mark.story("S-013")
@@ -18,3 +35,278 @@ def test_upload_scoped_to_client(settings, tmp_path, client, django_user_model):
     f = ContentFile(b"hello world", name="hello.txt")
     rec = File.objects.create(client=c, file=f, size=f.size, content_type="text/plain", category=cat)
     assert rec.client == c
+
+
+@pytest.mark.story("S-013")
+def test_resumable_upload_streams_to_bucket_and_creates_file(settings, tmp_path, client, django_user_model, monkeypatch):
+    settings.MEDIA_ROOT = tmp_path
+    user = django_user_model.objects.create_user(username="u", password="p")
+    role = Role.objects.create(name="Client Admin", code="client-admin")
+    RolePermission.objects.create(role=role, code="file.upload")
+    client.force_login(user)
+    c = Client.objects.create(name="Acme", owner=user)
+    assign_role(actor=None, user=user, client=c, role=role)
+    cat = Category.objects.create(name="General", slug="general")
+    payload = b"resumable upload body " * 5000
+    metadata = ",".join(f"{key} {base64.b64encode(value.encode()).decode()}" for key, value in {"filename": "big.txt", "category": str(cat.pk), "tags": "finance, q1"}.items())
+
+    created = client.post("/uploads/resumable/", headers={"Tus-Resumable": "1.0.0", "Upload-Length": str(len(payload)), "Upload-Metadata": metadata})
+    assert created.status_code == 201
+    location = created["Location"]
+
+    def patch(offset, body):
+        return client.generic("PATCH", location, body, content_type="application/offset+octet-stream", headers={"Upload-Offset": str(offset)})
+
+    assert patch(0, payload[:40000])["Upload-Offset"] == "40000"
+    assert patch(0, payload[:10]).status_code == 409
+    # A second PATCH while one is still streaming is turned away instead of waiting on a lock.
+    with open(UploadSession.objects.get().partial_path, "rb") as writing:
+        fcntl.flock(writing, fcntl.LOCK_EX)
+        assert patch(40000, payload[40000:]).status_code == 409
+    # A PATCH landing on a worker without the running digest replays the partial file.
+    monkeypatch.setattr(resumable, "_hashers", resumable._Hashers())
+    assert client.head(location)["Upload-Offset"] == "40000"
+    assert patch(40000, payload[40000:]).status_code == 204
+
+    session = UploadSession.objects.get()
+    record = session.file
+    assert record.client == c and record.size == len(payload) and sorted(record.tags.names()) == ["finance", "q1"]
+    assert record.sha256 == hashlib.sha256(payload).hexdigest()
+    assert record.file.name == "acme/big.txt" and record.file.read() == payload
+    assert not session.partial_path.exists()
+
+
+@pytest.mark.story("S-013")
+def test_abandoned_resumable_uploads_expire(settings, tmp_path, django_user_model):
+    settings.MEDIA_ROOT = tmp_path
+    user = django_user_model.objects.create_user(username="u", password="p")
+    c = Client.objects.create(name="Acme", owner=user)
+    cat = Category.objects.create(name="General", slug="general")
+    abandoned = resumable.create_session(c, user, "100", {"filename": "old.txt", "category": str(cat.pk)})
+    active = resumable.create_session(c, user, "100", {"filename": "new.txt", "category": str(cat.pk)})
+    resumable.append(abandoned, io.BytesIO(b"x" * 40), "0")
+    UploadSession.objects.filter(pk=abandoned.pk).update(updated_at=timezone.now() - timedelta(days=2))
+
+    assert tasks.expire_resumable_uploads_task.call_local() == 1
+    assert list(UploadSession.objects.values_list("pk", flat=True)) == [active.pk]
+    assert not abandoned.partial_path.exists() and active.partial_path.exists()
+    # A PATCH that was still streaming into the expired upload cannot resurrect it.
+    with pytest.raises(resumable.UploadError):
+        resumable.append(abandoned, io.BytesIO(b"x" * 60), "40")
+
+@pytest.mark.story("S-013")
+def test_identical_uploads_share_one_blob(settings, tmp_path, django_capture_on_commit_callbacks):
+    settings.MEDIA_ROOT = tmp_path
+    cat = Category.objects.create(name="General", slug="general")
+    acme, edge = Client.objects.create(name="Acme"), Client.objects.create(name="Edge")
+    payload = b"quarterly report " * 1000
+    first = File.objects.create(client=acme, file=ContentFile(payload, name="report.pdf"), category=cat)
+    second = File.objects.create(client=edge, file=ContentFile(payload, name="copy.pdf"), category=cat)
+
+    digest = hashlib.sha256(payload).hexdigest()
+    assert first.sha256 == second.sha256 == digest
+    assert Blob.objects.get().refcount == 2
+    blob = first.file.storage.blob_path(digest)
+    assert (tmp_path / "acme" / "report.pdf").stat().st_ino == (tmp_path / "edge" / "copy.pdf").stat().st_ino == blob.stat().st_ino
+
+    with django_capture_on_commit_callbacks(execute=True):
+        first.delete()
+    assert Blob.objects.get().refcount == 1 and blob.exists()
+    second.file.delete(save=False)
+    assert not Blob.objects.exists() and not blob.exists()
+
+
+@pytest.mark.story("S-013")
+def test_temporary_upload_is_copied_into_blob_store(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path / "media"
+    # /dev/shm is a separate filesystem from the media root, as a docker volume would be.
+    settings.FILE_UPLOAD_TEMP_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else str(tmp_path)
+    cat = Category.objects.create(name="General", slug="general")
+    acme = Client.objects.create(name="Acme")
+    payload = b"large upload spooled to disk " * 1000
+    uploaded = TemporaryUploadedFile("large.txt", "text/plain", len(payload), None)
+    uploaded.write(payload)
+    uploaded.seek(0)
+
+    record = File.objects.create(client=acme, file=uploaded, category=cat)
+
+    assert record.sha256 == hashlib.sha256(payload).hexdigest()
+    assert record.file.read() == payload
+    assert os.path.exists(uploaded.temporary_file_path())
+    uploaded.close()
+
+
+@pytest.mark.story("S-013")
+def test_file_manager_pages_by_keyset(settings, tmp_path, client, django_user_model, django_assert_num_queries):
+    settings.MEDIA_ROOT = tmp_path
+    settings.FILE_MANAGER_PAGE_SIZE = 3
+    user = django_user_model.objects.create_user(username="u", password="p")
+    client.force_login(user)
+    c = Client.objects.create(name="Acme", owner=user)
+    role = Role.objects.create(name="Client Admin", code="client-admin")
+    assign_role(actor=None, user=user, client=c, role=role)
+    cat = Category.objects.create(name="General", slug="general")
+    for index in range(8):
+        record = File.objects.create(client=c, file=ContentFile(f"doc {index}".encode(), name=f"doc{index}.txt"), category=cat)
+        record.tags.add(f"tag{index}", "shared")
+    # Identical timestamps: the id tie-breaker must still give every row exactly once.
+    File.objects.update(uploaded_at=File.objects.first().uploaded_at)
+
+    page = client.get("/uploads/manager/")
+    seen = [document.pk for document in page.context["files"]]
+    cursor = page.context["next_cursor"]
+    while cursor:
+        with django_assert_num_queries(2):
+            file_page(c, cursor)
+        page = client.get("/uploads/manager/rows/", {"cursor": cursor})
+        assert page.status_code == 200 and b"shared" in page.content
+        seen.extend(document.pk for document in page.context["files"])
+        cursor = page.context["next_cursor"]
+    assert seen == sorted(File.objects.values_list("pk", flat=True), reverse=True)
+    assert b"hx-get" not in page.content
+    assert client.get("/uploads/manager/rows/", {"cursor": "not-a-cursor"}).status_code == 400
+
+
+@pytest.mark.story("S-013")
+def test_archive_import_maps_members_and_reports_errors(settings, tmp_path, client, django_user_model, django_capture_on_commit_callbacks, monkeypatch):
+    settings.MEDIA_ROOT = tmp_path
+    # Run the queued work in-process, as a worker would.
+    monkeypatch.setattr(tasks, "extract_archive_task", tasks.extract_archive_task.call_local)
+    monkeypatch.setattr(tasks, "ingest_archive_lane_task", tasks.ingest_archive_lane_task.call_local)
+    settings.ARCHIVE_IMPORT_BATCH_SIZE = 2
+    settings.ARCHIVE_IMPORT_CONCURRENCY = 2
+    settings.RESUMABLE_UPLOAD_MAX_SIZE = 1000
+    user = django_user_model.objects.create_user(username="u", password="p")
+    role = Role.objects.create(name="Client Admin", code="client-admin")
+    RolePermission.objects.create(role=role, code="file.upload")
+    client.force_login(user)
+    c = Client.objects.create(name="Acme", owner=user)
+    assign_role(actor=None, user=user, client=c, role=role)
+    general = Category.objects.create(name="General", slug="general")
+    finance = Category.objects.create(name="Finance", slug="finance")
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("invoices/", "")
+        archive.writestr("invoices/jan.txt", "January invoice. Total due in thirty days.")
+        archive.writestr("invoices/feb.txt", "February invoice. Paid in full.")
+        archive.writestr("notes/kickoff.md", "Kickoff notes. Agreed scope and timeline.")
+        archive.writestr("notes/huge.txt", "x" * 5000)
+        archive.writestr("__MACOSX/invoices/._jan.txt", "resource fork")
+        archive.writestr("readme.txt", "Read me first.")
+    rules = "invoices/*=finance:invoice,2024\n*.md=:notes"
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.post("/uploads/imports/", {"archive": SimpleUploadedFile("onboarding.zip", buffer.getvalue()), "category": str(general.pk), "rules": rules})
+    assert response.status_code == 302
+
+    job = ArchiveImport.objects.get()
+    progress = client.get(f"/uploads/imports/{job.pk}/").json()
+    assert progress["status"] == "ready" and progress["members"] == 5
+    assert progress["ingested"] == 4 and progress["failed"] == 1
+    assert progress["errors"] == [{"member": "notes/huge.txt", "error": "Member exceeds the maximum upload size."}]
+    job.refresh_from_db()
+    assert job.active_lanes == 0 and job.archive_path == ""
+
+    files = {record.filename: record for record in File.objects.filter(client=c)}
+    assert sorted(files) == ["feb.txt", "jan.txt", "kickoff.md", "readme.txt"]
+    assert files["jan.txt"].category == finance and files["jan.txt"].tag_slugs == ["2024", "invoice"]
+    assert sorted(files["jan.txt"].tags.names()) == ["2024", "invoice"]
+    assert files["kickoff.md"].category == general and files["kickoff.md"].tags.names()[0] == "notes"
+    assert files["readme.txt"].file.read() == b"Read me first."
+    assert files["readme.txt"].sha256 == hashlib.sha256(b"Read me first.").hexdigest()
+    assert all(DocumentChunk.objects.filter(file=record).exists() for record in files.values())
+
+
+@pytest.mark.story("S-013")
+def test_import_archive_command_streams_tar(settings, tmp_path, capsys, monkeypatch):
+    settings.MEDIA_ROOT = tmp_path / "media"
+    monkeypatch.setattr(tasks, "ingest_archive_lane_task", tasks.ingest_archive_lane_task.call_local)
+    c = Client.objects.create(name="Acme")
+    Category.objects.create(name="General", slug="general")
+    path = tmp_path / "docs.tar.gz"
+    with tarfile.open(path, "w:gz") as archive:
+        for index in range(3):
+            payload = f"Document {index}. Imported from a tarball.".encode()
+            info = tarfile.TarInfo(f"docs/doc{index}.txt")
+            info.size = len(payload)
+            archive.addfile(info, io.BytesIO(payload))
+        link = tarfile.TarInfo("docs/link.txt")
+        link.type = tarfile.SYMTYPE
+        link.linkname = "/etc/passwd"
+        archive.addfile(link)
+
+    call_command("import_archive", str(path), "--client", c.slug, "--rule", "docs/*=general:tarball", "--batch-size", "2")
+
+    progress = json.loads(capsys.readouterr().out)
+    assert progress["status"] == "ready" and progress["ingested"] == 3 and progress["failed"] == 0
+    assert sorted(File.objects.values_list("tag_slugs", flat=True)) == [["tarball"]] * 3
+    assert ArchiveMember.objects.filter(file__isnull=True).count() == 0
+    assert path.exists()
+
+
+@pytest.mark.story("S-013")
+def test_failed_extraction_keeps_no_orphaned_blobs(settings, tmp_path, monkeypatch):
+    settings.MEDIA_ROOT = tmp_path / "media"
+    monkeypatch.setattr(tasks, "ingest_archive_lane_task", tasks.ingest_archive_lane_task.call_local)
+    c = Client.objects.create(name="Acme")
+    cat = Category.objects.create(name="General", slug="general")
+
+    def truncated(path):
+        for index in range(2):
+            payload = f"Document {index} before the archive broke.".encode()
+            yield ArchiveEntry(f"doc{index}.txt", len(payload), lambda payload=payload: io.BytesIO(payload))
+        raise ArchiveError("Corrupt tar archive: unexpected end of data")
+
+    monkeypatch.setattr(tasks, "iter_members", truncated)
+    job = ArchiveImport.objects.create(client=c, archive_name="broken.tar", default_category=cat)
+    with pytest.raises(ArchiveError):
+        tasks._extract_archive(job, tmp_path / "broken.tar")
+    job.refresh_from_db()
+    assert job.status == "failed"
+    assert ArchiveMember.objects.filter(job=job, file__isnull=False).count() == 2
+    assert sorted(Blob.objects.values_list("refcount", flat=True)) == [1, 1]
+
+    def broken_flush(job, members, tags):
+        raise RuntimeError("database went away")
+
+    monkeypatch.setattr(tasks, "_flush", broken_flush)
+    job = ArchiveImport.objects.create(client=c, archive_name="broken.tar", default_category=cat)
+    with pytest.raises(ArchiveError):
+        tasks._extract_archive(job, tmp_path / "broken.tar")
+    assert not job.members.exists() and File.objects.count() == 2
+    assert sorted(Blob.objects.values_list("refcount", flat=True)) == [1, 1]
+
+@pytest.mark.story("S-013")
+def test_stalled_archive_import_is_reclaimed(settings, tmp_path, monkeypatch):
+    settings.MEDIA_ROOT = tmp_path
+    monkeypatch.setattr(tasks, "ingest_archive_lane_task", tasks.ingest_archive_lane_task.call_local)
+    c = Client.objects.create(name="Acme")
+    cat = Category.objects.create(name="General", slug="general")
+    record = File.objects.create(client=c, file=ContentFile(b"Stranded document. Its worker died.", name="stranded.txt"), category=cat)
+    job = ArchiveImport.objects.create(client=c, archive_name="dead.zip", default_category=cat, status="ingesting", concurrency=1, active_lanes=1)
+    member = ArchiveMember.objects.create(job=job, name="stranded.txt", file=record, status="ingesting")
+
+    # A lane that fails mid-claim still gives its slot back.
+    claim_batch = tasks._claim_batch
+
+    def lost_connection(job):
+        raise RuntimeError("connection lost")
+
+    monkeypatch.setattr(tasks, "_claim_batch", lost_connection)
+    with pytest.raises(RuntimeError):
+        tasks._ingest_lane(job.pk)
+    job.refresh_from_db()
+    assert job.active_lanes == 0
+    monkeypatch.setattr(tasks, "_claim_batch", claim_batch)
+
+    # A worker killed outright leaves its lane counted and its member ingesting until the sweep.
+    ArchiveImport.objects.filter(pk=job.pk).update(active_lanes=1)
+    assert tasks._reclaim_stalled(job.pk) == 0
+    stale = timezone.now() - timedelta(hours=1)
+    ArchiveMember.objects.filter(pk=member.pk).update(updated_at=stale)
+    ArchiveImport.objects.filter(pk=job.pk).update(updated_at=stale)
+    assert tasks._reclaim_stalled(job.pk) == 1
+
+    member.refresh_from_db()
+    job.refresh_from_db()
+    assert member.status == "ingested" and job.status == "ready" and job.active_lanes == 0
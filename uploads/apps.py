@@ -2,3 +2,8 @@ from django.apps import AppConfig
 class UploadsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "uploads"
+
+    def ready(self):
+        super().ready()
+        # Import signal handlers: release stored files with their rows, keep tag_slugs in sync.
+        from . import signals  # noqa: F401
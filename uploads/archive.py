@@ -0,0 +1,151 @@
+"""
+Streaming reads of ZIP and tar archives for bulk imports.
+
+Members are read one at a time from the archive on disk and streamed into the
+default storage in fixed-size blocks, so neither the archive nor any member is
+held in memory. Tar archives (optionally gzip/bzip2/xz compressed) are read in
+stream mode, front to back; ZIP archives through their central directory.
+
+Import rules map member paths to a category and tags. A rule is written
+``PATTERN=CATEGORY[:TAG,TAG]``, e.g. ``invoices/*.pdf=finance:invoice,2024``;
+patterns are shell globs matched against the full member path. The first
+matching rule with a category decides the category, and every matching rule
+contributes its tags. ``*.md=:docs`` tags without setting a category.
+"""
+
+from __future__ import annotations
+
+import fnmatch
+import hashlib
+import tarfile
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.core.files import File as DjangoFile
+from django.core.files.storage import default_storage
+from django.utils.text import get_valid_filename
+
+from contexts.models import Category
+
+from .models import File, upload_to
+
+
+# Resource forks and Finder/Explorer droppings that archivers add alongside real documents.
+SKIPPED_PREFIXES = ("__MACOSX/",)
+
+
+class ArchiveError(Exception):
+    """The archive, one of its members or the import rules cannot be used."""
+
+
+@dataclass
+class ArchiveEntry:
+    name: str
+    size: int
+    open: Callable[[], Optional[BinaryIO]]
+
+
+def parse_rules(lines: Iterable[str]) -> List[dict]:
+    """Parse ``PATTERN=CATEGORY[:TAG,TAG]`` lines; blank lines and ``#`` comments are skipped."""
+    rules = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        pattern, separator, target = line.rpartition("=")
+        if not separator or not pattern.strip():
+            raise ArchiveError(f"Invalid import rule {line!r}; expected PATTERN=CATEGORY[:TAG,TAG].")
+        category, _, tags = target.partition(":")
+        rules.append({
+            "pattern": pattern.strip(),
+            "category": category.strip(),
+            "tags": [tag.strip() for tag in tags.split(",") if tag.strip()],
+        })
+    return rules
+
+
+def rule_categories(rules: Iterable[dict]) -> Dict[str, Category]:
+    """Categories named by ``rules``, keyed by slug; an unknown slug is an error before anything is imported."""
+    slugs = {rule["category"] for rule in rules if rule.get("category")}
+    found = {category.slug: category for category in Category.objects.filter(slug__in=slugs)}
+    missing = sorted(slugs - set(found))
+    if missing:
+        raise ArchiveError(f"Unknown categories in import rules: {', '.join(missing)}.")
+    return found
+
+
+def classify(name: str, rules: Iterable[dict]) -> Tuple[Optional[str], List[str]]:
+    """Return ``(category slug or None, tags)`` for the member ``name``."""
+    category = None
+    tags: List[str] = []
+    for rule in rules:
+        if not fnmatch.fnmatchcase(name, rule["pattern"]):
+            continue
+        if category is None and rule.get("category"):
+            category = rule["category"]
+        tags.extend(tag for tag in rule.get("tags", ()) if tag not in tags)
+    return category, tags
+
+
+def _skipped(name: str) -> bool:
+    return name.startswith(SKIPPED_PREFIXES) or PurePosixPath(name).name.startswith(".")
+
+
+def iter_members(path) -> Iterator[ArchiveEntry]:
+    """
+    Yield the regular files of the archive at ``path`` in archive order. Each entry's ``open`` is
+    only valid until the next entry is requested: tar members are read from a forward-only stream.
+    """
+    path = Path(path)
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or _skipped(info.filename):
+                    continue
+                yield ArchiveEntry(info.filename, info.file_size, lambda info=info: archive.open(info))
+        return
+    try:
+        archive = tarfile.open(path, mode="r|*")
+    except tarfile.TarError:
+        raise ArchiveError("Not a ZIP or tar archive.")
+    with archive:
+        try:
+            for member in archive:
+                # Links and devices have no content of their own; a link could also point outside the import.
+                if not member.isfile() or _skipped(member.name):
+                    continue
+                yield ArchiveEntry(member.name, member.size, lambda member=member: archive.extractfile(member))
+        except tarfile.TarError as exc:
+            raise ArchiveError(f"Corrupt tar archive: {exc}")
+
+
+class _HashingReader:
+    """File-like view of a member stream that hashes and counts the bytes as storage reads them."""
+
+    def __init__(self, stream: BinaryIO):
+        self._stream = stream
+        self.hasher = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._stream.read(size)
+        self.hasher.update(data)
+        self.size += len(data)
+        return data
+
+
+def store_member(client, entry: ArchiveEntry) -> Tuple[str, int, str]:
+    """
+    Stream ``entry`` into the client's bucket and return ``(storage name, size, sha256)``. Folder
+    structure is flattened like a regular upload; clashing names get the storage's usual suffix.
+    """
+    filename = get_valid_filename(PurePosixPath(entry.name).name)
+    stream = entry.open()
+    if stream is None:
+        raise ArchiveError("Member has no readable content.")
+    with stream:
+        reader = _HashingReader(stream)
+        name = default_storage.save(upload_to(File(client=client), filename), DjangoFile(reader, name=filename))
+    return name, reader.size, reader.hasher.hexdigest()
@@ -0,0 +1,133 @@
+"""
+EXPLAIN ANALYZE of select_docs before and after the tag_slugs denormalization.
+
+Builds a synthetic tenant (one million files by default) with set-based SQL,
+then runs both plans for the same category/tag selection:
+
+* ``join``: the previous query, a category join OR'd with a ``tags__name__in``
+  join through taggit's generic relation, followed by ``DISTINCT``.
+* ``array``: the current :func:`uploads.query.select_docs`, a single-table
+  scan of ``uploads_file`` using the GIN index on ``tag_slugs``.
+
+Results (execution and planning time, plan nodes and indexes used) are
+printed as JSON. The fixture is removed afterwards unless ``--keep`` is given.
+PostgreSQL only.
+"""
+
+from __future__ import annotations
+
+import json
+import uuid
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+from taggit.models import Tag, TaggedItem
+
+from contexts.models import Category
+from domains.models import Client
+from uploads.models import File
+from uploads.query import select_docs
+
+
+def _plan_nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from _plan_nodes(child)
+
+
+class Command(BaseCommand):
+    help = "Compare EXPLAIN ANALYZE of the join-based and array-based select_docs on a large synthetic tenant."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--files", type=int, default=1_000_000)
+        parser.add_argument("--tags", type=int, default=500, help="Distinct tags in the fixture.")
+        parser.add_argument("--categories", type=int, default=20)
+        parser.add_argument("--select-tags", type=int, default=2, help="Tags in the measured selection.")
+        parser.add_argument("--keep", action="store_true", help="Keep the fixture for further runs.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("bench_select_docs needs PostgreSQL (GIN index and EXPLAIN ANALYZE).")
+        suffix = uuid.uuid4().hex[:8]
+        client = Client.objects.create(name=f"bench-select-docs-{suffix}")
+        categories = Category.objects.bulk_create(Category(name=f"bench-{suffix}-{index}", slug=f"bench-{suffix}-{index}") for index in range(options["categories"]))
+        tags = Tag.objects.bulk_create(Tag(name=f"bench-{suffix}-{index}", slug=f"bench-{suffix}-{index}") for index in range(options["tags"]))
+        try:
+            self._load(client, categories, tags, options["files"])
+            category_slugs = [categories[0].slug]
+            tag_names = [tag.name for tag in tags[: options["select_tags"]]]
+            queries = {
+                "join": File.objects.filter(Q(category__slug__in=category_slugs) | Q(tags__name__in=tag_names), client=client).distinct(),
+                "array": select_docs(categories=category_slugs, tags=tag_names).filter(client=client),
+            }
+            results = {name: self._explain(queryset.values_list("pk", flat=True)) for name, queryset in queries.items()}
+        finally:
+            if not options["keep"]:
+                self._cleanup(client, categories, tags)
+        report = {"files": options["files"], "tags": options["tags"], "categories": options["categories"], "results": results}
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def _load(self, client, categories, tags, files: int) -> None:
+        content_type = ContentType.objects.get_for_model(File)
+        slugs = [tag.slug for tag in tags]
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Three pseudo-random tags per file, picked by multiplicative hashing of the row number.
+            cursor.execute(
+                "INSERT INTO uploads_file (client_id, file, size, content_type, sha256, uploaded_at, category_id, tag_slugs) "
+                "SELECT %(client)s, 'bench/' || g || '.txt', 0, '', '', now() - g * interval '1 second', "
+                "(%(categories)s::bigint[])[1 + g %% %(category_count)s], "
+                "ARRAY(SELECT DISTINCT s FROM unnest(ARRAY[(%(slugs)s::text[])[1 + (g * 7) %% %(tag_count)s], "
+                "(%(slugs)s::text[])[1 + (g * 13) %% %(tag_count)s], (%(slugs)s::text[])[1 + (g * 31) %% %(tag_count)s]]) s ORDER BY s) "
+                "FROM generate_series(1, %(files)s) g",
+                {
+                    "client": client.pk,
+                    "categories": [category.pk for category in categories],
+                    "category_count": len(categories),
+                    "slugs": slugs,
+                    "tag_count": len(slugs),
+                    "files": files,
+                },
+            )
+            cursor.execute(
+                "INSERT INTO taggit_taggeditem (object_id, content_type_id, tag_id) "
+                "SELECT DISTINCT f.id, %s, t.id FROM uploads_file f CROSS JOIN LATERAL unnest(f.tag_slugs) s "
+                "JOIN taggit_tag t ON t.slug = s WHERE f.client_id = %s",
+                [content_type.pk, client.pk],
+            )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE uploads_file")
+            cursor.execute("ANALYZE taggit_taggeditem")
+            cursor.execute("ANALYZE taggit_tag")
+
+    @staticmethod
+    def _explain(queryset) -> dict:
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", params)
+            (explained,) = cursor.fetchone()
+        if isinstance(explained, str):
+            explained = json.loads(explained)
+        plan = explained[0]
+        nodes = list(_plan_nodes(plan["Plan"]))
+        return {
+            "execution_ms": plan["Execution Time"],
+            "planning_ms": plan["Planning Time"],
+            "rows": plan["Plan"]["Actual Rows"],
+            "nodes": sorted({node["Node Type"] for node in nodes}),
+            "indexes": sorted({node["Index Name"] for node in nodes if "Index Name" in node}),
+            "shared_hit_blocks": plan["Plan"].get("Shared Hit Blocks"),
+            "shared_read_blocks": plan["Plan"].get("Shared Read Blocks"),
+        }
+
+    @staticmethod
+    def _cleanup(client, categories, tags) -> None:
+        with transaction.atomic():
+            TaggedItem.objects.filter(tag__in=tags).delete()
+            with connection.cursor() as cursor:
+                # Raw delete: a million-row ORM cascade would collect every row in memory first.
+                cursor.execute("DELETE FROM uploads_file WHERE client_id = %s", [client.pk])
+            Tag.objects.filter(pk__in=[tag.pk for tag in tags]).delete()
+            Category.objects.filter(pk__in=[category.pk for category in categories]).delete()
+            client.delete()
@@ -0,0 +1,75 @@
+"""
+Bulk-import a ZIP or tar archive into a client from the command line.
+
+Extraction runs in this process, straight from the archive on disk; chunk and
+embed work is queued to the Huey workers in batches, at most ``--concurrency``
+lanes at a time. Progress and per-member errors are printed as JSON when
+extraction finishes and stay queryable through the import's progress endpoint.
+
+    manage.py import_archive onboarding.zip --client acme --category general \\
+        --rule 'invoices/*=finance:invoice' --rule '*.md=:notes'
+"""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from contexts.models import Category
+from domains.models import Client
+from uploads.archive import ArchiveError, parse_rules, rule_categories
+from uploads.models import ArchiveImport
+from uploads.tasks import DEFAULT_IMPORT_BATCH_SIZE, DEFAULT_IMPORT_CONCURRENCY, _extract_archive, import_progress
+
+
+class Command(BaseCommand):
+    help = "Import every document in a ZIP or tar archive, mapping paths to categories and tags."
+
+    def add_arguments(self, parser):
+        parser.add_argument("archive", help="Path of the ZIP or tar archive.")
+        parser.add_argument("--client", required=True, help="Slug of the client to import into.")
+        parser.add_argument("--category", help="Slug of the category for members no rule categorizes.")
+        parser.add_argument("--rule", action="append", default=[], help="PATTERN=CATEGORY[:TAG,TAG]; repeatable.")
+        parser.add_argument("--rules-file", help="File with one rule per line.")
+        parser.add_argument("--batch-size", type=int, default=getattr(settings, "ARCHIVE_IMPORT_BATCH_SIZE", DEFAULT_IMPORT_BATCH_SIZE))
+        parser.add_argument("--concurrency", type=int, default=getattr(settings, "ARCHIVE_IMPORT_CONCURRENCY", DEFAULT_IMPORT_CONCURRENCY))
+
+    def handle(self, *args, **options):
+        path = Path(options["archive"])
+        if not path.is_file():
+            raise CommandError(f"No such archive: {path}")
+        client = Client.objects.filter(slug=options["client"]).first()
+        if client is None:
+            raise CommandError(f"Unknown client: {options['client']}")
+        default_category = None
+        if options["category"]:
+            default_category = Category.objects.filter(slug=options["category"]).first()
+            if default_category is None:
+                raise CommandError(f"Unknown category: {options['category']}")
+        lines = list(options["rule"])
+        if options["rules_file"]:
+            lines.extend(Path(options["rules_file"]).read_text(encoding="utf-8").splitlines())
+        try:
+            rules = parse_rules(lines)
+            rule_categories(rules)
+        except ArchiveError as exc:
+            raise CommandError(str(exc))
+        if default_category is None and not rules:
+            raise CommandError("Give --category or at least one --rule.")
+
+        job = ArchiveImport.objects.create(
+            client=client,
+            archive_name=path.name,
+            default_category=default_category,
+            rules=rules,
+            batch_size=max(options["batch_size"], 1),
+            concurrency=max(options["concurrency"], 1),
+        )
+        try:
+            _extract_archive(job, path)
+        except ArchiveError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(json.dumps(import_progress(job.pk), indent=2))
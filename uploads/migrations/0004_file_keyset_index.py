@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploads', '0003_file_client_sha256_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['client', '-uploaded_at', '-id'], name='uploads_fil_client__cc2985_idx'),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:25
+
+import uploads.models
+from django.db import migrations, models
+
+
+BATCH_SIZE = 10000
+INDEX_NAME = "uploads_file_tag_slugs_gin"
+
+
+def backfill_tag_slugs(apps, schema_editor):
+    ContentType = apps.get_model("contenttypes", "ContentType")
+    content_type = ContentType.objects.filter(app_label="uploads", model="file").first()
+    if content_type is None:
+        return
+    File = apps.get_model("uploads", "File")
+    TaggedItem = apps.get_model("taggit", "TaggedItem")
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT MIN(id), MAX(id) FROM uploads_file")
+        low, high = cursor.fetchone()
+        if low is None:
+            return
+        # Id-range batches keep each UPDATE short on large tables.
+        for start in range(low, high + 1, BATCH_SIZE):
+            if connection.vendor == "postgresql":
+                cursor.execute(
+                    "UPDATE uploads_file f SET tag_slugs = COALESCE(("
+                    "SELECT array_agg(t.slug ORDER BY t.slug) FROM taggit_taggeditem i JOIN taggit_tag t ON t.id = i.tag_id "
+                    "WHERE i.content_type_id = %s AND i.object_id = f.id), '{}') "
+                    "WHERE f.id >= %s AND f.id < %s",
+                    [content_type.pk, start, start + BATCH_SIZE],
+                )
+                continue
+            slugs = {}
+            rows = TaggedItem.objects.filter(content_type_id=content_type.pk, object_id__gte=start, object_id__lt=start + BATCH_SIZE)
+            for object_id, slug in rows.values_list("object_id", "tag__slug"):
+                slugs.setdefault(object_id, []).append(slug)
+            File.objects.bulk_update(
+                [File(pk=pk, tag_slugs=sorted(values)) for pk, values in slugs.items()], ["tag_slugs"], batch_size=1000
+            )
+
+
+def add_gin_index(apps, schema_editor):
+    # GIN on a native array is Postgres-only; elsewhere select_docs queries tags through the join.
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX_NAME} ON uploads_file USING gin (tag_slugs)")
+
+
+def drop_gin_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME}")
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+        ('uploads', '0004_file_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='tag_slugs',
+            field=uploads.models.SlugArrayField(base_field=models.SlugField(max_length=100), blank=True, default=list, editable=False, size=None),
+        ),
+        migrations.RunPython(backfill_tag_slugs, migrations.RunPython.noop),
+        migrations.RunPython(add_gin_index, drop_gin_index),
+    ]
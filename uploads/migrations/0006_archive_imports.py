@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contexts', '0012_documentchunk_byte_offsets'),
+        ('domains', '0001_initial'),
+        ('uploads', '0005_file_tag_slugs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archive_name', models.CharField(max_length=255)),
+                ('archive_path', models.CharField(blank=True, max_length=500)),
+                ('rules', models.JSONField(blank=True, default=list)),
+                ('status', models.CharField(choices=[('extracting', 'Extracting'), ('ingesting', 'Ingesting'), ('ready', 'Ready'), ('failed', 'Failed')], default='extracting', max_length=16)),
+                ('batch_size', models.PositiveIntegerField(default=100)),
+                ('concurrency', models.PositiveIntegerField(default=4)),
+                ('active_lanes', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archive_imports', to='domains.client')),
+                ('default_category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='contexts.category')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at', '-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchiveMember',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=1024)),
+                ('size', models.BigIntegerField(default=0)),
+                ('status', models.CharField(choices=[('stored', 'Stored'), ('ingesting', 'Ingesting'), ('ingested', 'Ingested'), ('failed', 'Failed')], default='stored', max_length=16)),
+                ('error', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('file', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='uploads.file')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='members', to='uploads.archiveimport')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['job', 'status'], name='uploads_arc_job_id_3dce2f_idx')],
+            },
+        ),
+    ]
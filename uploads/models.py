@@ -1,26 +1,71 @@
+import json
+import uuid
+from collections import defaultdict
 from pathlib import Path
+from typing import Iterable
 
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.fields import ArrayField
 from django.db import models
 from django.core.exceptions import ValidationError
 from taggit.managers import TaggableManager
+from taggit.models import TaggedItem
 
 from contexts.models import Category
 from domains.models import Client
+from domains.storage import client_partial_upload_path, content_hash
 
 def upload_to(instance, filename):
     return f"{instance.client.slug}/{filename}"
 
+
+class SlugArrayField(ArrayField):
+    """
+    A native array on PostgreSQL, where it takes a GIN index and ``__overlap`` lookups. Other
+    databases store a JSON list in a text column and query tags through the join instead.
+    """
+
+    def db_type(self, connection):
+        if connection.vendor != "postgresql":
+            return "text"
+        return super().db_type(connection)
+
+    def get_placeholder(self, value, compiler, connection):
+        if connection.vendor != "postgresql":
+            return "%s"
+        return super().get_placeholder(value, compiler, connection)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if connection.vendor != "postgresql" and value is not None:
+            return json.dumps(list(value))
+        return super().get_db_prep_value(value, connection, prepared)
+
+    def from_db_value(self, value, expression, connection):
+        if isinstance(value, str):
+            return json.loads(value)
+        return value
+
+
 class File(models.Model):
     client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name="files")
     file = models.FileField(upload_to=upload_to)
     size = models.BigIntegerField(default=0)
     content_type = models.CharField(max_length=200, blank=True)
+    sha256 = models.CharField(max_length=64, blank=True, default="")
     uploaded_at = models.DateTimeField(auto_now_add=True)
     category = models.ForeignKey(Category, on_delete=models.PROTECT)
     tags = TaggableManager(blank=True)
+    # Denormalized, sorted tag slugs so select_docs filters tags without joining taggit.
+    tag_slugs = SlugArrayField(models.SlugField(max_length=100), default=list, blank=True, editable=False)
 
     class Meta:
         ordering = ["-uploaded_at"]
+        indexes = [
+            models.Index(fields=["client", "sha256"]),
+            # Keyset pagination of the file manager: WHERE client = ? ORDER BY uploaded_at DESC, id DESC.
+            models.Index(fields=["client", "-uploaded_at", "-id"]),
+        ]
 
     def clean(self):
         if not self.category_id:
@@ -33,6 +78,11 @@ class File(models.Model):
         if hasattr(self.file, "content_type") and self.file.content_type:
             self.content_type = self.file.content_type
         self.client.provision_storage()
+        if self.file and not self.file._committed:
+            # Store the upload first so the hash computed by the storage is saved with the row.
+            self.file.save(self.file.name, self.file.file, save=False)
+        if self.file and not self.sha256:
+            self.sha256 = content_hash(self.file)
         super().save(*args, **kwargs)
 
     @property
@@ -41,3 +91,108 @@ class File(models.Model):
 
     def __str__(self):
         return f"{self.client.slug}:{self.filename}"
+
+
+def sync_tag_slugs(file_ids: Iterable[int], *, batch_size: int = 1000) -> None:
+    """Recompute ``File.tag_slugs`` for ``file_ids`` from taggit's tagged items."""
+    file_ids = list(file_ids)
+    if not file_ids:
+        return
+    slugs = defaultdict(list)
+    rows = TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(File), object_id__in=file_ids).values_list("object_id", "tag__slug")
+    for object_id, slug in rows:
+        slugs[object_id].append(slug)
+    File.objects.bulk_update([File(pk=pk, tag_slugs=sorted(slugs.get(pk, []))) for pk in file_ids], ["tag_slugs"], batch_size=batch_size)
+
+
+class UploadSession(models.Model):
+    """A resumable (tus-style) upload in progress; the File row is created once every byte has arrived."""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name="upload_sessions")
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=200, blank=True)
+    category = models.ForeignKey(Category, on_delete=models.PROTECT, related_name="+")
+    tags = models.CharField(max_length=500, blank=True)
+    length = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    file = models.ForeignKey(File, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def partial_path(self) -> Path:
+        return client_partial_upload_path(self.client) / self.id.hex
+
+    @property
+    def complete(self) -> bool:
+        return self.file_id is not None
+
+    @property
+    def tag_list(self):
+        return [tag.strip() for tag in self.tags.split(",") if tag.strip()]
+
+    def __str__(self):
+        return f"Upload {self.id} of {self.filename} ({self.offset}/{self.length})"
+
+
+class ArchiveImport(models.Model):
+    """
+    A bulk import of a ZIP or tar archive into one client. Members are stored and turned into
+    File rows as the archive streams; chunk-and-embed runs in at most ``concurrency`` lanes.
+    """
+
+    STATUS_CHOICES = [
+        ("extracting", "Extracting"),
+        ("ingesting", "Ingesting"),
+        ("ready", "Ready"),
+        ("failed", "Failed"),
+    ]
+
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name="archive_imports")
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    archive_name = models.CharField(max_length=255)
+    # Spooled upload inside the client's bucket; removed once extraction has finished.
+    archive_path = models.CharField(max_length=500, blank=True)
+    default_category = models.ForeignKey(Category, on_delete=models.PROTECT, null=True, blank=True, related_name="+")
+    # [{"pattern": "invoices/*.pdf", "category": "finance", "tags": ["invoice"]}, ...]
+    rules = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default="extracting")
+    batch_size = models.PositiveIntegerField(default=100)
+    concurrency = models.PositiveIntegerField(default=4)
+    active_lanes = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at", "-id"]
+
+    def __str__(self):
+        return f"Import {self.pk} of {self.archive_name} ({self.status})"
+
+
+class ArchiveMember(models.Model):
+    STATUS_CHOICES = [
+        ("stored", "Stored"),
+        ("ingesting", "Ingesting"),
+        ("ingested", "Ingested"),
+        ("failed", "Failed"),
+    ]
+
+    job = models.ForeignKey(ArchiveImport, on_delete=models.CASCADE, related_name="members")
+    name = models.CharField(max_length=1024)
+    size = models.BigIntegerField(default=0)
+    file = models.ForeignKey(File, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default="stored")
+    error = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [models.Index(fields=["job", "status"])]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
@@ -1,13 +1,26 @@
 from __future__ import annotations
 
-from typing import Iterable, Sequence
+import base64
+import binascii
+from datetime import datetime
+from typing import Iterable, List, Optional, Sequence, Tuple
 
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
 from django.db.models import Q, QuerySet
+from taggit.models import Tag, TaggedItem
+
+from contexts.models import Category
 
 from .models import File
 
 
-def _normalize_category_values(categories: Iterable) -> Sequence[str]:
+DEFAULT_FILE_PAGE_SIZE = 50
+
+
+def normalize_category_values(categories: Iterable) -> Sequence[str]:
+    """Category slugs from ``Category`` instances or slug strings, as :func:`select_docs` matches them."""
     normalized = []
     for item in categories:
         if not item:
@@ -19,18 +32,86 @@ def _normalize_category_values(categories: Iterable) -> Sequence[str]:
     return normalized
 
 
+def normalize_tag_values(tags: Iterable) -> Sequence[str]:
+    """Tag names from ``Tag`` instances or name strings, as :func:`select_docs` matches them."""
+    return [getattr(tag, "name", str(tag)) for tag in tags if tag]
+
+
 def select_docs(categories: Iterable = None, tags: Iterable = None) -> QuerySet[File]:
     categories = categories or []
     tags = tags or []
-    category_slugs = _normalize_category_values(categories)
-    tag_names = [getattr(tag, "name", str(tag)) for tag in tags if tag]
+    category_slugs = normalize_category_values(categories)
+    tag_names = normalize_tag_values(tags)
 
     if not category_slugs and not tag_names:
         return File.objects.none()
 
     query = Q()
+    if connection.vendor == "postgresql":
+        # Resolved to literals up front: ``category_id IN (...) OR tag_slugs && '{...}'`` plans as a
+        # BitmapOr of the category index and the GIN index on File.tag_slugs, where the same
+        # predicates as subqueries made the planner filter every row of the client instead.
+        category_ids = list(Category.objects.filter(slug__in=category_slugs).values_list("pk", flat=True)) if category_slugs else []
+        tag_slugs = list(Tag.objects.filter(name__in=tag_names).values_list("slug", flat=True)) if tag_names else []
+        if category_ids:
+            query |= Q(category_id__in=category_ids)
+        if tag_slugs:
+            query |= Q(tag_slugs__overlap=tag_slugs)
+        return File.objects.filter(query) if query else File.objects.none()
+
+    # Both predicates are semi-joins on File alone, so no row is multiplied and no DISTINCT is needed.
     if category_slugs:
-        query |= Q(category__slug__in=category_slugs)
+        query |= Q(category_id__in=Category.objects.filter(slug__in=category_slugs).values("pk"))
     if tag_names:
-        query |= Q(tags__name__in=tag_names)
-    return File.objects.filter(query).distinct()
+        query |= Q(pk__in=TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(File), tag__name__in=tag_names).values("object_id"))
+    return File.objects.filter(query)
+
+
+def file_page_size() -> int:
+    return max(int(getattr(settings, "FILE_MANAGER_PAGE_SIZE", DEFAULT_FILE_PAGE_SIZE)), 1)
+
+
+def encode_file_cursor(document: File) -> str:
+    return base64.urlsafe_b64encode(f"{document.uploaded_at.isoformat()}|{document.pk}".encode()).decode()
+
+
+class InvalidCursor(ValueError):
+    """A file manager cursor that does not decode to a position."""
+
+
+def decode_file_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    """
+    ``(uploaded_at, id)`` of the last row already shown, or None (first page) without a cursor.
+    A malformed cursor raises :class:`InvalidCursor` rather than silently restarting at page one.
+    """
+    if not cursor:
+        return None
+    try:
+        uploaded_at, _, pk = base64.urlsafe_b64decode(cursor.encode()).decode().partition("|")
+        return datetime.fromisoformat(uploaded_at), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(f"Invalid file cursor {cursor!r}.")
+
+
+def file_page(client, cursor: Optional[str] = None, page_size: Optional[int] = None) -> Tuple[List[File], Optional[str]]:
+    """
+    One page of the client's files, newest first, and the cursor of the next page (None on the
+    last one). Keyset pagination on ``(uploaded_at, id)`` is served by the composite index on
+    ``File``, so every page costs the same however many files the client has: two queries,
+    the files joined with their category and the tags prefetch. Raises :class:`InvalidCursor`
+    for a cursor that does not decode.
+    """
+    page_size = page_size or file_page_size()
+    files = File.objects.filter(client=client).select_related("category").prefetch_related("tags").order_by("-uploaded_at", "-id")
+    position = decode_file_cursor(cursor)
+    if position is not None:
+        uploaded_at, pk = position
+        # The redundant bound gives the planner a plain range on the index's leading sort column.
+        files = files.filter(uploaded_at__lte=uploaded_at).filter(Q(uploaded_at__lt=uploaded_at) | Q(uploaded_at=uploaded_at, pk__lt=pk))
+    page = list(files[: page_size + 1])
+    has_more = len(page) > page_size
+    page = page[:page_size]
+    for document in page:
+        # tags.all() is answered from the prefetch cache; tags.names() would query per row.
+        document.tag_list = [tag.name for tag in document.tags.all()]
+    return page, encode_file_cursor(page[-1]) if has_more else None
@@ -0,0 +1,254 @@
+"""
+Resumable chunked uploads following the core tus 1.0 protocol.
+
+A client creates an :class:`~uploads.models.UploadSession` with the total
+length, then PATCHes byte ranges at the offset the server reports. Bytes are
+streamed from the request in fixed-size blocks and appended to a partial file
+inside the client's media bucket, so memory stays constant per upload however
+large the file is. SHA-256 is updated block by block; the running digest is
+kept per process and rebuilt from the partial file if a PATCH lands on a
+worker that has not seen the upload. When the last byte arrives the partial
+file is renamed into place and the ``File`` row is created. Uploads left
+untouched for ``RESUMABLE_UPLOAD_EXPIRE_AFTER`` seconds are removed, partial
+file included, by a periodic sweep.
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import fcntl
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.files import File as DjangoFile
+from django.db import transaction
+from django.http import UnreadablePostError
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from contexts.models import Category
+
+from .models import File, UploadSession
+
+
+TUS_VERSION = "1.0.0"
+TUS_EXTENSIONS = "creation,termination"
+DEFAULT_MAX_UPLOAD_SIZE = 5 * 1024 ** 3
+DEFAULT_UPLOAD_EXPIRE_AFTER = 24 * 60 * 60
+READ_SIZE = 64 * 1024
+MAX_TRACKED_HASHERS = 256
+
+
+class UploadError(Exception):
+    """A protocol violation; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def max_upload_size() -> int:
+    return int(getattr(settings, "RESUMABLE_UPLOAD_MAX_SIZE", DEFAULT_MAX_UPLOAD_SIZE))
+
+
+def parse_metadata(header: str) -> Dict[str, str]:
+    """Decode an ``Upload-Metadata`` header: comma-separated ``key base64value`` pairs."""
+    metadata = {}
+    for pair in filter(None, (item.strip() for item in (header or "").split(","))):
+        key, _, encoded = pair.partition(" ")
+        try:
+            metadata[key] = base64.b64decode(encoded.strip(), validate=True).decode("utf-8") if encoded else ""
+        except (binascii.Error, UnicodeDecodeError):
+            raise UploadError(f"Invalid Upload-Metadata value for {key!r}.")
+    return metadata
+
+
+class _Hashers:
+    """Running SHA-256 per upload, keyed by session id and valid only at the recorded offset."""
+
+    def __init__(self, max_entries: int = MAX_TRACKED_HASHERS):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[int, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, session: UploadSession):
+        with self._lock:
+            offset, hasher = self._entries.pop(session.pk.hex, (None, None))
+        if offset == session.offset:
+            return hasher
+        # Another worker took the earlier PATCHes, or this one restarted: replay the stored bytes.
+        hasher = hashlib.sha256()
+        with open(session.partial_path, "rb") as handle:
+            remaining = session.offset
+            while remaining:
+                block = handle.read(min(READ_SIZE, remaining))
+                if not block:
+                    raise UploadError("Partial upload is shorter than its recorded offset.", status=409)
+                hasher.update(block)
+                remaining -= len(block)
+        return hasher
+
+    def put(self, session: UploadSession, hasher) -> None:
+        with self._lock:
+            self._entries[session.pk.hex] = (session.offset, hasher)
+            self._entries.move_to_end(session.pk.hex)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, session: UploadSession) -> None:
+        with self._lock:
+            self._entries.pop(session.pk.hex, None)
+
+
+_hashers = _Hashers()
+
+
+def create_session(client, user, length: Optional[str], metadata: Dict[str, str]) -> UploadSession:
+    try:
+        length = int(length)
+    except (TypeError, ValueError):
+        raise UploadError("Upload-Length is required.")
+    if length < 0:
+        raise UploadError("Upload-Length must not be negative.")
+    if length > max_upload_size():
+        raise UploadError("Upload exceeds the maximum size.", status=413)
+    filename = get_valid_filename(Path(metadata.get("filename", "")).name) if metadata.get("filename") else ""
+    if not filename:
+        raise UploadError("Upload-Metadata must include a filename.")
+    category_id = metadata.get("category", "")
+    category = Category.objects.filter(pk=category_id).first() if category_id.isdigit() else None
+    if category is None:
+        raise UploadError("Upload-Metadata must include a valid category.")
+    session = UploadSession.objects.create(
+        client=client,
+        user=user,
+        filename=filename,
+        content_type=metadata.get("filetype") or metadata.get("content_type", ""),
+        category=category,
+        tags=metadata.get("tags", ""),
+        length=length,
+    )
+    session.partial_path.touch()
+    if not length:
+        _finalize(session, hashlib.sha256().hexdigest())
+    return session
+
+
+def _read_block(stream: BinaryIO, size: int) -> bytes:
+    try:
+        return stream.read(size)
+    except (OSError, UnreadablePostError):
+        # The client went away mid-request; keep what arrived.
+        return b""
+
+
+def _claim_partial(handle) -> None:
+    # One writer per upload at a time; a concurrent PATCH is told to re-check the offset.
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        raise UploadError("Another request is writing to this upload.", status=409)
+
+
+def append(session: UploadSession, stream: BinaryIO, offset: Optional[str]) -> UploadSession:
+    """
+    Write the request body at ``offset`` and advance the session by the bytes received. A dropped
+    connection keeps whatever arrived, so the client resumes from there. No database lock or
+    transaction is held while the body streams: writers are serialized by a lock on the partial
+    file, and the new offset is only recorded if the stored one still matches.
+    """
+    if session.complete:
+        raise UploadError("Upload is already complete.", status=409)
+    if offset is None or not offset.isdigit() or int(offset) != session.offset:
+        raise UploadError("Upload-Offset does not match the current offset.", status=409)
+    written = 0
+    try:
+        handle = open(session.partial_path, "r+b")
+    except FileNotFoundError:
+        raise UploadError("Upload was terminated.", status=404)
+    with handle:
+        _claim_partial(handle)
+        # The row may have moved on between loading it and taking the file lock.
+        if not UploadSession.objects.filter(pk=session.pk, offset=session.offset, file__isnull=True).exists():
+            raise UploadError("Upload-Offset does not match the current offset.", status=409)
+        hasher = _hashers.take(session)
+        remaining = session.length - session.offset
+        # Bytes past the recorded offset belong to a write that never committed.
+        handle.seek(session.offset)
+        handle.truncate()
+        while remaining:
+            block = _read_block(stream, min(READ_SIZE, remaining))
+            if not block:
+                break
+            handle.write(block)
+            hasher.update(block)
+            written += len(block)
+            remaining -= len(block)
+        handle.flush()
+        with transaction.atomic():
+            advanced = UploadSession.objects.filter(pk=session.pk, offset=session.offset, file__isnull=True).update(
+                offset=session.offset + written, updated_at=timezone.now()
+            )
+            if not advanced:
+                raise UploadError("Upload was changed or terminated while this request was writing.", status=409)
+            session.offset += written
+            if session.offset == session.length:
+                _finalize(session, hasher.hexdigest())
+    if not session.complete:
+        _hashers.put(session, hasher)
+    return session
+
+
+class _PartialFile(DjangoFile):
+    # FileSystemStorage moves files that expose a temporary path instead of copying them.
+    def temporary_file_path(self) -> str:
+        return self.file.name
+
+
+def _finalize(session: UploadSession, digest: str) -> File:
+    _hashers.discard(session)
+    with open(session.partial_path, "rb") as handle:
+        partial = _PartialFile(handle, name=session.filename)
+        # Content-addressed storage reuses the streamed digest instead of hashing again.
+        partial.sha256 = digest
+        record = File(
+            client=session.client,
+            file=partial,
+            size=session.length,
+            content_type=session.content_type,
+            category=session.category,
+            sha256=digest,
+        )
+        record.save()
+    if session.tag_list:
+        record.tags.add(*session.tag_list)
+    session.file = record
+    session.save(update_fields=["file", "updated_at"])
+    return record
+
+
+def terminate(session: UploadSession) -> None:
+    _hashers.discard(session)
+    if not session.complete:
+        session.partial_path.unlink(missing_ok=True)
+    session.delete()
+
+
+def expire_sessions() -> int:
+    """
+    Terminate uploads untouched for ``RESUMABLE_UPLOAD_EXPIRE_AFTER`` seconds, removing the partial
+    files of those never finished. Returns the number of sessions removed.
+    """
+    cutoff = timezone.now() - timedelta(seconds=int(getattr(settings, "RESUMABLE_UPLOAD_EXPIRE_AFTER", DEFAULT_UPLOAD_EXPIRE_AFTER)))
+    expired = 0
+    # A PATCH still streaming into an expired upload fails its conditional offset update with a 409.
+    for session in UploadSession.objects.filter(updated_at__lt=cutoff).select_related("client").iterator():
+        terminate(session)
+        expired += 1
+    return expired
@@ -0,0 +1,47 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from taggit.models import Tag, TaggedItem
+
+from .models import File, sync_tag_slugs
+
+
+@receiver(post_delete, sender=File)
+def release_stored_file(sender, instance: File, **kwargs):
+    # Content-addressed storage drops a blob reference per deleted name; the blob goes with the last one.
+    if not instance.file:
+        return
+    name, storage = instance.file.name, instance.file.storage
+
+    def release():
+        if not File.objects.filter(file=name).exists():
+            storage.delete(name)
+
+    transaction.on_commit(release)
+
+
+def _tagged_file_ids(tag: Tag):
+    return list(TaggedItem.objects.filter(tag=tag, content_type=ContentType.objects.get_for_model(File)).values_list("object_id", flat=True))
+
+
+@receiver(m2m_changed, sender=TaggedItem)
+def sync_file_tag_slugs(sender, instance, action: str, **kwargs):
+    if isinstance(instance, File) and action in ("post_add", "post_remove", "post_clear"):
+        sync_tag_slugs([instance.pk])
+
+
+@receiver(post_save, sender=Tag)
+def sync_renamed_tag(sender, instance: Tag, created: bool, **kwargs):
+    if not created:
+        sync_tag_slugs(_tagged_file_ids(instance))
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_tagged_files(sender, instance: Tag, **kwargs):
+    instance._tagged_file_ids = _tagged_file_ids(instance)
+
+
+@receiver(post_delete, sender=Tag)
+def sync_deleted_tag(sender, instance: Tag, **kwargs):
+    sync_tag_slugs(getattr(instance, "_tagged_file_ids", []))
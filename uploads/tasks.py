@@ -0,0 +1,286 @@
+"""
+Bulk archive imports.
+
+Extraction streams the archive member by member (see :mod:`uploads.archive`),
+stores each one and bulk-creates ``File`` rows, tags and ``ArchiveMember``
+records every ``batch_size`` members. After each batch it starts ingest lanes:
+at most ``concurrency`` Huey tasks per import, each claiming a batch of stored
+members at a time and running chunk-and-embed on them, so a large archive
+neither floods the queue nor waits for extraction to finish before embedding
+starts. Per-member failures are recorded on the member and never stop the import.
+Members and lanes abandoned by a dead worker are reclaimed by a periodic sweep.
+"""
+
+from __future__ import annotations
+
+import mimetypes
+import shutil
+import uuid
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, List
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from huey import crontab
+from huey.contrib.djhuey import db_periodic_task, task
+from taggit.models import Tag, TaggedItem
+
+from contexts.tasks import chunk_and_embed_file
+from domains.storage import client_partial_upload_path
+
+from .archive import ArchiveError, classify, iter_members, rule_categories, store_member
+from .models import ArchiveImport, ArchiveMember, File
+from .resumable import expire_sessions, max_upload_size
+
+
+DEFAULT_IMPORT_BATCH_SIZE = 100
+DEFAULT_IMPORT_CONCURRENCY = 4
+DEFAULT_IMPORT_STALE_AFTER = 30 * 60
+MAX_REPORTED_ERRORS = 100
+
+
+def start_archive_import(client, user, archive, *, rules: List[dict], default_category=None) -> ArchiveImport:
+    """Spool the uploaded ``archive`` into the client's bucket and queue its extraction."""
+    rule_categories(rules)
+    target = client_partial_upload_path(client) / f"import-{uuid.uuid4().hex}"
+    if hasattr(archive, "temporary_file_path"):
+        shutil.move(archive.temporary_file_path(), target)
+    else:
+        with open(target, "wb") as handle:
+            for block in archive.chunks():
+                handle.write(block)
+    job = ArchiveImport.objects.create(
+        client=client,
+        user=user,
+        archive_name=Path(archive.name).name,
+        archive_path=str(target),
+        default_category=default_category,
+        rules=rules,
+        batch_size=max(int(getattr(settings, "ARCHIVE_IMPORT_BATCH_SIZE", DEFAULT_IMPORT_BATCH_SIZE)), 1),
+        concurrency=max(int(getattr(settings, "ARCHIVE_IMPORT_CONCURRENCY", DEFAULT_IMPORT_CONCURRENCY)), 1),
+    )
+    transaction.on_commit(lambda: extract_archive_task(job.pk))
+    return job
+
+
+def _resolve_tags(names: List[str], cache: Dict[str, Tag]) -> List[Tag]:
+    for name in names:
+        if name not in cache:
+            cache[name] = Tag.objects.get_or_create(name=name)[0]
+    return [cache[name] for name in names]
+
+
+def _flush(job: ArchiveImport, members: List[ArchiveMember], tags: Dict[int, List[Tag]]) -> None:
+    """Create the batch's File rows, tagged items and member records in one transaction."""
+    with transaction.atomic():
+        stored = [member for member in members if member.file is not None]
+        File.objects.bulk_create([member.file for member in stored], batch_size=job.batch_size)
+        content_type = ContentType.objects.get_for_model(File)
+        TaggedItem.objects.bulk_create(
+            [TaggedItem(tag=tag, content_type=content_type, object_id=member.file.pk) for member in stored for tag in tags.get(id(member), ())],
+            batch_size=job.batch_size,
+        )
+        ArchiveMember.objects.bulk_create(members, batch_size=job.batch_size)
+        ArchiveImport.objects.filter(pk=job.pk).update(updated_at=timezone.now())
+
+
+def _extract_archive(job: ArchiveImport, path) -> int:
+    """Stream every member of ``path`` into ``job``'s client; returns the number of members seen."""
+    categories = rule_categories(job.rules)
+    limit = max_upload_size()
+    tag_cache: Dict[str, Tag] = {}
+    members: List[ArchiveMember] = []
+    member_tags: Dict[int, List[Tag]] = {}
+    seen = 0
+    job.client.provision_storage()
+    try:
+        for entry in iter_members(path):
+            seen += 1
+            member = ArchiveMember(job=job, name=entry.name[:1024], size=entry.size)
+            slug, tag_names = classify(entry.name, job.rules)
+            category = categories[slug] if slug else job.default_category
+            try:
+                if category is None:
+                    raise ArchiveError("No import rule assigns a category and the import has no default category.")
+                if entry.size > limit:
+                    raise ArchiveError("Member exceeds the maximum upload size.")
+                name, size, digest = store_member(job.client, entry)
+                tags = _resolve_tags(tag_names, tag_cache)
+            except Exception as exc:
+                member.status = "failed"
+                member.error = str(exc)
+            else:
+                member.size = size
+                member.file = File(
+                    client=job.client,
+                    file=name,
+                    size=size,
+                    content_type=mimetypes.guess_type(entry.name)[0] or "",
+                    sha256=digest,
+                    category=category,
+                    tag_slugs=sorted({tag.slug for tag in tags}),
+                )
+                member_tags[id(member)] = tags
+            members.append(member)
+            if len(members) >= job.batch_size:
+                _flush(job, members, member_tags)
+                members, member_tags = [], {}
+                _start_lanes(job)
+        if members:
+            _flush(job, members, member_tags)
+    except Exception as exc:
+        # Members of the unflushed batch are already in storage; record them so they are still
+        # ingested, or release their blobs if even that fails, so none are left unreferenced.
+        try:
+            if members:
+                _flush(job, members, member_tags)
+        except Exception:
+            for member in members:
+                if member.file is not None:
+                    default_storage.delete(member.file.file.name)
+        ArchiveImport.objects.filter(pk=job.pk).update(status="failed", error=str(exc), updated_at=timezone.now())
+        _start_lanes(job)
+        raise
+    ArchiveImport.objects.filter(pk=job.pk, status="extracting").update(status="ingesting", updated_at=timezone.now())
+    _start_lanes(job)
+    _finish_import(job.pk)
+    return seen
+
+
+def _claimable(job_id: int):
+    return ArchiveMember.objects.filter(job_id=job_id, status="stored")
+
+
+def _acquire_lane(job: ArchiveImport) -> bool:
+    return bool(ArchiveImport.objects.filter(pk=job.pk, active_lanes__lt=F("concurrency")).update(active_lanes=F("active_lanes") + 1))
+
+
+def _start_lanes(job: ArchiveImport) -> int:
+    """Start enough ingest lanes for the waiting members, never more than ``concurrency`` at once."""
+    waiting = _claimable(job.pk).count()
+    started = 0
+    while started * job.batch_size < waiting and _acquire_lane(job):
+        ingest_archive_lane_task(job.pk)
+        started += 1
+    return started
+
+
+def _claim_batch(job: ArchiveImport) -> list:
+    with transaction.atomic():
+        # SKIP LOCKED lets concurrent lanes claim disjoint batches without waiting on each other.
+        rows = list(_claimable(job.pk).select_for_update(skip_locked=True).values_list("id", "file_id")[: job.batch_size])
+        ArchiveMember.objects.filter(pk__in=[member_id for member_id, _ in rows]).update(status="ingesting", updated_at=timezone.now())
+    return rows
+
+
+def _release_lane(job: ArchiveImport) -> None:
+    # Greatest() keeps the counter valid if a reclaim already reset it under a lane that was only slow.
+    ArchiveImport.objects.filter(pk=job.pk).update(active_lanes=Greatest(F("active_lanes") - 1, 0), updated_at=timezone.now())
+
+
+def _ingest_lane(job_id: int) -> int:
+    """Chunk and embed claimed batches until none are left; the caller holds one of the job's lanes."""
+    job = ArchiveImport.objects.get(pk=job_id)
+    processed = 0
+    while True:
+        try:
+            for batch in iter(lambda: _claim_batch(job), []):
+                for member_id, file_id in batch:
+                    try:
+                        chunk_and_embed_file(file_id)
+                    except Exception as exc:
+                        ArchiveMember.objects.filter(pk=member_id).update(status="failed", error=str(exc), updated_at=timezone.now())
+                    else:
+                        # Per member, so updated_at doubles as the lane's heartbeat for reclaim.
+                        ArchiveMember.objects.filter(pk=member_id).update(status="ingested", updated_at=timezone.now())
+                    processed += 1
+                ArchiveImport.objects.filter(pk=job.pk).update(updated_at=timezone.now())
+        finally:
+            _release_lane(job)
+        # A batch flushed after the last claim found no free lane; pick it up rather than strand it.
+        if not _claimable(job.pk).exists() or not _acquire_lane(job):
+            break
+    _finish_import(job.pk)
+    return processed
+
+
+def _stale_after() -> timedelta:
+    return timedelta(seconds=int(getattr(settings, "ARCHIVE_IMPORT_STALE_AFTER", DEFAULT_IMPORT_STALE_AFTER)))
+
+
+def _reclaim_stalled(job_id: int) -> int:
+    """
+    Recover from workers that died mid-import. Members left ``ingesting`` without a heartbeat for
+    ``ARCHIVE_IMPORT_STALE_AFTER`` go back to ``stored``; when the import itself has been silent
+    that long, its lane counter is reset and a stalled extraction is marked failed. Returns the
+    number of members reclaimed.
+    """
+    now = timezone.now()
+    cutoff = now - _stale_after()
+    reclaimed = ArchiveMember.objects.filter(job_id=job_id, status="ingesting", updated_at__lt=cutoff).update(status="stored", updated_at=now)
+    ArchiveImport.objects.filter(pk=job_id, status="extracting", updated_at__lt=cutoff).update(
+        status="failed", error="Extraction stopped without finishing.", updated_at=now
+    )
+    silent = ArchiveImport.objects.filter(pk=job_id, updated_at__lt=cutoff, active_lanes__gt=0).update(active_lanes=0, updated_at=now)
+    if reclaimed or silent:
+        job = ArchiveImport.objects.get(pk=job_id)
+        _start_lanes(job)
+        _finish_import(job.pk)
+    return reclaimed
+
+
+def _finish_import(job_id: int) -> None:
+    if ArchiveMember.objects.filter(job_id=job_id, status__in=("stored", "ingesting")).exists():
+        return
+    now = timezone.now()
+    ArchiveImport.objects.filter(pk=job_id, status="ingesting", active_lanes=0).update(status="ready", completed_at=now, updated_at=now)
+
+
+def import_progress(job_id: int, *, errors: int = MAX_REPORTED_ERRORS) -> Dict[str, object]:
+    """Snapshot of an archive import: member counts by status and the first per-member errors."""
+    job = ArchiveImport.objects.get(pk=job_id)
+    counts = dict(job.members.order_by().values_list("status").annotate(count=Count("id")))
+    return {
+        "import_id": job.pk,
+        "archive": job.archive_name,
+        "status": job.status,
+        "error": job.error,
+        "members": sum(counts.values()),
+        "stored": counts.get("stored", 0),
+        "ingesting": counts.get("ingesting", 0),
+        "ingested": counts.get("ingested", 0),
+        "failed": counts.get("failed", 0),
+        "errors": [{"member": name, "error": error} for name, error in job.members.filter(status="failed").values_list("name", "error")[:errors]],
+    }
+
+
+@task()
+def extract_archive_task(job_id: int):
+    job = ArchiveImport.objects.select_related("client", "default_category").get(pk=job_id)
+    try:
+        return _extract_archive(job, job.archive_path)
+    finally:
+        Path(job.archive_path).unlink(missing_ok=True)
+        ArchiveImport.objects.filter(pk=job.pk).update(archive_path="")
+
+
+@task()
+def ingest_archive_lane_task(job_id: int):
+    return _ingest_lane(job_id)
+
+
+@db_periodic_task(crontab(minute="*/5"))
+def reclaim_stalled_imports_task():
+    unfinished = ArchiveImport.objects.filter(Q(status__in=("extracting", "ingesting")) | Q(members__status="ingesting")).distinct()
+    return sum(_reclaim_stalled(job_id) for job_id in unfinished.values_list("pk", flat=True))
+
+
+@db_periodic_task(crontab(minute="17"))
+def expire_resumable_uploads_task():
+    return expire_sessions()
@@ -2,5 +2,10 @@ from django.urls import path
 from . import views
 urlpatterns = [
     path("manager/", views.file_manager, name="file_manager"),
+    path("manager/rows/", views.file_manager_rows, name="file_manager_rows"),
     path("upload/", views.upload, name="upload"),
+    path("resumable/", views.resumable_uploads, name="resumable_uploads"),
+    path("resumable/<uuid:upload_id>/", views.resumable_upload, name="resumable_upload"),
+    path("imports/", views.archive_imports, name="archive_imports"),
+    path("imports/<int:import_id>/", views.archive_import_progress, name="archive_import_progress"),
 ]
@@ -1,11 +1,17 @@
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponseForbidden
-from django.shortcuts import redirect, render
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotAllowed, JsonResponse
+from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
 
 from contexts.models import Category
 from rbac.models import primary_client_for_user, user_has_permission
-from .models import File
+from .archive import ArchiveError, parse_rules
+from .models import ArchiveImport, File, UploadSession
+from .query import InvalidCursor, file_page
+from .resumable import TUS_EXTENSIONS, TUS_VERSION, UploadError, append, create_session, max_upload_size, parse_metadata, terminate
+from .tasks import import_progress, start_archive_import
 
 
 @login_required
@@ -13,10 +19,22 @@ def file_manager(request):
     client = primary_client_for_user(request.user)
     if not client:
         return HttpResponseForbidden()
-    files = list(File.objects.filter(client=client).prefetch_related("tags", "category"))
-    for document in files:
-        document.tag_list = list(document.tags.names())
-    return render(request, "uploads/file_manager.html", {"files": files})
+    files, next_cursor = file_page(client)
+    return render(request, "uploads/file_manager.html", {"files": files, "next_cursor": next_cursor})
+
+
+@login_required
+def file_manager_rows(request):
+    """HTMX partial: the page of rows after ``?cursor=``, ending in a sentinel that loads the next one."""
+    client = primary_client_for_user(request.user)
+    if not client:
+        return HttpResponseForbidden()
+    try:
+        files, next_cursor = file_page(client, request.GET.get("cursor"))
+    except InvalidCursor:
+        # Falling back to page one would append rows the page already shows.
+        return HttpResponseBadRequest("Invalid cursor.")
+    return render(request, "uploads/partials/file_rows.html", {"files": files, "next_cursor": next_cursor})
 
 
 @login_required
@@ -49,3 +67,101 @@ def upload(request):
         messages.error(request, "Please choose both a file and category.")
 
     return render(request, "uploads/upload.html", {"categories": categories})
+
+
+def _upload_client(request):
+    client = primary_client_for_user(request.user)
+    if not client or not user_has_permission(request.user, client, "file.upload"):
+        return None
+    return client
+
+
+def _tus_response(status: int = 204, headers=None, content: str = "") -> HttpResponse:
+    response = HttpResponse(content, status=status, content_type="text/plain")
+    response["Tus-Resumable"] = TUS_VERSION
+    for name, value in (headers or {}).items():
+        response[name] = str(value)
+    return response
+
+
+@login_required
+def resumable_uploads(request):
+    """tus creation endpoint: ``POST`` with ``Upload-Length`` and ``Upload-Metadata`` opens an upload."""
+    client = _upload_client(request)
+    if client is None:
+        return HttpResponseForbidden()
+    if request.method == "OPTIONS":
+        return _tus_response(204, {"Tus-Version": TUS_VERSION, "Tus-Extension": TUS_EXTENSIONS, "Tus-Max-Size": max_upload_size()})
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST", "OPTIONS"])
+    try:
+        metadata = parse_metadata(request.headers.get("Upload-Metadata", ""))
+        session = create_session(client, request.user, request.headers.get("Upload-Length"), metadata)
+    except UploadError as exc:
+        return _tus_response(exc.status, content=str(exc))
+    return _tus_response(201, {"Location": reverse("resumable_upload", args=[session.pk]), "Upload-Offset": session.offset})
+
+
+@login_required
+def resumable_upload(request, upload_id):
+    """``HEAD`` reports the offset to resume from, ``PATCH`` appends bytes at it, ``DELETE`` abandons the upload."""
+    client = _upload_client(request)
+    if client is None:
+        return HttpResponseForbidden()
+    if request.method == "HEAD":
+        session = get_object_or_404(UploadSession, pk=upload_id, client=client)
+        return _tus_response(200, {"Upload-Offset": session.offset, "Upload-Length": session.length, "Cache-Control": "no-store"})
+    if request.method == "PATCH":
+        if request.content_type != "application/offset+octet-stream":
+            return _tus_response(415, content="Content-Type must be application/offset+octet-stream.")
+        # The body is streamed, never buffered, and no transaction stays open while it arrives.
+        session = get_object_or_404(UploadSession.objects.select_related("client"), pk=upload_id, client=client)
+        try:
+            append(session, request, request.headers.get("Upload-Offset"))
+        except UploadError as exc:
+            return _tus_response(exc.status, content=str(exc))
+        return _tus_response(204, {"Upload-Offset": session.offset})
+    if request.method == "DELETE":
+        with transaction.atomic():
+            terminate(get_object_or_404(UploadSession.objects.select_for_update(), pk=upload_id, client=client))
+        return _tus_response(204)
+    return HttpResponseNotAllowed(["HEAD", "PATCH", "DELETE"])
+
+
+@login_required
+def archive_imports(request):
+    """Bulk import: ``POST`` a ZIP or tar archive with category/tag rules; lists the client's recent imports."""
+    client = _upload_client(request)
+    if client is None:
+        return HttpResponseForbidden()
+    categories = Category.objects.all().order_by("name")
+
+    if request.method == "POST":
+        archive = request.FILES.get("archive")
+        category_id = request.POST.get("category", "")
+        default_category = Category.objects.filter(pk=category_id).first() if category_id.isdigit() else None
+        try:
+            rules = parse_rules(request.POST.get("rules", "").splitlines())
+            if not archive:
+                raise ArchiveError("Please choose an archive.")
+            if default_category is None and not rules:
+                raise ArchiveError("Choose a default category or add category rules.")
+            job = start_archive_import(client, request.user, archive, rules=rules, default_category=default_category)
+        except ArchiveError as exc:
+            messages.error(request, str(exc))
+        else:
+            messages.success(request, f"Importing {job.archive_name}; documents appear in the file manager as they are stored.")
+            return redirect("archive_imports")
+
+    imports = ArchiveImport.objects.filter(client=client)[:20]
+    return render(request, "uploads/archive_imports.html", {"categories": categories, "imports": imports})
+
+
+@login_required
+def archive_import_progress(request, import_id):
+    """JSON progress of an import, including per-member errors; safe to poll while it runs."""
+    client = _upload_client(request)
+    if client is None:
+        return HttpResponseForbidden()
+    job = get_object_or_404(ArchiveImport, pk=import_id, client=client)
+    return JsonResponse(import_progress(job.pk))